@@ -3,28 +3,59 @@
 import os
 import re
 import json
+import mimetypes
+import base64
+import hashlib
+import hmac
+import html
+import heapq
+import itertools
+import math
+import multiprocessing
 import random
 import unicodedata
-import requests
 import click
-from datetime import datetime
-from functools import wraps
+import time
+import threading
+import uuid
+import weakref
+import zlib
+import zipfile
+import tempfile
+import sqlite3
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache, wraps
 
 # --- IMPORTS ---
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, render_template, session, redirect, url_for, stream_with_context, g, has_app_context, has_request_context, send_from_directory, make_response
 from dotenv import load_dotenv
-from groq import Groq
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool, Pool, QueuePool
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash, safe_join
 
 # --- INITIALIZATION ---
+# create_app() at the end of this file builds the Flask app; routes, hooks and CLI commands are
+# registered on `bp`. Importing this module stays cheap: the Groq SDK and requests are imported
+# on first use, no database connection is opened until one is needed, and the schema is set up
+# by `flask db-upgrade` (or once in the gunicorn master, see gunicorn.conf.py), never by a request.
 load_dotenv()
-app = Flask(__name__, static_folder='static', template_folder='templates')
-CORS(app, supports_credentials=True)
-app.secret_key = os.environ.get("FLASK_SECRET_KEY")
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
+bp = Blueprint('main', __name__, cli_group=None)
+db = SQLAlchemy()
 
-@app.before_request
+@bp.before_app_request
 def force_password_each_request():
     # endpoints that must be reachable without being auto-logged-out
     whitelist = {
@@ -33,34 +64,465 @@ def force_password_each_request():
         'api_signup',        # /api/signup
         'index',             # / (so redirect after login works)
         'static',            # static files (css/js/img)
+        'audio_track',       # /audio/<track> - meditation audio
         'check_auth',        # any endpoints that front-end uses to check auth
-        'force_init_db'      # Database reset utility
     }
 
     # allow any /api/* route: function names in your file start with "api_"
     if request.endpoint is None:
         return
-    if request.endpoint in whitelist:
+    endpoint = request.endpoint.rpartition('.')[2]  # without the blueprint name
+    if endpoint in whitelist:
         return
-    if request.endpoint.startswith('api_'):
+    if endpoint.startswith('api_'):
         return
 
     # otherwise clear site-password auth
     session.pop('authenticated', None)
 
 
+# --- METRICS ---
+# Served at /metrics in the Prometheus text format. Under gunicorn, set PROMETHEUS_MULTIPROC_DIR
+# (see gunicorn.conf.py) so that scraping any worker reports the totals across all of them.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # when set, /metrics requires "Authorization: Bearer <token>"
+DB_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+LLM_BUCKETS = (.1, .25, .5, 1, 2, 4, 8, 15, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+REQUEST_LATENCY = Histogram('bigsister_http_request_duration_seconds',
+                            'Time to build the response (to the first line for streamed responses)',
+                            ['endpoint', 'method', 'status'])
+DB_QUERIES_PER_REQUEST = Histogram('bigsister_db_queries_per_request', 'SQL statements executed per request',
+                                   ['endpoint'], buckets=COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram('bigsister_db_query_seconds_per_request', 'Time spent in SQL per request',
+                                ['endpoint'], buckets=DB_BUCKETS)
+DB_QUERY_DURATION = Histogram('bigsister_db_query_duration_seconds', 'Duration of each SQL statement', buckets=DB_BUCKETS)
+DB_POOL_WAIT = Histogram('bigsister_db_pool_wait_seconds', 'Time spent waiting for a pooled connection', buckets=DB_BUCKETS)
+DB_POOL_CHECKED_OUT = Gauge('bigsister_db_pool_checked_out', 'Pooled connections currently checked out',
+                            multiprocess_mode='livesum')
+LLM_LATENCY = Histogram('bigsister_llm_call_duration_seconds', 'Model call duration, including retries and fallback',
+                        ['call_type', 'model'], buckets=LLM_BUCKETS)
+LLM_TOKENS = Counter('bigsister_llm_tokens', 'Tokens reported by the model API', ['call_type', 'model', 'kind'])
+LLM_ERRORS = Counter('bigsister_llm_errors', 'Failed model call attempts', ['call_type', 'model', 'kind'])
+LLM_IN_FLIGHT = Gauge('bigsister_llm_calls_in_flight', 'Model calls in progress', ['call_type'],
+                      multiprocess_mode='livesum')
+RATE_LIMITED = Counter('bigsister_rate_limited', 'Requests refused by a per-user rate limit', ['endpoint', 'limit'])
+PIN_HASH_DURATION = Histogram('bigsister_pin_hash_duration_seconds', 'PIN hashing time, including the wait for a pool slot',
+                              ['op'], buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+PIN_HASH_REFUSED = Counter('bigsister_pin_hash_refused', 'PIN hashes refused because the hashing pool stayed full')
+
+@bp.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.db_queries, g.db_query_seconds = 0, 0.0
+
+@bp.after_app_request
+def record_request_metrics(response):
+    if 'request_started' in g:
+        endpoint = (request.endpoint or 'unmatched').rpartition('.')[2]
+        REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(time.perf_counter() - g.request_started)
+        DB_QUERIES_PER_REQUEST.labels(endpoint).observe(g.db_queries)
+        DB_TIME_PER_REQUEST.labels(endpoint).observe(g.db_query_seconds)
+    return response
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_started
+    DB_QUERY_DURATION.observe(elapsed)
+    if has_app_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_query_seconds += elapsed
+
+@event.listens_for(Pool, 'checkout')
+def count_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_POOL_CHECKED_OUT.inc()
+
+@event.listens_for(Pool, 'checkin')
+def count_pool_checkin(dbapi_connection, connection_record):
+    DB_POOL_CHECKED_OUT.dec()
+
 # --- DATABASE CONFIGURATION ---
 DATABASE_URL = os.environ.get("DATABASE_URL")
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL or 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'database.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+DEFAULT_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'database.db')
+
+# Pool sizing; checkout wait is recorded per request and reported in the Server-Timing header
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_WAIT_WARN_MS = float(os.environ.get("DB_POOL_WAIT_WARN_MS", 100))
+
+class TimedCheckoutMixin:
+    """Times how long each checkout waits for a pooled connection."""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            record_pool_wait((time.perf_counter() - start) * 1000)
+
+class TimedQueuePool(TimedCheckoutMixin, QueuePool): pass
+class TimedNullPool(TimedCheckoutMixin, NullPool): pass
+
+def record_pool_wait(wait_ms):
+    DB_POOL_WAIT.observe(wait_ms / 1000)
+    if has_app_context():
+        g.db_pool_wait_ms = g.get('db_pool_wait_ms', 0.0) + wait_ms
+    if wait_ms >= DB_POOL_WAIT_WARN_MS:
+        print(f"DB pool checkout waited {wait_ms:.1f} ms (pool_size={DB_POOL_SIZE}, max_overflow={DB_MAX_OVERFLOW})")
+
+def engine_options(database_uri):
+    if database_uri.startswith('sqlite'):
+        return {}
+    if os.environ.get("DB_PGBOUNCER", "").lower() in ("1", "true", "yes"):
+        # PgBouncer in transaction mode does the pooling; keep no connections of our own
+        return {"poolclass": TimedNullPool}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": True,
+    }
+
+created_apps = weakref.WeakSet()  # every app create_app() has built; see dispose_inherited_engines
+
+def dispose_inherited_engines():
+    """Drops connections pooled before a fork without closing them; they belong to the parent."""
+    for app in list(created_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+# Safe to preload: a process forked after the parent used the database (gunicorn --preload,
+# schema setup in the master) starts with an empty pool instead of sharing the parent's sockets.
+os.register_at_fork(after_in_child=dispose_inherited_engines)
+
+@bp.after_app_request
+def report_pool_wait(response):
+    if 'db_pool_wait_ms' in g:
+        response.headers.add('Server-Timing', f"db-wait;dur={g.db_pool_wait_ms:.1f}")
+    return response
+
+# --- STATIC ASSETS ---
+# scripts/build_assets.py writes content-hashed, resized and precompressed copies of the static
+# files to static/dist/ with a manifest. Without a build, the source files are served as before.
+ASSET_MANIFEST_PATH = os.path.join(STATIC_FOLDER, 'dist', 'manifest.json')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+RESPONSIVE_FALLBACK_WIDTH = 640
+
+def load_asset_manifest():
+    try:
+        with open(ASSET_MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}, "images": {}, "audio": {}}
+
+ASSET_MANIFEST = load_asset_manifest()
+
+@bp.app_url_defaults
+def hashed_static_url(endpoint, values):
+    """Points url_for('static', filename=...) at the content-hashed build of the file."""
+    if endpoint == 'static' and values.get('filename') in ASSET_MANIFEST['files']:
+        values['filename'] = ASSET_MANIFEST['files'][values['filename']]
+
+def responsive_image(filename):
+    """src plus per-format srcset strings for a static image; just src when it was not built."""
+    image = {"src": url_for('static', filename=filename)}
+    entry = ASSET_MANIFEST['images'].get(filename)
+    if not entry:
+        return image
+    image.update(width=entry['width'], height=entry['height'])
+    for fmt in ('avif', 'webp'):
+        if entry.get(fmt):
+            image[fmt] = ", ".join(f"{url_for('static', filename=path)} {width}w" for width, path in entry[fmt])
+    if entry.get('webp'):
+        # Every browser that renders this app decodes WebP, so the fallback need not be the PNG
+        fallback = [path for width, path in entry['webp'] if width <= RESPONSIVE_FALLBACK_WIDTH] or [entry['webp'][0][1]]
+        image['src'] = url_for('static', filename=fallback[-1])
+    return image
+
+@bp.app_context_processor
+def inject_responsive_images():
+    return {"responsive_images": lambda: {name: responsive_image(name) for name in ASSET_MANIFEST['images']}}
+
+def precompressed_siblings(filename):
+    """(encoding, filename) for each .br/.gz copy written next to a built file, best first."""
+    siblings = []
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        path = safe_join(current_app.static_folder, filename + suffix)
+        if path and os.path.isfile(path):
+            siblings.append((encoding, filename + suffix))
+    return siblings
+
+def serve_static(filename):
+    """Static files. Built files are immutable and sent precompressed when the client accepts it."""
+    if not filename.startswith('dist/'):
+        return current_app.send_static_file(filename)
+    siblings = precompressed_siblings(filename)
+    accepted = [(encoding, name) for encoding, name in siblings if request.accept_encodings[encoding]]
+    if accepted:
+        encoding, name = accepted[0]
+        response = send_from_directory(current_app.static_folder, name, mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(current_app.static_folder, filename)
+    if siblings:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+# Audio tracks come in a low and a standard bitrate (see AUDIO_LADDER in scripts/build_assets.py).
+# The player asks for one explicitly; other clients get one picked from network client hints.
+AUDIO_FOLDER = os.path.join(STATIC_FOLDER, 'audio')
+AUDIO_QUALITIES = ('low', 'standard')
+AUDIO_CLIENT_HINTS = ('Save-Data', 'ECT', 'Downlink')
+AUDIO_LOW_ECT = {'slow-2g', '2g', '3g'}
+AUDIO_LOW_DOWNLINK_MBPS = float(os.environ.get("AUDIO_LOW_DOWNLINK_MBPS", 1.5))
+AUDIO_MAX_AGE = int(os.environ.get("AUDIO_MAX_AGE", 86400))
+
+def audio_quality_from_hints(headers):
+    if headers.get('Save-Data', '').strip().lower() == 'on':
+        return 'low'
+    if headers.get('ECT', '').strip().lower() in AUDIO_LOW_ECT:
+        return 'low'
+    try:
+        if float(headers.get('Downlink', 'inf')) < AUDIO_LOW_DOWNLINK_MBPS:
+            return 'low'
+    except ValueError:
+        pass
+    return 'standard'
+
+
+# --- LLM CLIENT ---
+# Every model call goes through `llm`: one pooled Groq client per process, a timeout and retry
+# budget per call type, a circuit breaker per model, and a smaller fallback model for the call
+# types that can live with one. Set GROQ_BASE_URL to scripts/fake_groq.py to exercise it locally.
+LLM_MODEL = os.environ.get("LLM_MODEL", "openai/gpt-oss-120b")
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "openai/gpt-oss-20b")  # empty disables fallback
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", 20))
+LLM_RETRY_BASE_SECONDS = float(os.environ.get("LLM_RETRY_BASE_SECONDS", 0.25))
+LLM_RETRY_MAX_SECONDS = float(os.environ.get("LLM_RETRY_MAX_SECONDS", 2.0))
+LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", 5))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", 30))
+
+def llm_call_type(name, timeout, retries, fallback):
+    """Per-call-type policy; LLM_TIMEOUT_<NAME> and LLM_RETRIES_<NAME> override the defaults."""
+    return {"timeout": float(os.environ.get(f"LLM_TIMEOUT_{name.upper()}", timeout)),
+            "retries": int(os.environ.get(f"LLM_RETRIES_{name.upper()}", retries)),
+            "fallback": fallback}
+
+# Completions have no upstream side effects, so any call type may be retried. Chat replies get
+# no retries by default: the user is already waiting and a retry after a timeout doubles the tail.
+LLM_CALL_TYPES = {
+    "chat": llm_call_type("chat", 30, 0, False),
+    "greeting": llm_call_type("greeting", 10, 1, True),
+    "summary": llm_call_type("summary", 30, 2, False),
+    "moderation": llm_call_type("moderation", 20, 2, True),
+}
+
+class LLMError(Exception):
+    """A model call failed after its retries and, where allowed, the fallback model."""
+
+class LLMUnavailable(LLMError):
+    """Every model the call may use has an open circuit breaker."""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# The Groq SDK is imported on first use (it is the slowest import in the app); by the time
+# one of its errors needs classifying, LLMClient.client has already imported it.
+def is_transient(error):
+    """Timeouts, connection failures, 429s and 5xx are worth retrying and count against the breaker."""
+    import groq
+    if isinstance(error, (groq.APIConnectionError, groq.RateLimitError)):
+        return True
+    return isinstance(error, groq.APIStatusError) and error.status_code >= 500
+
+def llm_error_kind(error):
+    import groq
+    if isinstance(error, groq.APITimeoutError): return "timeout"
+    if isinstance(error, groq.APIConnectionError): return "connection"
+    if isinstance(error, groq.RateLimitError): return "rate_limit"
+    if isinstance(error, groq.APIStatusError): return "server" if error.status_code >= 500 else "client"
+    return "other"
+
+def record_llm_usage(call_type, model, usage):
+    if usage:
+        LLM_TOKENS.labels(call_type, model, "prompt").inc(usage.prompt_tokens or 0)
+        LLM_TOKENS.labels(call_type, model, "completion").inc(usage.completion_tokens or 0)
+        if has_request_context() and 'rate_limit' in g:  # set by @rate_limited
+            charge_model_tokens(*g.rate_limit, (usage.prompt_tokens or 0) + (usage.completion_tokens or 0))
+
+def retry_delay(error, attempt):
+    """Full-jitter exponential backoff, or the server's Retry-After when it asks for a short wait."""
+    import groq
+    if isinstance(error, groq.APIStatusError):
+        try:
+            requested = float(error.response.headers.get("retry-after", ""))
+            if requested <= LLM_RETRY_MAX_SECONDS:
+                return requested
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive transient failures and fails fast for `cooldown`
+    seconds, then lets one trial call through; its outcome closes or re-opens the circuit."""
+    def __init__(self, threshold, cooldown):
+        self.threshold, self.cooldown = threshold, cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if self.retry_after() > 0 else "half-open"
+
+    def allow(self):
+        """False to fail fast; otherwise True, or "trial" for the one call a half-open circuit lets through,
+        whose caller must call end_trial() however the call ends."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.retry_after() > 0 or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return "trial"
+
+    def end_trial(self):
+        # A no-op after record_success/record_failure; otherwise the trial was interrupted
+        # (a gevent Timeout, GreenletExit) and the next call may try again
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures, self.opened_at, self.trial_in_flight = 0, None, False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+class LLMClient:
+    def __init__(self):
+        self._client, self._pid = None, None
+        self.breakers = {}
+
+    @property
+    def client(self):
+        """The pooled Groq client, created on first use in each process so forked workers never share sockets."""
+        if self._pid != os.getpid():
+            import httpx
+            from groq import Groq, DefaultHttpxClient
+            # Retries are ours (per call type), so the SDK's own are disabled
+            self._client = Groq(
+                api_key=os.environ.get("GROQ_API_KEY"), max_retries=0,
+                http_client=DefaultHttpxClient(limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE)))
+            self._pid = os.getpid()
+        return self._client
+
+    def breaker(self, model):
+        return self.breakers.setdefault(model, CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN))
+
+    def models_for(self, call_type):
+        models = [LLM_MODEL]
+        if LLM_CALL_TYPES[call_type]["fallback"] and LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != LLM_MODEL:
+            models.append(LLM_FALLBACK_MODEL)
+        return models
+
+    def call(self, call_type, send):
+        """Runs send(model, timeout) under the call type's retry, breaker and fallback policy.
+
+        Returns (model, result) for the model that answered.
+        """
+        policy = LLM_CALL_TYPES[call_type]
+        models = self.models_for(call_type)
+        last_error, waits = None, []
+        for model in models:
+            breaker = self.breaker(model)
+            for attempt in range(policy["retries"] + 1):
+                admitted = breaker.allow()
+                if not admitted:
+                    LLM_ERRORS.labels(call_type, model, "circuit_open").inc()
+                    waits.append(breaker.retry_after())
+                    break
+                try:
+                    result = send(model, policy["timeout"])
+                except Exception as e:
+                    LLM_ERRORS.labels(call_type, model, llm_error_kind(e)).inc()
+                    if not is_transient(e):
+                        breaker.record_success()  # Groq answered; the request itself was bad
+                        raise LLMError(f"{call_type} call to {model} failed: {e}") from e
+                    breaker.record_failure()
+                    last_error = e
+                else:
+                    breaker.record_success()
+                    return model, result
+                finally:
+                    if admitted == "trial": breaker.end_trial()
+                if attempt < policy["retries"]:
+                    time.sleep(retry_delay(last_error, attempt))
+        if last_error is None:
+            raise LLMUnavailable(f"{call_type} call skipped: circuit open for {', '.join(models)}",
+                                 retry_after=max(1, int(min(waits) + 0.999)))
+        raise LLMError(f"{call_type} call failed: {last_error}") from last_error
+
+    def complete(self, call_type, messages, **kwargs):
+        """Returns the reply text of a non-streaming completion."""
+        started, model = time.perf_counter(), LLM_MODEL
+        with LLM_IN_FLIGHT.labels(call_type).track_inprogress():
+            try:
+                model, completion = self.call(call_type, lambda model, timeout: self.client.chat.completions.create(
+                    messages=messages, model=model, timeout=timeout, **kwargs))
+            finally:
+                LLM_LATENCY.labels(call_type, model).observe(time.perf_counter() - started)
+        record_llm_usage(call_type, model, completion.usage)
+        return completion.choices[0].message.content
+
+    def stream(self, call_type, messages, **kwargs):
+        """Yields content deltas. Retries and fallback apply until the first chunk has arrived."""
+        def open_stream(model, timeout):
+            chunks = iter(self.client.chat.completions.create(
+                messages=messages, model=model, stream=True, timeout=timeout, **kwargs))
+            first = next(chunks, None)
+            return itertools.chain([first] if first is not None else [], chunks)
+
+        started, model = time.perf_counter(), LLM_MODEL
+        LLM_IN_FLIGHT.labels(call_type).inc()
+        try:
+            model, chunks = self.call(call_type, open_stream)
+            for chunk in chunks:
+                # Groq reports usage on the last chunk, under x_groq
+                record_llm_usage(call_type, model, getattr(getattr(chunk, "x_groq", None), "usage", None))
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            LLM_IN_FLIGHT.labels(call_type).dec()
+            LLM_LATENCY.labels(call_type, model).observe(time.perf_counter() - started)
+
+llm = LLMClient()
 
 # --- GROQ & PROMPTS ---
-try:
-    client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-except Exception as e: client = None
 
 SYSTEM_PROMPT = """You are "BigSister," an empathetic AI listener for teens. Your persona is warm, caring, and understanding, like a cool older sister who is always there to listen without judgment. You are NOT a therapist or a doctor. You NEVER give medical advice. Your goal is to make the user feel heard, validated, and less alone. You are so heartwarming.
 
@@ -215,21 +677,27 @@ class User(db.Model):
         cascade="all, delete-orphan"
     )
 
+    # Both hash in the PIN HASHING pool and may raise PinHashingBusy
     def set_pin(self, pin):
-        self.pin_hash = generate_password_hash(str(pin))
+        self.pin_hash = hash_pin(pin)
 
     def check_pin(self, pin):
-        return check_password_hash(self.pin_hash, str(pin))
+        return verify_pin(self.pin_hash, pin)
 
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
+    __table_args__ = (db.Index('ix_chat_sessions_user_start', 'user_id', 'start_time', 'id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     
+    # Rolling summary of the turns that have slid out of the prompt window
+    summary = db.Column(db.Text, nullable=True)
+    summarized_through_id = db.Column(db.Integer, nullable=True)
+    
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     messages = db.relationship(
         'ChatMessage',
@@ -241,6 +709,10 @@ class ChatSession(db.Model):
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        db.Index('ix_chat_messages_session_ts', 'session_id', 'timestamp', 'id'),  # transcript pages
+        db.Index('ix_chat_messages_session_id', 'session_id', 'id'),  # context window after the summary
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     role = db.Column(db.String(20), nullable=False)
@@ -252,6 +724,11 @@ class ChatMessage(db.Model):
 
 class JournalEntry(db.Model):
     __tablename__ = 'journal_entries'
+    __table_args__ = (
+        db.Index('ix_journal_entries_user_ts', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_journal_entries_located', 'lat', 'lng', 'mood',
+                 sqlite_where=db.text('lat IS NOT NULL'), postgresql_where=db.text('lat IS NOT NULL')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -269,8 +746,46 @@ class JournalEntry(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
 
+class JournalTerm(db.Model):
+    __tablename__ = 'journal_terms'
+    __table_args__ = (db.Index('ix_journal_terms_user_feature', 'user_id', 'feature'),)
+
+    # One nonzero component of an entry's hashed term vector; see JOURNAL RETRIEVAL
+    entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), primary_key=True)
+    feature = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    weight = db.Column(db.Float, nullable=False)
+
+
+class HeatmapCell(db.Model):
+    __tablename__ = 'heatmap_cells'
+    __table_args__ = (db.UniqueConstraint('level', 'cell_x', 'cell_y', 'mood', name='uq_heatmap_cell'),)
+    
+    # Per-mood journal counts on a lat/lng grid of 360 / 2**level degrees; see HEATMAP_LEVELS
+    id = db.Column(db.Integer, primary_key=True)
+    level = db.Column(db.Integer, nullable=False)
+    cell_x = db.Column(db.Integer, nullable=False)
+    cell_y = db.Column(db.Integer, nullable=False)
+    mood = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MoodRollup(db.Model):
+    __tablename__ = 'mood_rollups'
+    __table_args__ = (db.UniqueConstraint('user_id', 'period', 'period_start', 'mood', name='uq_mood_rollup'),)
+
+    # Per-user journal counts by mood for each UTC day and ISO week (period_start is the Monday)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    period = db.Column(db.String(4), nullable=False)  # one of MOOD_TREND_PERIODS
+    period_start = db.Column(db.Date, nullable=False)
+    mood = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class CommunityMessage(db.Model):
     __tablename__ = 'community_messages'
+    __table_args__ = (db.Index('ix_community_messages_status_ts', 'status', 'timestamp', 'id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     submitted_by_username = db.Column(db.String(80), nullable=False, unique=True)
@@ -278,6 +793,69 @@ class CommunityMessage(db.Model):
     status = db.Column(db.String(20), nullable=False, default='pending')
     reason = db.Column(db.Text, nullable=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Lease held by the moderation worker while a pending message is with the model
+    claimed_by = db.Column(db.String(32), nullable=True)
+    claimed_until = db.Column(db.DateTime, nullable=True)
+
+
+class ModerationVerdict(db.Model):
+    __tablename__ = 'moderation_verdicts'
+    
+    # sha256 of the normalized message text, so near-identical submissions share a verdict
+    text_hash = db.Column(db.String(64), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)
+    reason = db.Column(db.Text, nullable=True)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    
+    version = db.Column(db.String(80), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# --- SCHEMA MIGRATIONS ---
+# db.create_all() only creates missing tables. Changes to existing tables go here as
+# ordered, idempotent steps; each runs once and is recorded in schema_migrations.
+# Apply with `flask db-upgrade`; gunicorn.conf.py's on_starting (SCHEMA_ON_START) and
+# `python app.py` run it too. create_app() never touches the schema.
+def add_columns(table, columns):
+    existing = {c['name'] for c in db.inspect(db.engine).get_columns(table)}
+    with db.engine.begin() as conn:
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+def create_model_indexes():
+    """Creates every index declared in the models' __table_args__ that doesn't exist yet."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+MIGRATIONS = [
+    ("0001_chat_session_summary", lambda: add_columns('chat_sessions', {'summary': 'TEXT', 'summarized_through_id': 'INTEGER'})),
+    ("0002_moderation_claims", lambda: add_columns('community_messages', {'claimed_by': 'VARCHAR(32)', 'claimed_until': 'TIMESTAMP'})),
+    ("0003_heatmap_backfill", lambda: rebuild_heatmap()),
+    ("0004_hot_path_indexes", create_model_indexes),
+    ("0005_journal_search", lambda: create_journal_search_index()),
+    ("0006_mood_rollup_backfill", lambda: rebuild_mood_rollups()),
+    ("0007_journal_retrieval_index", lambda: rebuild_journal_index()),
+]
+
+def ensure_schema():
+    """Creates missing tables, then applies any migrations not yet recorded. Returns the versions applied."""
+    db.create_all()
+    applied = {m.version for m in SchemaMigration.query.all()}
+    newly_applied = []
+    for version, migrate in MIGRATIONS:
+        if version in applied: continue
+        migrate()
+        db.session.add(SchemaMigration(version=version))
+        db.session.commit()
+        newly_applied.append(version)
+    return newly_applied
 
 
 # --- DECORATORS ---
@@ -285,7 +863,7 @@ def site_password_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'authenticated' not in session:
-            return redirect(url_for('login_site'))
+            return redirect(url_for('main.login_site'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -296,110 +874,1449 @@ def user_login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def get_coordinates(place_name):
-    """Converts a city name (e.g. 'Edmonton') into Lat/Lng coordinates."""
-    if not place_name: return None, None
+def current_user():
+    """The logged-in User, loaded at most once per request; None when logged out or the account is gone."""
+    if 'user' not in g:
+        g.user = db.session.get(User, session['user_id']) if 'user_id' in session else None
+    return g.user
+
+# --- RATE LIMITING ---
+# Per-user token buckets in front of the endpoints that call the model: for each user and
+# endpoint, one bucket of requests and one of model tokens. The buckets live in a small SQLite
+# file every process on the host opens (not the app database), so the limits hold across
+# gunicorn workers with no external service; a check is one short write transaction.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB") or os.path.join(  # one file per app database
+    tempfile.gettempdir(), f"bigsister-ratelimit-{hashlib.sha1((DATABASE_URL or DEFAULT_DATABASE_URI).encode()).hexdigest()[:12]}.db")
+
+def parse_rate(value):
+    """'20/60' (20 per 60 seconds) as (capacity, refill per second); '', '0' or a count of 0 means no limit."""
+    if not value or value == "0": return None
+    count, _, seconds = value.partition('/')
+    count, seconds = float(count), float(seconds or 1)
+    if count == 0: return None
+    if not (count > 0 and seconds > 0):
+        raise ValueError(f"Rate limit {value!r} must be <count>/<seconds> with both positive")
+    return count, count / seconds
+
+def rate_limit(name, requests, tokens):
+    """Per-endpoint limits; RATE_LIMIT_<NAME>_REQUESTS and RATE_LIMIT_<NAME>_TOKENS override the defaults."""
+    return {"requests": parse_rate(os.environ.get(f"RATE_LIMIT_{name.upper()}_REQUESTS", requests)),
+            "tokens": parse_rate(os.environ.get(f"RATE_LIMIT_{name.upper()}_TOKENS", tokens))}
+
+# Each limit allows a burst of `count`, refilling evenly over the period. Model tokens are charged
+# after each call (prompt + completion, as reported by the API), so a request is admitted while
+# its token bucket is not empty and a long reply can leave the bucket in debt for the next one.
+RATE_LIMITS = {
+    "chat": rate_limit("chat", "20/60", "200000/3600"),
+    "session": rate_limit("session", "10/600", "50000/3600"),
+    "community_message": rate_limit("community_message", "5/600", "2000/3600"),
+}
+
+class BucketStore:
+    """Token buckets in a SQLite file shared by every process that opens it."""
+    def __init__(self, path):
+        self.path = path
+        self._conn, self._pid = None, None
+        self.lock = threading.Lock()
+
+    def connection(self):
+        """One connection per process, opened after any fork; callers hold self.lock."""
+        if self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def take(self, draws):
+        """Takes from several buckets atomically: from all of them or from none.
+
+        Each draw is (key, capacity, refill per second, cost, minimum). A bucket is first refilled
+        for the time since it was last touched; its cost is taken if the level is at least the
+        minimum (pass -inf to always take, which may leave it negative). Returns (0.0, None) when
+        everything was taken, else (seconds until it would be, index of the draw that refused).
+        """
+        now = time.time()
+        with self.lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = {key: (level, updated) for key, level, updated in conn.execute(
+                    f"SELECT key, level, updated FROM buckets WHERE key IN ({','.join('?' * len(draws))})", [d[0] for d in draws])}
+                wait, refused, updates = 0.0, None, []
+                for index, (key, capacity, rate, cost, minimum) in enumerate(draws):
+                    level, updated = state.get(key, (capacity, now))
+                    level = min(capacity, level + max(0.0, now - updated) * rate)
+                    if level < minimum and (minimum - level) / rate > wait:
+                        wait, refused = (minimum - level) / rate, index
+                    updates.append((key, level - cost, now))
+                if refused is None:
+                    conn.executemany("INSERT INTO buckets (key, level, updated) VALUES (?, ?, ?) ON CONFLICT (key) "
+                                     "DO UPDATE SET level = excluded.level, updated = excluded.updated", updates)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait, refused
+
+rate_buckets = BucketStore(RATE_LIMIT_DB)
+
+def check_rate_limit(name, user_id):
+    """Takes one request from the user's buckets for endpoint `name`.
+
+    Returns (0.0, None) when admitted, else (seconds to wait, "requests" or "tokens").
+    """
+    if not RATE_LIMIT_ENABLED: return 0.0, None
+    limits = RATE_LIMITS[name]
+    kinds = [kind for kind in ("requests", "tokens") if limits[kind]]
+    if not kinds: return 0.0, None
+    try:
+        wait, refused = rate_buckets.take([(f"{name}:{kind}:{user_id}", *limits[kind], 1 if kind == "requests" else 0, 1)
+                                           for kind in kinds])
+    except sqlite3.Error as e:  # a broken limiter must not take the endpoints down with it
+        print(f"Rate limit check failed, allowing the request: {e}")
+        return 0.0, None
+    return (0.0, None) if refused is None else (wait, kinds[refused])
+
+def charge_model_tokens(name, user_id, tokens):
+    """Debits model tokens from the user's token bucket for endpoint `name`."""
+    limit = RATE_LIMITS[name]["tokens"]
+    if not RATE_LIMIT_ENABLED or not limit or not tokens: return
+    try:
+        rate_buckets.take([(f"{name}:tokens:{user_id}", *limit, tokens, float('-inf'))])
+    except sqlite3.Error as e:
+        print(f"Rate limit charge failed: {e}")
+
+def rate_limited(name, methods=('POST',)):
+    """Applies RATE_LIMITS[name] to the logged-in user's `methods` requests; goes under @user_login_required.
+
+    Model usage reported while the request (or its stream) runs is charged to the same limit.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method in methods:
+                wait, kind = check_rate_limit(name, session['user_id'])
+                if wait:
+                    RATE_LIMITED.labels(name, kind).inc()
+                    retry_after = max(1, math.ceil(wait))
+                    return jsonify({"error": f"You're going a little fast. Please try again in {retry_after} seconds.",
+                                    "limit": kind, "retry_after": retry_after}), 429, {"Retry-After": str(retry_after)}
+                g.rate_limit = (name, session['user_id'])
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# --- PIN HASHING ---
+# PIN hashes are slow on purpose (scrypt by default), so they run in a small pool of spawned
+# processes instead of on the request's thread, where a burst of logins (a class signing in at
+# once) would starve every other request the worker is serving. Each app process queues or runs
+# at most PIN_HASH_QUEUE hashes; past that a request waits up to PIN_HASH_WAIT seconds for a
+# slot and then gets a 503. Hashes made with other parameters are replaced at the next login.
+PIN_HASH_METHOD = os.environ.get("PIN_HASH_METHOD", "scrypt:32768:8:1")  # werkzeug's syntax: scrypt:n:r:p or pbkdf2:sha256:<iterations>
+PIN_HASH_WORKERS = int(os.environ.get("PIN_HASH_WORKERS", 1))  # per app process; 0 hashes on the request thread
+PIN_HASH_QUEUE = int(os.environ.get("PIN_HASH_QUEUE", 16))
+PIN_HASH_WAIT = float(os.environ.get("PIN_HASH_WAIT", 5))
+
+class PinHashingBusy(Exception):
+    """No PIN hashing slot came free within PIN_HASH_WAIT seconds."""
+    retry_after = 1
+
+pin_hash_pool, pin_hash_lock, pin_hash_slots = None, threading.Lock(), threading.BoundedSemaphore(PIN_HASH_QUEUE)
+
+def reset_pin_hasher():
+    # A forked child can't use its parent's pool: the threads that feed it were not copied
+    global pin_hash_pool, pin_hash_lock, pin_hash_slots
+    pin_hash_pool, pin_hash_lock, pin_hash_slots = None, threading.Lock(), threading.BoundedSemaphore(PIN_HASH_QUEUE)
+
+os.register_at_fork(after_in_child=reset_pin_hasher)
+
+def pin_hasher():
+    global pin_hash_pool
+    with pin_hash_lock:
+        if pin_hash_pool is None:
+            # Spawned rather than forked: a copy of a threaded (or gevent-patched) app worker is not safe to run
+            pin_hash_pool = ProcessPoolExecutor(PIN_HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return pin_hash_pool
+
+def run_pin_hash(op, fn, *args):
+    """fn(*args) in the hashing pool; fn must be importable on its own (the werkzeug functions are)."""
+    global pin_hash_pool
+    started, slots = time.perf_counter(), pin_hash_slots
+    if not slots.acquire(timeout=PIN_HASH_WAIT):
+        PIN_HASH_REFUSED.inc()
+        raise PinHashingBusy("Lots of people are signing in right now. Please try again in a moment.")
     try:
-        # We use OpenStreetMap's Nominatim API (free, requires User-Agent)
-        headers = {'User-Agent': 'BigSisterApp/1.0'}
-        url = "https://nominatim.openstreetmap.org/search"
-        response = requests.get(url, params={'q': place_name, 'format': 'json', 'limit': 1}, headers=headers, timeout=5)
-        data = response.json()
-        if data:
-            return float(data[0]['lat']), float(data[0]['lon'])
+        if PIN_HASH_WORKERS <= 0: return fn(*args)
+        pool = pin_hasher()
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:  # a hashing process died (e.g. OOM-killed): start a new pool next time
+            with pin_hash_lock:
+                if pin_hash_pool is pool: pin_hash_pool = None
+            return fn(*args)
+    finally:
+        slots.release()
+        PIN_HASH_DURATION.labels(op).observe(time.perf_counter() - started)
+
+def hash_pin(pin):
+    return run_pin_hash('hash', generate_password_hash, str(pin), PIN_HASH_METHOD)
+
+def verify_pin(pin_hash, pin):
+    return run_pin_hash('verify', check_password_hash, pin_hash, str(pin))
+
+def pin_hash_prefix():
+    """PIN_HASH_METHOD as werkzeug spells it at the start of a hash (e.g. "pbkdf2" -> "pbkdf2:sha256:1000000"),
+    with werkzeug's defaults filled in the same way, so no hash has to be computed to find it."""
+    method, *args = PIN_HASH_METHOD.split(':')
+    if method == 'scrypt' and len(args) in (0, 3):
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if method == 'pbkdf2' and len(args) <= 2:
+        return f"pbkdf2:{(args or ['sha256'])[0]}:{int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS}"
+    raise ValueError(f"Unsupported PIN_HASH_METHOD {PIN_HASH_METHOD!r}")
+
+pin_hash_prefix()  # a bad PIN_HASH_METHOD fails at startup, not at the first signup
+
+def pin_needs_rehash(pin_hash):
+    return pin_hash.split('$', 1)[0] != pin_hash_prefix()
+
+@bp.errorhandler(PinHashingBusy)
+def pin_hashing_busy(e):
+    return jsonify({"error": str(e), "retry_after": e.retry_after}), 503, {"Retry-After": str(e.retry_after)}
+
+# --- PAGINATION ---
+# List endpoints page with an opaque keyset cursor over (timestamp, id): each page is one
+# index range scan, however deep the user has scrolled.
+PAGE_SIZE_DEFAULT = 20
+PAGE_SIZE_MAX = 100
+JOURNAL_SNIPPET_CHARS = 120
+
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def keyset_page(query, timestamp_col, id_col):
+    """Returns (rows, next_cursor) for the newest-first page after ?cursor=, of ?limit= rows.
+
+    Raises ValueError for a malformed cursor.
+    """
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE_DEFAULT, type=int), PAGE_SIZE_MAX))
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            timestamp, row_id = decode_cursor(cursor)
+        except Exception:
+            raise ValueError("Invalid cursor.")
+        query = query.filter(db.or_(timestamp_col < timestamp, db.and_(timestamp_col == timestamp, id_col < row_id)))
+    rows = query.order_by(timestamp_col.desc(), id_col.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
+
+def ndjson(obj):
+    """Serializes one event of a newline-delimited JSON stream."""
+    return json.dumps(obj) + "\n"
+
+def ndjson_response(generator):
+    """Wraps an NDJSON generator so proxies relay each line as soon as it is yielded."""
+    return Response(
+        stream_with_context(generator),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def save_assistant_message(session_id, content):
+    """Stores an assistant reply in its own short transaction."""
+    db.session.add(ChatMessage(role='assistant', content=content, session_id=session_id))
+    db.session.commit()
+
+def stream_assistant_reply(session_id, messages, fallback=None, call_type="chat", **kwargs):
+    """Relays a completion as {"delta"} lines, then stores the finished reply on the session.
+
+    If the model call fails before anything was sent, `fallback` is streamed in its place
+    (or an {"error"} line when there is no fallback). A client that disconnects mid-stream
+    still gets whatever was generated so far saved.
+    """
+    parts = []
+    try:
+        for delta in llm.stream(call_type, messages, **kwargs):
+            parts.append(delta)
+            yield ndjson({"delta": delta})
+    except GeneratorExit:
+        if parts: save_assistant_message(session_id, "".join(parts))
+        raise
     except Exception as e:
-        print(f"Geocoding error: {e}")
-    return None, None
+        if parts or fallback is None:
+            yield ndjson({"error": f"API Error: {str(e)}"})
+            return
+        parts.append(fallback)
+        yield ndjson({"delta": fallback})
+
+    save_assistant_message(session_id, "".join(parts))
+    yield ndjson({"done": True})
+
+# --- CHAT CONTEXT WINDOW ---
+# Only the newest turns are sent verbatim; older ones are folded into ChatSession.summary.
+# The window grows up to CHAT_HISTORY_MAX_MESSAGES and is then folded back down to
+# CHAT_HISTORY_KEEP_MESSAGES, so the summary is refreshed once every few turns, not every turn.
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", 20))
+CHAT_HISTORY_KEEP_MESSAGES = int(os.environ.get("CHAT_HISTORY_KEEP_MESSAGES", CHAT_HISTORY_MAX_MESSAGES // 2))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", 3000))
+
+SUMMARY_PROMPT = """You maintain a private running summary of a supportive conversation between a teen and BigSister.
+Update the existing summary with the new messages. Keep what matters for continuing the conversation warmly:
+feelings shared, important people and events, what helped, and anything BigSister promised to follow up on.
+Write at most 150 words in the third person. Output only the summary."""
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token plus per-message overhead)."""
+    return len(text or "") // 4 + 4
+
+def load_chat_context(chat_session):
+    """Returns the prompt history for a session and the turns that are due to be folded.
+
+    Reads only messages newer than the summary, newest first, so the cost stays flat
+    however long the session gets. Turns are always folded oldest first, straight after the
+    summary: a session with a longer unsummarized backlog (e.g. one from before summaries)
+    is folded one batch per refresh rather than skipping the turns between.
+    """
+    through_id = chat_session.summarized_through_id or 0
+    limit = CHAT_HISTORY_MAX_MESSAGES * 2
+    unsummarized = (ChatMessage.query
+                    .with_entities(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+                    .filter(ChatMessage.session_id == chat_session.id, ChatMessage.id > through_id))
+    rows = unsummarized.order_by(ChatMessage.id.desc()).limit(limit).all()
+
+    budget = CHAT_HISTORY_TOKEN_BUDGET - estimate_tokens(chat_session.summary)
+    window, used = [], 0
+    for row in rows:
+        used += estimate_tokens(row.content)
+        if len(window) >= CHAT_HISTORY_MAX_MESSAGES or (window and used > budget):
+            break
+        window.append(row)
+
+    # Fold once the window is full, keeping only the newest few turns verbatim
+    fold = []
+    if len(window) < len(rows):
+        fold = rows[min(CHAT_HISTORY_KEEP_MESSAGES, len(window)):][::-1]
+        if len(rows) == limit:  # there may be older unsummarized turns than these
+            fold = unsummarized.filter(ChatMessage.id <= fold[-1].id).order_by(ChatMessage.id).limit(limit).all()
+
+    history = []
+    if chat_session.summary:
+        history.append({"role": "system", "content": f"Summary of the earlier conversation: {chat_session.summary}"})
+    history += [{"role": r.role, "content": r.content} for r in reversed(window)]
+    return history, [{"id": r.id, "role": r.role, "content": r.content} for r in fold]
+
+def refresh_session_summary(app, session_id, summary, through_id, fold):
+    """Folds turns that slid out of the window into the session summary (runs off the request thread)."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in fold)
+    with app.app_context():
+        try:
+            new_summary = llm.complete(
+                "summary",
+                [{"role": "system", "content": SUMMARY_PROMPT},
+                 {"role": "user", "content": f"Existing summary: {summary or '(none)'}\n\nNew messages:\n{transcript}"}],
+                temperature=0.2)
+            # Only advance if no concurrent refresh got there first
+            ChatSession.query.filter(
+                ChatSession.id == session_id,
+                ChatSession.summarized_through_id.is_(None) if through_id is None else ChatSession.summarized_through_id == through_id
+            ).update({"summary": new_summary, "summarized_through_id": fold[-1]["id"]}, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Summary refresh failed for session {session_id}: {e}")
+        finally:
+            db.session.remove()
+
+def schedule_summary_refresh(chat_session, fold):
+    if fold:
+        threading.Thread(
+            target=refresh_session_summary,
+            args=(current_app._get_current_object(), chat_session.id, chat_session.summary, chat_session.summarized_through_id, fold),
+            daemon=True
+        ).start()
+
+# --- COMMUNITY MODERATION ---
+# Rules from SYSTEM_PROMPT_MODERATOR that can be decided locally are checked here first;
+# only messages that pass them (and have no cached verdict) are sent to the model.
+MODERATION_MAX_CHARS = int(os.environ.get("MODERATION_MAX_CHARS", 140))
+MODERATION_MAX_WORDS = int(os.environ.get("MODERATION_MAX_WORDS", 20))
+
+def normalize_for_moderation(text):
+    """Folds case, accents, spaced-out letters ("d i h") and stretched letters ("soooo") into plain words."""
+    text = unicodedata.normalize('NFKC', text).casefold().replace('$', 's')
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    tokens = [re.sub(r"[^a-z]+", "", t) for t in text.split()]
+    words, letters = [], []
+    for token in filter(None, tokens):
+        if len(token) == 1:
+            letters.append(token)
+            continue
+        if letters: words.append(''.join(letters)); letters = []
+        words.append(token)
+    if letters: words.append(''.join(letters))
+    return ' '.join(re.sub(r'(.)\1+', r'\1', w) for w in words)
+
+def compile_terms(terms):
+    normalized = sorted({normalize_for_moderation(t) for t in terms}, key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(map(re.escape, normalized)) + r')s?\b')
+
+MODERATION_TERM_RULES = [
+    ("Contains crisis or self-harm language.", compile_terms([
+        "suicide", "suicidal", "kill myself", "kms", "end it", "end my life", "hopeless", "self harm",
+        "cutting", "want to die", "wanna die", "die", "dying", "overdose"])),
+    ("Contains negative emotion words.", compile_terms([
+        "sad", "anxious", "anxiety", "depressed", "depression", "hurting", "hurt", "scared", "awful",
+        "terrible", "lonely", "cry", "crying", "pain", "struggle", "struggling", "stressed", "stress",
+        "worried", "afraid", "fear", "miserable", "upset", "broken", "bad"])),
+    ("Describes a personal problem.", compile_terms(["i feel", "i felt", "i was", "im feeling"])),
+    ("Contains advice.", compile_terms(["you should", "you need to", "you must", "you have to", "try to", "dont forget to"])),
+    ("Contains profanity.", compile_terms([
+        "fuck", "fck", "fk", "shit", "damn", "dang", "hell", "crap", "piss", "bitch", "bastard", "dick",
+        "cock", "asshole", "dumbass", "jackass", "slut", "whore", "wtf", "stfu", "omfg", "frick", "heck", "cunt"])),
+    ("Contains a banned word or inappropriate tone.", compile_terms([
+        "dih", "luv", "baby", "babe", "bae", "yummy", "thicc", "hot", "sexy", "mwah", "uwu", "owo",
+        "silly goose", "scrunkly", "delulu", "rizz", "sus"])),
+]
+
+PERSONAL_INFO_PATTERN = re.compile(r'\d|@|https?:|www\.|\b[\w-]+\.(?:com|net|org|io|gg|ly|me|co|app|xyz|tv|ca|uk)\b', re.IGNORECASE)
+FORMATTING_PATTERN = re.compile(r'[*_#<>{}\[\]`~|\\^=+]|\n|[:;]-?[()pd]\B', re.IGNORECASE)
+
+def prefilter_message(text):
+    """Applies the moderator's deterministic rules. Returns ("rejected", reason) or None if the model must decide."""
+    if len(text) > MODERATION_MAX_CHARS or len(text.split()) > MODERATION_MAX_WORDS:
+        return "rejected", "Message is too long. Keep it short and simple."
+    if PERSONAL_INFO_PATTERN.search(text):
+        return "rejected", "Contains personal information, numbers, or links."
+    if any(unicodedata.category(c) in ('So', 'Sk', 'Cs', 'Co') or c in '\u200d\ufe0f' for c in text) or FORMATTING_PATTERN.search(text):
+        return "rejected", "Contains emojis or special formatting. Only simple text is allowed."
+    stripped = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    if any(c.isalpha() and not ('a' <= c.lower() <= 'z') for c in stripped):
+        return "rejected", "Only English messages are allowed."
+    normalized = normalize_for_moderation(text)
+    for reason, pattern in MODERATION_TERM_RULES:
+        if pattern.search(normalized):
+            return "rejected", reason
+    return None
+
+def moderation_cache_key(text):
+    return hashlib.sha256(normalize_for_moderation(text).encode()).hexdigest()
+
+def cached_verdict(text):
+    """Returns a verdict the rules or the cache can give right away, or None if the model must decide."""
+    verdict = prefilter_message(text)
+    if verdict: return verdict
+    cached = db.session.get(ModerationVerdict, moderation_cache_key(text))
+    if cached: return cached.status, cached.reason
+    return None
+
+# --- MODERATION QUEUE ---
+# Submissions the rules and cache can't decide are stored as 'pending' and moderated in
+# batches by a background worker: one model call per MODERATION_BATCH_SIZE messages.
+# Each batch is claimed with a lease (claimed_by/claimed_until), so the in-process thread
+# of every gunicorn worker and the `flask moderate-queue` command can all drain safely.
+MODERATION_WORKER = os.environ.get("MODERATION_WORKER", "thread")  # "thread" or "external"
+MODERATION_BATCH_SIZE = int(os.environ.get("MODERATION_BATCH_SIZE", 20))
+MODERATION_BATCH_WINDOW = float(os.environ.get("MODERATION_BATCH_WINDOW", 2.0))
+MODERATION_POLL_SECONDS = float(os.environ.get("MODERATION_POLL_SECONDS", 30.0))
+MODERATION_LEASE_SECONDS = int(os.environ.get("MODERATION_LEASE_SECONDS", 120))
+MODERATION_MAX_BACKOFF = float(os.environ.get("MODERATION_MAX_BACKOFF", 300.0))
+
+BATCH_MODERATION_INSTRUCTIONS = """
+BATCH MODE: The user message is a JSON array of submissions, each {"id": <number>, "text": "<message>"}.
+Judge every submission independently with the rules above. Output a JSON object of the form
+{"verdicts": [{"id": <number>, "decision": "APPROVE" or "REJECT", "reason": "Explanation for the decision"}]}
+with exactly one verdict for every id.
+"""
+
+moderation_wakeup = threading.Event()
+moderation_worker_pid = None
+
+def claim_pending_batch(token):
+    """Leases up to MODERATION_BATCH_SIZE pending messages to this worker and returns them."""
+    now = datetime.utcnow()
+    table = CommunityMessage.__table__
+    candidates = (db.select(table.c.id)
+                  .where(table.c.status == 'pending',
+                         db.or_(table.c.claimed_until.is_(None), table.c.claimed_until < now))
+                  .order_by(table.c.timestamp)
+                  .limit(MODERATION_BATCH_SIZE)
+                  .scalar_subquery())
+    db.session.execute(
+        db.update(table)
+        .where(table.c.id.in_(candidates), table.c.status == 'pending',
+               db.or_(table.c.claimed_until.is_(None), table.c.claimed_until < now))
+        .values(claimed_by=token, claimed_until=now + timedelta(seconds=MODERATION_LEASE_SECONDS))
+    )
+    rows = db.session.execute(db.select(table.c.id, table.c.text).where(table.c.claimed_by == token)).all()
+    db.session.commit()
+    return [{"id": r.id, "text": r.text} for r in rows]
+
+def release_claims(token):
+    table = CommunityMessage.__table__
+    db.session.execute(db.update(table).where(table.c.claimed_by == token).values(claimed_by=None, claimed_until=None))
+    db.session.commit()
+
+def moderate_pending_batch():
+    """Moderates one claimed batch with a single model call. Returns how many messages were claimed."""
+    token = uuid.uuid4().hex
+    batch = claim_pending_batch(token)
+    if not batch: return 0
+
+    try:
+        reply = llm.complete(
+            "moderation",
+            [{"role": "system", "content": SYSTEM_PROMPT_MODERATOR + BATCH_MODERATION_INSTRUCTIONS},
+             {"role": "user", "content": json.dumps(batch)}],
+            temperature=0.0, response_format={"type": "json_object"})
+        verdicts = json.loads(reply)["verdicts"]
+        by_id = {int(v["id"]): v for v in verdicts if v.get("decision") in ("APPROVE", "REJECT")}
+    except Exception:
+        release_claims(token)
+        raise
+
+    decided = [{"b_id": m["id"], "b_text": m["text"],
+                "b_status": "approved" if by_id[m["id"]]["decision"] == "APPROVE" else "rejected",
+                "b_reason": by_id[m["id"]].get("reason")}
+               for m in batch if m["id"] in by_id]
+    table = CommunityMessage.__table__
+    if decided:
+        # Only messages still carrying our claim are updated; a resubmission clears the claim
+        db.session.execute(
+            db.update(table)
+            .where(table.c.id == db.bindparam("b_id"), table.c.claimed_by == token, table.c.status == 'pending')
+            .values(status=db.bindparam("b_status"), reason=db.bindparam("b_reason"), claimed_by=None, claimed_until=None),
+            decided
+        )
+    db.session.commit()
+    release_claims(token)  # anything the model skipped goes back in the queue
+
+    try:
+        for d in decided:
+            db.session.merge(ModerationVerdict(text_hash=moderation_cache_key(d["b_text"]), status=d["b_status"], reason=d["b_reason"]))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another worker cached the same text first
+    return len(batch)
+
+def drain_moderation_queue(max_failures=None):
+    """Moderates batches until the queue is empty, backing off with jitter while the model is failing.
+
+    After max_failures failed batches in a row (if given) the last error is raised instead.
+    """
+    failures = 0
+    while True:
+        try:
+            claimed = moderate_pending_batch()
+            failures = 0
+        except Exception as e:
+            db.session.rollback()
+            failures += 1
+            if max_failures and failures >= max_failures: raise
+            delay = min(MODERATION_MAX_BACKOFF, 2 ** failures) * random.uniform(0.5, 1.5)
+            print(f"Moderation batch failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        if claimed < MODERATION_BATCH_SIZE:
+            return
+
+def moderation_worker_loop(app):
+    while True:
+        moderation_wakeup.wait(timeout=MODERATION_POLL_SECONDS)
+        moderation_wakeup.clear()
+        time.sleep(MODERATION_BATCH_WINDOW)  # let a few submissions accumulate into one batch
+        with app.app_context():
+            try:
+                drain_moderation_queue()
+            finally:
+                db.session.remove()
+
+def ensure_moderation_worker(app=None):
+    """Starts this process's moderation thread (again after a fork) unless an external worker is used.
+
+    Servers call it once a worker is up (gunicorn's post_worker_init), so messages left pending by a
+    restart are moderated without waiting for a visit to the wall; the community endpoints call it too.
+    """
+    global moderation_worker_pid
+    if MODERATION_WORKER != "thread" or moderation_worker_pid == os.getpid():
+        return
+    moderation_worker_pid = os.getpid()
+    app = app or current_app._get_current_object()
+    threading.Thread(target=moderation_worker_loop, args=(app,), daemon=True).start()
+    moderation_wakeup.set()  # drain whatever is already pending
+
+# --- HEATMAP AGGREGATION ---
+# Journal locations are only ever published as counts per grid cell. The finest level
+# (~20 km cells) is the obfuscation floor, so responses are deterministic and cacheable.
+HEATMAP_LEVELS = (5, 7, 9, 11)
+
+def heatmap_level_for_zoom(zoom):
+    return max([l for l in HEATMAP_LEVELS if l <= zoom + 3] or [HEATMAP_LEVELS[0]])
+
+def heatmap_cell(lat, lng, level):
+    size = 360.0 / 2 ** level
+    return int((lng + 180) // size), int((lat + 90) // size)
+
+def upsert_counts(table, key_columns, rows, chunk_size=500):
+    """Adds each row's count onto the row with the same key (inserting it if new), inside the caller's transaction."""
+    merged = {}
+    for row in rows:  # one statement may not touch the same key twice
+        key = tuple(row[c] for c in key_columns)
+        merged[key] = merged.get(key, 0) + row["count"]
+    rows = [{**dict(zip(key_columns, key)), "count": count} for key, count in merged.items()]
+    insert = sqlite_insert if db.engine.dialect.name == 'sqlite' else postgresql_insert
+    for i in range(0, len(rows), chunk_size):
+        stmt = insert(table).values(rows[i:i + chunk_size])
+        db.session.execute(stmt.on_conflict_do_update(index_elements=key_columns, set_={"count": table.c.count + stmt.excluded.count}))
+
+def heatmap_rows(lat, lng, mood, delta):
+    if lat is None or lng is None: return []
+    return [{"level": level, "cell_x": x, "cell_y": y, "mood": mood or "Neutral", "count": delta}
+            for level in HEATMAP_LEVELS for x, y in [heatmap_cell(lat, lng, level)]]
+
+def bump_heatmap(lat, lng, mood, delta):
+    """Adds delta to the entry's cell at every level, inside the caller's transaction."""
+    upsert_counts(HeatmapCell.__table__, ['level', 'cell_x', 'cell_y', 'mood'], heatmap_rows(lat, lng, mood, delta))
+
+def rebuild_heatmap():
+    """Recomputes every cell from the journal (for backfills and repairs)."""
+    db.session.execute(db.delete(HeatmapCell.__table__))
+    points = db.session.execute(
+        db.select(JournalEntry.lat, JournalEntry.lng, JournalEntry.mood).where(JournalEntry.lat.isnot(None), JournalEntry.lng.isnot(None))
+    ).all()
+    counts = {}
+    for lat, lng, mood in points:
+        for level in HEATMAP_LEVELS:
+            key = (level, *heatmap_cell(lat, lng, level), mood or "Neutral")
+            counts[key] = counts.get(key, 0) + 1
+    if counts:
+        db.session.execute(db.insert(HeatmapCell.__table__), [
+            {"level": l, "cell_x": x, "cell_y": y, "mood": m, "count": c} for (l, x, y, m), c in counts.items()
+        ])
+    db.session.commit()
+    return len(points)
+
+# --- GEOCODING ---
+# Journal locations resolve against a bundled gazetteer (data/gazetteer.tsv, built by
+# scripts/build_gazetteer.py) instead of a web service, so a lookup is a few bisects or a short
+# KD-tree walk. Places are held in parallel arrays rather than one object per place.
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", os.path.join(BASE_DIR, 'data', 'gazetteer.tsv'))
+COUNTRIES_PATH = os.environ.get("COUNTRIES_PATH", os.path.join(BASE_DIR, 'data', 'countries.tsv'))
+GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", 4096))  # per cached function, per process
+REVERSE_GEOCODE_MAX_KM = float(os.environ.get("REVERSE_GEOCODE_MAX_KM", 50))  # map pins farther than this stay unlabelled
+PLACE_SUGGESTIONS_MAX = 10
+EARTH_RADIUS_KM = 6371.0
+
+def normalize_place(text):
+    """Lookup key for a place name: ASCII, lower case, punctuation dropped, 'Saint' spelled 'st'."""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    text = re.sub(r"['’.]", "", text)
+    text = re.sub(r"[^a-z0-9]+", " ", text).strip()
+    return re.sub(r"\bsaint\b", "st", text)
+
+def unit_vector(lat, lng):
+    lat, lng = math.radians(lat), math.radians(lng)
+    return math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat)
+
+class Gazetteer:
+    """Places with name/prefix lookup and nearest-place lookup.
+
+    Names are found through a sorted list of normalized keys (every spelling of every place)
+    with a parallel array of place indexes. Nearest-place queries walk an implicit KD-tree over
+    points on the unit sphere: `tree` is a permutation of place indexes in which each range's
+    middle element splits the rest on one axis, so the tree costs one array and no nodes.
+    """
+    def __init__(self, places, countries=None):
+        self.names, self.country_codes = [], []
+        self.lat, self.lng, self.population = array('d'), array('d'), array('q')
+        self.xyz = array('d')
+        keys = []
+        for i, (name, country, lat, lng, population, alternates) in enumerate(places):
+            self.names.append(name)
+            self.country_codes.append(country)
+            self.lat.append(lat)
+            self.lng.append(lng)
+            self.population.append(population)
+            self.xyz.extend(unit_vector(lat, lng))
+            keys.extend((key, i) for key in {normalize_place(n) for n in (name, *alternates)} if key)
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.key_places = array('l', (i for _, i in keys))
+        self.country_names, self.countries_by_key = {}, {}
+        for code, country in countries or ():  # the first name listed for a code is its label, later ones aliases
+            self.country_names.setdefault(code, country)
+            self.countries_by_key[normalize_place(country)] = code
+            self.countries_by_key[code.lower()] = code
+        self.tree = array('l', range(len(self.names)))
+        self._build(0, len(self.tree), 0)
+
+    @classmethod
+    def load(cls, path=GAZETTEER_PATH, countries_path=COUNTRIES_PATH):
+        def rows(p):
+            with open(p, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip() and not line.startswith('#'):
+                        yield line.rstrip('\n').split('\t')
+        places = ((name, country, float(lat), float(lng), int(population), alternates.split(',') if alternates else ())
+                  for name, country, lat, lng, population, alternates in rows(path))
+        countries = rows(countries_path) if os.path.exists(countries_path) else ()
+        return cls(places, countries)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _build(self, lo, hi, axis):
+        if hi - lo < 2: return
+        self.tree[lo:hi] = array('l', sorted(self.tree[lo:hi], key=lambda i: self.xyz[3 * i + axis]))
+        mid = (lo + hi) // 2
+        self._build(lo, mid, (axis + 1) % 3)
+        self._build(mid + 1, hi, (axis + 1) % 3)
+
+    def country_code(self, text):
+        return self.countries_by_key.get(normalize_place(text))
+
+    def label(self, i):
+        return f"{self.names[i]}, {self.country_names.get(self.country_codes[i], self.country_codes[i])}"
+
+    def lookup(self, query, limit=1, prefix=False):
+        """Indexes of places named `query` ("Name" or "Name, Country"), exact names first, then by population.
+
+        With prefix=True, names that merely start with the query match too. A qualifier that is
+        not a known country (a province, say) is ignored rather than failing the lookup.
+        """
+        name, _, qualifier = query.partition(',')
+        key = normalize_place(name)
+        if not key: return []
+        country = self.country_code(qualifier) if qualifier.strip() else None
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + '\x7f') if prefix else bisect_right(self.keys, key, lo)
+        ranks = {}
+        for j in range(lo, hi):
+            i = self.key_places[j]
+            if country and self.country_codes[i] != country: continue
+            rank = (self.keys[j] != key, -self.population[i], self.names[i])
+            if i not in ranks or rank < ranks[i]: ranks[i] = rank
+        return heapq.nsmallest(limit, ranks, key=ranks.get)
+
+    def nearest(self, lat, lng):
+        """(index, distance in km) of the place closest to a point, or (None, None) if there are no places."""
+        if not self.names: return None, None
+        qx, qy, qz = unit_vector(lat, lng)
+        tree, xyz = self.tree, self.xyz
+        best, best_d2 = None, float('inf')  # squared chord length
+        stack = [(0, len(tree), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if lo >= hi: continue
+            mid = (lo + hi) // 2
+            j = 3 * tree[mid]
+            dx, dy, dz = qx - xyz[j], qy - xyz[j + 1], qz - xyz[j + 2]
+            d2 = dx * dx + dy * dy + dz * dz
+            if d2 < best_d2: best, best_d2 = tree[mid], d2
+            diff = (dx, dy, dz)[axis]
+            near, far = ((mid + 1, hi), (lo, mid)) if diff > 0 else ((lo, mid), (mid + 1, hi))
+            if diff * diff < best_d2: stack.append((*far, (axis + 1) % 3))  # popped after the near side
+            stack.append((*near, (axis + 1) % 3))
+        return best, 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(best_d2) / 2))
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+def gazetteer():
+    """The process-wide gazetteer, loaded on first use (an empty one if the data file is missing)."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                try:
+                    _gazetteer = Gazetteer.load()
+                except FileNotFoundError:
+                    print(f"Gazetteer {GAZETTEER_PATH} not found; run scripts/build_gazetteer.py. Locations will not be geocoded.")
+                    _gazetteer = Gazetteer([])
+    return _gazetteer
+
+@lru_cache(maxsize=GEOCODE_CACHE_SIZE)
+def geocode(place_name):
+    """(lat, lng, label) of the best match for a place name, or None. Callers pass a normalized name."""
+    places = gazetteer()
+    found = places.lookup(place_name)
+    return (places.lat[found[0]], places.lng[found[0]], places.label(found[0])) if found else None
+
+@lru_cache(maxsize=GEOCODE_CACHE_SIZE)
+def suggest_places(prefix, limit=PLACE_SUGGESTIONS_MAX):
+    """Places whose names start with prefix, as (label, lat, lng) tuples, most likely first."""
+    places = gazetteer()
+    return tuple((places.label(i), places.lat[i], places.lng[i]) for i in places.lookup(prefix, limit, prefix=True))
+
+@lru_cache(maxsize=GEOCODE_CACHE_SIZE)
+def nearest_place_label(lat, lng):
+    places = gazetteer()
+    i, km = places.nearest(lat, lng)
+    return places.label(i) if i is not None and km <= REVERSE_GEOCODE_MAX_KM else None
+
+def reverse_geocode(lat, lng):
+    """Label of the nearest place within REVERSE_GEOCODE_MAX_KM of a point, or None.
+
+    Points are rounded to ~100 m first, so pins dropped around the same spot share a cache entry.
+    """
+    return nearest_place_label(round(lat, 3), round(lng, 3))
+
+def place_query(text):
+    """Canonical form of a "Name[, Country]" query, so different spellings share cache entries."""
+    name, _, qualifier = (text or '').partition(',')
+    name, qualifier = normalize_place(name), normalize_place(qualifier)
+    return f"{name}, {qualifier}" if name and qualifier else name
+
+def get_coordinates(place_name):
+    """Converts a place name (e.g. 'Edmonton' or 'London, Canada') into Lat/Lng coordinates."""
+    query = place_query(place_name)
+    found = geocode(query) if query else None
+    return (found[0], found[1]) if found else (None, None)
+
+def resolve_location(location, lat, lng):
+    """Fills in whichever half of a journal entry's place is missing: coordinates for a named place, a name for a map pin."""
+    location = (location or '').strip()[:100] or None
+    if lat is None or lng is None:
+        lat, lng = get_coordinates(location)
+    elif location is None:
+        location = reverse_geocode(lat, lng)
+    return location, lat, lng
+
+# --- MOOD TRENDS ---
+# Per-user mood counts per day and per week, maintained alongside the journal like the heatmap,
+# so the trends endpoint reads a few hundred rollup rows instead of scanning every entry.
+MOOD_TREND_PERIODS = {"day": 1, "week": 7}  # period -> days per bucket
+MOOD_TREND_DEFAULT_BUCKETS = {"day": 30, "week": 12}
+MOOD_TREND_MAX_BUCKETS = 366
+
+def mood_period_start(when, period):
+    """The first day of the bucket a timestamp (or date) falls in; weeks start on Monday."""
+    day = when.date() if isinstance(when, datetime) else when
+    return day - timedelta(days=day.weekday()) if period == "week" else day
+
+def mood_rollup_rows(user_id, when, mood, delta):
+    return [{"user_id": user_id, "period": period, "period_start": mood_period_start(when, period),
+             "mood": mood or "Neutral", "count": delta} for period in MOOD_TREND_PERIODS]
+
+def bump_mood_rollup(user_id, when, mood, delta):
+    """Adds delta to the entry's day and week buckets, inside the caller's transaction."""
+    upsert_counts(MoodRollup.__table__, ['user_id', 'period', 'period_start', 'mood'], mood_rollup_rows(user_id, when, mood, delta))
+
+def rebuild_mood_rollups():
+    """Recomputes every user's rollups from the journal (for backfills and repairs)."""
+    db.session.execute(db.delete(MoodRollup.__table__))
+    entries = db.session.execute(
+        db.select(JournalEntry.user_id, JournalEntry.timestamp, JournalEntry.mood).execution_options(yield_per=5000))
+    counts, total = {}, 0
+    for user_id, timestamp, mood in entries:
+        total += 1
+        for period in MOOD_TREND_PERIODS:
+            key = (user_id, period, mood_period_start(timestamp, period), mood or "Neutral")
+            counts[key] = counts.get(key, 0) + 1
+    if counts:
+        db.session.execute(db.insert(MoodRollup.__table__), [
+            {"user_id": u, "period": p, "period_start": s, "mood": m, "count": c} for (u, p, s, m), c in counts.items()
+        ])
+    db.session.commit()
+    return total
+
+# --- JOURNAL SEARCH ---
+# SQLite: an external-content FTS5 table over journal_entries, kept in sync by triggers.
+# Postgres: a generated, weighted tsvector column with a GIN index. Either way the index is
+# updated in the same transaction as the entry, whichever code path writes it.
+JOURNAL_SEARCH_CONFIG = os.environ.get("JOURNAL_SEARCH_CONFIG", "english")  # Postgres text search config
+JOURNAL_SEARCH_MAX_TERMS = 12
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"  # swapped for <mark> after HTML-escaping
+
+SQLITE_JOURNAL_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS journal_fts USING fts5(
+        title, content, location, content='journal_entries', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS journal_fts_insert AFTER INSERT ON journal_entries BEGIN
+        INSERT INTO journal_fts(rowid, title, content, location) VALUES (new.id, new.title, new.content, new.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS journal_fts_delete AFTER DELETE ON journal_entries BEGIN
+        INSERT INTO journal_fts(journal_fts, rowid, title, content, location) VALUES ('delete', old.id, old.title, old.content, old.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS journal_fts_update AFTER UPDATE OF title, content, location ON journal_entries BEGIN
+        INSERT INTO journal_fts(journal_fts, rowid, title, content, location) VALUES ('delete', old.id, old.title, old.content, old.location);
+        INSERT INTO journal_fts(rowid, title, content, location) VALUES (new.id, new.title, new.content, new.location);
+    END""",
+    "INSERT INTO journal_fts(journal_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_JOURNAL_SEARCH_DDL = [
+    f"""ALTER TABLE journal_entries ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{JOURNAL_SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{JOURNAL_SEARCH_CONFIG}', coalesce(content, '')), 'B') ||
+        setweight(to_tsvector('{JOURNAL_SEARCH_CONFIG}', coalesce(location, '')), 'C')) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_journal_entries_search ON journal_entries USING GIN (search_vector)",
+]
+
+def create_journal_search_index():
+    statements = {"sqlite": SQLITE_JOURNAL_SEARCH_DDL, "postgresql": POSTGRES_JOURNAL_SEARCH_DDL}.get(db.engine.dialect.name, [])
+    with db.engine.begin() as conn:
+        for statement in statements:
+            conn.execute(db.text(statement))
+
+def search_terms(query):
+    return re.findall(r"\w+", (query or "").lower())[:JOURNAL_SEARCH_MAX_TERMS]
+
+def mark_highlights(text):
+    """HTML-escapes an indexed snippet, then turns the highlight sentinels into <mark> tags."""
+    return html.escape(text or "").replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+
+def journal_search_query(terms, filters, limit, offset):
+    """Ranked search statement for the current dialect. Every term must match; the last also matches as a prefix."""
+    entries = JournalEntry.__table__
+    if db.engine.dialect.name == "sqlite":
+        fts = db.table('journal_fts', db.column('rowid'))
+        match = " ".join(f'"{t}"' for t in terms[:-1]) + f' "{terms[-1]}"*'  # quoted, so FTS5 syntax in input is inert
+        return (db.select(entries.c.id, entries.c.mood, entries.c.location, entries.c.timestamp,
+                          db.func.highlight(db.literal_column('journal_fts'), 0, HIGHLIGHT_START, HIGHLIGHT_END).label('title'),
+                          db.func.snippet(db.literal_column('journal_fts'), 1, HIGHLIGHT_START, HIGHLIGHT_END, '…', 16).label('snippet'))
+                .select_from(fts.join(entries, entries.c.id == fts.c.rowid))
+                .where(db.literal_column('journal_fts').op('MATCH')(match), *filters)
+                .order_by(db.func.bm25(db.literal_column('journal_fts'), 8.0, 2.0, 1.0), entries.c.id.desc())
+                .limit(limit).offset(offset))
+    if db.engine.dialect.name == "postgresql":
+        tsquery = db.func.to_tsquery(JOURNAL_SEARCH_CONFIG, " & ".join(terms[:-1] + [f"{terms[-1]}:*"]))
+        vector = db.literal_column('journal_entries.search_vector')
+        rank = db.func.ts_rank_cd(vector, tsquery)
+        # Rank and page first, so ts_headline only runs on the rows returned
+        ranked = (db.select(entries.c.id, rank.label('rank')).where(vector.op('@@')(tsquery), *filters)
+                  .order_by(rank.desc(), entries.c.id.desc()).limit(limit).offset(offset).subquery())
+        options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=24, MinWords=8, MaxFragments=2"
+        return (db.select(entries.c.id, entries.c.mood, entries.c.location, entries.c.timestamp,
+                          db.func.ts_headline(JOURNAL_SEARCH_CONFIG, entries.c.title, tsquery, 'HighlightAll=true, ' + options).label('title'),
+                          db.func.ts_headline(JOURNAL_SEARCH_CONFIG, entries.c.content, tsquery, options).label('snippet'))
+                .select_from(ranked.join(entries, entries.c.id == ranked.c.id))
+                .order_by(ranked.c.rank.desc(), entries.c.id.desc()))
+    return None
+
+# --- JOURNAL RETRIEVAL ---
+# Grounds chats in the user's own journal without an embedding model. Each entry is indexed as a
+# hashed, log-scaled term-frequency vector (L2-normalized) stored as rows of journal_terms; a turn
+# is matched by weighting its terms with the user's IDF and summing over the postings it shares
+# with each entry (SMART lnc.ltc cosine). Entries are re-indexed in the transaction that writes
+# them, so new IDF values never require touching stored vectors.
+RETRIEVAL_HASH_BITS = 20
+JOURNAL_CONTEXT_TOKEN_BUDGET = int(os.environ.get("JOURNAL_CONTEXT_TOKEN_BUDGET", 400))  # per chat turn; 0 turns it off
+JOURNAL_CONTEXT_TOP_K = int(os.environ.get("JOURNAL_CONTEXT_TOP_K", 3))
+JOURNAL_CONTEXT_MIN_MATCH = float(os.environ.get("JOURNAL_CONTEXT_MIN_MATCH", 2.0))  # see match_journal_entries
+JOURNAL_REFLECTION_TOKENS = int(os.environ.get("JOURNAL_REFLECTION_TOKENS", 800))  # the entry being reflected on
+RETRIEVAL_STOPWORDS = frozenset("""
+    about after again all also am an and any are as at be because been before being but by can could did do does doing
+    done down during each even ever every few for from get got had has have having he her here hers herself him himself
+    his how if in into is it its itself just like me more most much my myself no nor not now of off on once only or
+    other our ours out over own really same she should so some such than that the their theirs them themselves then
+    there these they this those through to too under until up us very was we were what when where which while who why
+    will with would you your yours yourself im ive id dont didnt cant wont isnt wasnt its thats
+""".split())
+
+def retrieval_terms(text):
+    """Hashed features of the words in text, with counts; stopwords and one-letter words are skipped."""
+    text = unicodedata.normalize('NFKD', (text or '').lower().replace("'", "").replace("’", ""))
+    words = re.findall(r"\w+", "".join(c for c in text if not unicodedata.combining(c)))
+    mask = (1 << RETRIEVAL_HASH_BITS) - 1
+    counts = {}
+    for word in words:
+        if len(word) > 1 and word not in RETRIEVAL_STOPWORDS:
+            feature = zlib.crc32(word.encode()) & mask  # stable across processes, unlike hash()
+            counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+def entry_vector(title, content):
+    """{feature: weight}: 1 + log(tf), scaled to unit length."""
+    weights = {f: 1 + math.log(tf) for f, tf in retrieval_terms(f"{title or ''}\n{content or ''}").items()}
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return {f: w / norm for f, w in weights.items()}
+
+def journal_term_rows(entry_id, user_id, title, content):
+    return [{"entry_id": entry_id, "feature": f, "user_id": user_id, "weight": w} for f, w in entry_vector(title, content).items()]
+
+def index_journal_entry(entry):
+    """(Re)indexes one entry inside the caller's transaction; the entry must have an id (flush first)."""
+    unindex_journal_entry(entry.id)
+    rows = journal_term_rows(entry.id, entry.user_id, entry.title, entry.content)
+    if rows: db.session.execute(db.insert(JournalTerm.__table__), rows)
+
+def unindex_journal_entry(entry_id):
+    db.session.execute(db.delete(JournalTerm.__table__).where(JournalTerm.entry_id == entry_id))
+
+def rebuild_journal_index():
+    """Re-indexes every journal entry (for backfills and repairs)."""
+    db.session.execute(db.delete(JournalTerm.__table__))
+    entries = db.session.execute(db.select(JournalEntry.id, JournalEntry.user_id, JournalEntry.title, JournalEntry.content)
+                                 .execution_options(yield_per=1000))
+    rows, total = [], 0
+    for entry_id, user_id, title, content in entries:
+        total += 1
+        rows += journal_term_rows(entry_id, user_id, title, content)
+        if len(rows) >= 5000:
+            db.session.execute(db.insert(JournalTerm.__table__), rows)
+            rows = []
+    if rows: db.session.execute(db.insert(JournalTerm.__table__), rows)
+    db.session.commit()
+    return total
+
+def match_journal_entries(user_id, text, limit, exclude=()):
+    """The user's entries most similar to text, as [(entry_id, score)] best first, plus the query's feature weights.
+
+    Entries are ranked by cosine similarity. To qualify, the query terms an entry shares must add up to an
+    IDF weight of JOURNAL_CONTEXT_MIN_MATCH: one word the user rarely writes, or a few less rare ones. (A
+    cosine cut-off would instead rule out long entries, whose many other words shrink every score.)
+    """
+    query = retrieval_terms(text)
+    if not query: return [], {}
+    postings = db.session.execute(
+        db.select(JournalTerm.entry_id, JournalTerm.feature, JournalTerm.weight)
+        .where(JournalTerm.user_id == user_id, JournalTerm.feature.in_(list(query)))
+    ).all()
+    if not postings: return [], {}
+    total = db.session.scalar(db.select(db.func.count()).select_from(JournalEntry).where(JournalEntry.user_id == user_id))
+    df = {}
+    for _, feature, _ in postings:
+        df[feature] = df.get(feature, 0) + 1
+    raw = {f: (1 + math.log(tf)) * (math.log((total + 1) / (df.get(f, 0) + 1)) + 1) for f, tf in query.items()}
+    norm = math.sqrt(sum(w * w for w in raw.values()))
+    weights = {f: w / norm for f, w in raw.items()}
+    scores, matched = {}, {}
+    for entry_id, feature, weight in postings:
+        if entry_id not in exclude:
+            scores[entry_id] = scores.get(entry_id, 0.0) + weight * weights[feature]
+            matched[entry_id] = matched.get(entry_id, 0.0) + raw[feature]
+    candidates = [(entry_id, score) for entry_id, score in scores.items() if matched[entry_id] >= JOURNAL_CONTEXT_MIN_MATCH]
+    return heapq.nlargest(limit, candidates, key=lambda item: item[1]), weights
+
+def clip_to_tokens(text, tokens):
+    limit = max(0, (tokens - 4) * 4)  # the inverse of estimate_tokens
+    return text if len(text) <= limit else text[:limit].rsplit(' ', 1)[0] + "…"
+
+def best_passage(content, weights, tokens):
+    """The sentence that best matches the query, widened while it fits the token budget: first over
+    neighbouring sentences that match too, then by one sentence of context on either side."""
+    sentences = [s for s in re.split(r'(?<=[.!?])\s+|\n+', content or '') if s.strip()]
+    if not sentences: return ""
+    scores = [sum(weights.get(f, 0.0) for f in retrieval_terms(s)) for s in sentences]
+    lo = hi = max(range(len(sentences)), key=scores.__getitem__)
+
+    def fits(start, end):
+        return estimate_tokens(" ".join(sentences[start:end + 1])) <= tokens
+
+    while True:  # towards whichever matching neighbour matches better
+        options = [i for i in (lo - 1, hi + 1) if 0 <= i < len(sentences) and scores[i] > 0]
+        nxt = max(options, key=scores.__getitem__, default=None)
+        if nxt is None or not fits(min(lo, nxt), max(hi, nxt)): break
+        lo, hi = min(lo, nxt), max(hi, nxt)
+    if lo > 0 and fits(lo - 1, hi): lo -= 1
+    if hi < len(sentences) - 1 and fits(lo, hi + 1): hi += 1
+    passage = clip_to_tokens(" ".join(sentences[lo:hi + 1]), tokens)
+    return ("…" if lo > 0 else "") + passage + ("…" if hi < len(sentences) - 1 and not passage.endswith("…") else "")
+
+def journal_snippets(user_id, text, budget=None, limit=None, exclude=()):
+    """Lines quoting the passages of the user's journal most relevant to text, within `budget` tokens in all."""
+    budget = JOURNAL_CONTEXT_TOKEN_BUDGET if budget is None else budget
+    limit = limit or JOURNAL_CONTEXT_TOP_K
+    if budget <= 0: return []
+    matches, weights = match_journal_entries(user_id, text, limit, exclude)
+    ids = [entry_id for entry_id, _ in matches]
+    if not ids: return []
+    entries = {e.id: e for e in db.session.execute(
+        db.select(JournalEntry.id, JournalEntry.title, JournalEntry.content, JournalEntry.mood, JournalEntry.timestamp)
+        .where(JournalEntry.id.in_(ids))
+    )}
+    lines, used = [], 0
+    for entry_id in ids:
+        e = entries[entry_id]
+        header = f'- "{e.title}" ({e.timestamp:%b %d, %Y}, {e.mood or "Neutral"}): '
+        room = (budget - used) // (len(ids) - len(lines)) - estimate_tokens(header)
+        passage = best_passage(e.content, weights, room) if room > 8 else ""
+        if not passage: continue
+        lines.append(header + passage)
+        used += estimate_tokens(lines[-1])
+    return lines
+
+def journal_context_message(user_id, text):
+    """A system message with journal passages relevant to the current turn, or None."""
+    lines = journal_snippets(user_id, text)
+    if not lines: return None
+    return {"role": "system", "content": "Possibly relevant notes from the user's private journal. Use them only if they help, "
+                                         "gently, and don't quote them back unless asked:\n" + "\n".join(lines)}
+
+def reflection_prompt(user_id, data):
+    """The opening prompt for a reflection session: the entry itself (clipped), plus related passages from other entries."""
+    entry_id = data.get("journal_entry_id")
+    if entry_id is not None:
+        entry = db.session.get(JournalEntry, entry_id) if isinstance(entry_id, int) else None
+        if entry is None or entry.user_id != user_id: return None
+        subject = (f'Journal entry "{entry.title}" written {entry.timestamp:%b %d, %Y}. Mood: {entry.mood or "Neutral"}.'
+                   + (f" Location: {entry.location}." if entry.location else "")
+                   + f"\n{clip_to_tokens(entry.content, JOURNAL_REFLECTION_TOKENS)}")
+        query, exclude = f"{entry.title}\n{entry.content}", {entry.id}
+    else:  # older clients post the entry's text themselves
+        subject = clip_to_tokens(str(data.get("reflection_context") or ""), JOURNAL_REFLECTION_TOKENS)
+        query, exclude = subject, ()
+    prompt = f"The user is reflecting on a previous journal entry. Please help them process these thoughts. {subject}"
+    related = journal_snippets(user_id, query, exclude=exclude)
+    if related:
+        prompt += "\n\nRelated passages from other entries in their journal:\n" + "\n".join(related)
+    return prompt
+
+# --- DATA EXPORT & IMPORT ---
+# A user's data as NDJSON, one record per line: the user, then journal entries, chat sessions and
+# chat messages (all sessions precede their messages). Exports read in yield_per batches and are
+# generated while they are sent, so memory stays flat however long the history. Imports take the
+# same format, validate every line and insert in executemany batches inside one transaction.
+EXPORT_FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = 1000  # rows per yield_per fetch
+EXPORT_CHUNK_BYTES = 64 * 1024
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", 50 * 1024 * 1024))
+CHAT_ROLES = ('user', 'assistant')
+
+def export_records(user):
+    """Yields the user's records, oldest first within each type."""
+    yield {"type": "user", "version": EXPORT_FORMAT_VERSION, "username": user.username,
+           "profile_info": user.profile_info or "", "exported_at": datetime.utcnow().isoformat()}
+    entries, sessions, messages = JournalEntry.__table__, ChatSession.__table__, ChatMessage.__table__
+    batched = {"yield_per": EXPORT_BATCH_SIZE}
+    for row in db.session.execute(
+            db.select(entries.c.id, entries.c.title, entries.c.content, entries.c.mood, entries.c.location,
+                      entries.c.lat, entries.c.lng, entries.c.timestamp)
+            .where(entries.c.user_id == user.id).order_by(entries.c.id).execution_options(**batched)):
+        yield {"type": "journal_entry", **row._asdict(), "timestamp": row.timestamp.isoformat()}
+    for row in db.session.execute(
+            db.select(sessions.c.id, sessions.c.name, sessions.c.start_time, sessions.c.is_active)
+            .where(sessions.c.user_id == user.id).order_by(sessions.c.id).execution_options(**batched)):
+        yield {"type": "session", **row._asdict(), "start_time": row.start_time.isoformat()}
+    for row in db.session.execute(
+            db.select(messages.c.session_id, messages.c.role, messages.c.content, messages.c.timestamp)
+            .join(sessions, sessions.c.id == messages.c.session_id)
+            .where(sessions.c.user_id == user.id).order_by(messages.c.session_id, messages.c.id).execution_options(**batched)):
+        yield {"type": "message", **row._asdict(), "timestamp": row.timestamp.isoformat()}
+
+def ndjson_chunks(records):
+    """Encodes records one per line, yielding roughly EXPORT_CHUNK_BYTES at a time."""
+    buffer, size = [], 0
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+class DrainableBuffer:
+    """A write-only file for zipfile; whatever has been written so far can be taken with drain()."""
+    def __init__(self): self.parts = []
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+    def flush(self): pass
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+def zip_chunks(member_name, chunks):
+    """Deflates chunks into a single-file zip archive as they arrive (no seeking, so it can be streamed)."""
+    buffer = DrainableBuffer()
+    info = zipfile.ZipInfo(member_name, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        with archive.open(info, 'w', force_zip64=True) as member:
+            for chunk in chunks:
+                member.write(chunk)
+                data = buffer.drain()
+                if data: yield data
+    yield buffer.drain()
+
+def export_filename(user, zipped):
+    name = re.sub(r'[^A-Za-z0-9_-]', '', user.username) or 'user'
+    return f"bigsister-{name}-{datetime.utcnow():%Y%m%d}.ndjson" + (".zip" if zipped else "")
+
+def export_chunks(user, zipped=False):
+    chunks = ndjson_chunks(export_records(user))
+    return zip_chunks(export_filename(user, False), chunks) if zipped else chunks
+
+def import_text(record, field, max_length=None, required=True):
+    value = record.get(field)
+    if value is None or value == "":
+        if required: raise ValueError(f"'{field}' is required")
+        return None
+    if not isinstance(value, str): raise ValueError(f"'{field}' must be a string")
+    if max_length and len(value) > max_length: raise ValueError(f"'{field}' is longer than {max_length} characters")
+    return value
+
+def import_timestamp(record, field):
+    try:
+        value = datetime.fromisoformat(record[field])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"'{field}' must be an ISO 8601 timestamp") from None
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def import_coordinate(record, field, limit):
+    value = record.get(field)
+    if value is None: return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not -limit <= value <= limit:
+        raise ValueError(f"'{field}' must be a number between -{limit} and {limit}")
+    return float(value)
+
+def import_point(record):
+    """A record's (lat, lng): both finite and in range, or both absent."""
+    lat, lng = import_coordinate(record, 'lat', 90), import_coordinate(record, 'lng', 180)
+    if (lat is None) != (lng is None): raise ValueError("'lat' and 'lng' must be given together")
+    return lat, lng
+
+def validate_journal_entry(record, user_id):
+    lat, lng = import_point(record)
+    location, lat, lng = resolve_location(import_text(record, 'location', 100, required=False), lat, lng)
+    return {"title": import_text(record, 'title', 200), "content": import_text(record, 'content'),
+            "mood": import_text(record, 'mood', 50, required=False) or "Neutral",
+            "location": location, "lat": lat, "lng": lng, "timestamp": import_timestamp(record, 'timestamp'), "user_id": user_id}
+
+def validate_session(record, user_id):
+    is_active = record.get('is_active', True)
+    if not isinstance(is_active, bool): raise ValueError("'is_active' must be true or false")
+    return {"name": import_text(record, 'name', 120), "start_time": import_timestamp(record, 'start_time'),
+            "is_active": is_active, "user_id": user_id}
+
+def validate_message(record):
+    if record.get('role') not in CHAT_ROLES: raise ValueError(f"'role' must be one of {', '.join(CHAT_ROLES)}")
+    return {"role": record['role'], "content": import_text(record, 'content'), "timestamp": import_timestamp(record, 'timestamp')}
+
+def import_records(user_id, lines):
+    """Validates and inserts exported NDJSON lines into a user's account, all or nothing.
+
+    Returns the counts inserted. Raises ValueError naming the first bad line, after rolling back.
+    """
+    counts = {"journal_entries": 0, "sessions": 0, "messages": 0}
+    entries, sessions, messages = [], [], []
+    session_ids = {}  # exported session id -> new id (None until its batch is inserted)
+
+    def flush_entries():
+        if not entries: return
+        table = JournalEntry.__table__
+        new_ids = db.session.execute(
+            db.insert(table).returning(table.c.id, sort_by_parameter_order=True), entries).scalars().all()
+        terms = [row for entry_id, e in zip(new_ids, entries) for row in journal_term_rows(entry_id, user_id, e['title'], e['content'])]
+        if terms: db.session.execute(db.insert(JournalTerm.__table__), terms)
+        upsert_counts(HeatmapCell.__table__, ['level', 'cell_x', 'cell_y', 'mood'],
+                      [row for e in entries for row in heatmap_rows(e['lat'], e['lng'], e['mood'], +1)])
+        upsert_counts(MoodRollup.__table__, ['user_id', 'period', 'period_start', 'mood'],
+                      [row for e in entries for row in mood_rollup_rows(user_id, e['timestamp'], e['mood'], +1)])
+        counts["journal_entries"] += len(entries)
+        entries.clear()
+
+    def flush_sessions():
+        if not sessions: return
+        table = ChatSession.__table__
+        new_ids = db.session.execute(
+            db.insert(table).returning(table.c.id, sort_by_parameter_order=True), [row for _, row in sessions]).scalars().all()
+        session_ids.update(zip((source_id for source_id, _ in sessions), new_ids))
+        counts["sessions"] += len(sessions)
+        sessions.clear()
+
+    def flush_messages():
+        if not messages: return
+        flush_sessions()  # messages may belong to sessions still waiting in the buffer
+        db.session.execute(db.insert(ChatMessage.__table__), [{**row, "session_id": session_ids[source_id]} for source_id, row in messages])
+        counts["messages"] += len(messages)
+        messages.clear()
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip(): continue
+            try:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise ValueError("not valid JSON") from None
+                if not isinstance(record, dict): raise ValueError("each line must be a JSON object")
+                kind = record.get('type')
+                if kind == 'user':
+                    continue  # the account is the importing user's, not the exported one
+                elif kind == 'journal_entry':
+                    entries.append(validate_journal_entry(record, user_id))
+                    if len(entries) >= IMPORT_BATCH_SIZE: flush_entries()
+                elif kind == 'session':
+                    source_id = record.get('id')
+                    if not isinstance(source_id, (int, str)) or source_id in session_ids:
+                        raise ValueError("sessions need a unique 'id'")
+                    sessions.append((source_id, validate_session(record, user_id)))
+                    session_ids[source_id] = None
+                    if len(sessions) >= IMPORT_BATCH_SIZE: flush_sessions()
+                elif kind == 'message':
+                    source_id = record.get('session_id')
+                    if not isinstance(source_id, (int, str)) or source_id not in session_ids:
+                        raise ValueError("'session_id' must match a session earlier in the file")
+                    messages.append((source_id, validate_message(record)))
+                    if len(messages) >= IMPORT_BATCH_SIZE: flush_messages()
+                else:
+                    raise ValueError(f"unknown record type {kind!r}")
+            except ValueError as e:
+                raise ValueError(f"Line {number}: {e}") from None
+        flush_entries()
+        flush_messages()
+        flush_sessions()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counts
+
+def ndjson_lines(upload):
+    """Yields the lines of an NDJSON file, or of the first .ndjson file inside a zip archive."""
+    if upload.read(4) != b"PK\x03\x04":
+        upload.seek(0)
+        yield from upload
+        return
+    upload.seek(0)
+    try:
+        archive = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise ValueError("The upload is not a valid zip file.") from None
+    with archive:
+        names = [name for name in archive.namelist() if name.endswith('.ndjson')]
+        if not names: raise ValueError("The zip file has no .ndjson file in it.")
+        with archive.open(names[0]) as member:
+            yield from member
 
 # --- ROUTES ---
 
 
 # SECTION 1: PAGE RENDERING & SITE PASSWORD
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login_site():
     if request.method == 'POST':
         if request.form.get('password') == os.environ.get("SITE_PASSWORD"):
             session['authenticated'] = True
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             return render_template('login.html', error='Invalid password.')
     return render_template('login.html')
 
-@app.route('/')
+@bp.route('/')
 @site_password_required
 def index():
-    return render_template('index.html')
+    response = make_response(render_template('index.html'))
+    response.headers['Accept-CH'] = ', '.join(AUDIO_CLIENT_HINTS)
+    return response
 
 # SECTION 2: USER AUTH API
-@app.route('/api/signup', methods=['POST'])
+@bp.route('/api/signup', methods=['POST'])
 def api_signup():
     data = request.json
     username, pin = data.get('username'), data.get('pin')
     if not all([username, pin, len(username) >= 3, str(pin).isdigit(), len(str(pin)) == 4]):
         return jsonify({"error": "Username must be > 3 chars, PIN must be 4 digits."}), 400
     if User.query.filter_by(username=username).first(): return jsonify({"error": "Username already exists."}), 409
+    db.session.commit()  # no pooled connection held while the PIN is hashed
     
     new_user = User(username=username)
     new_user.set_pin(pin)
     db.session.add(new_user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:  # taken by someone else meanwhile
+        db.session.rollback()
+        return jsonify({"error": "Username already exists."}), 409
     session['user_id'] = new_user.id
     return jsonify({"message": "User created successfully.", "username": new_user.username}), 201
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def api_login():
     data = request.json
-    user = User.query.filter_by(username=data.get('username')).first()
-    if user and user.check_pin(data.get('pin')):
+    user = db.session.execute(db.select(User.id, User.username, User.pin_hash).filter_by(username=data.get('username'))).first()
+    db.session.commit()  # no pooled connection held while the PIN is checked
+    if user and verify_pin(user.pin_hash, data.get('pin')):
+        # Hashed with older PIN_HASH_METHOD settings: store it again (unless the PIN changed meanwhile).
+        # The PIN is already verified, so a busy pool only postpones this to a later login.
+        try:
+            if pin_needs_rehash(user.pin_hash):
+                db.session.execute(db.update(User).where(User.id == user.id, User.pin_hash == user.pin_hash)
+                                   .values(pin_hash=hash_pin(data.get('pin'))))
+                db.session.commit()
+        except PinHashingBusy: pass
         session['user_id'] = user.id
         return jsonify({"message": "Login successful.", "username": user.username}), 200
     return jsonify({"error": "Invalid username or PIN."}), 401
 
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 def api_logout():
     session.pop('user_id', None)
     return jsonify({"message": "Logout successful."}), 200
 
-@app.route('/api/check_auth', methods=['GET'])
+@bp.route('/api/check_auth', methods=['GET'])
 def check_auth():
-    if 'user_id' in session:
-        user = db.session.get(User, session['user_id'])
-        if user: return jsonify({"username": user.username}), 200
+    user = current_user()
+    if user: return jsonify({"username": user.username}), 200
     return jsonify({"error": "Not authenticated"}), 401
 
 # SECTION 3: CHAT API
-@app.route('/api/sessions', methods=['GET', 'POST'])
+@bp.route('/api/sessions', methods=['GET', 'POST'])
 @user_login_required
+@rate_limited('session')
 def manage_sessions():
     user_id = session['user_id']
     if request.method == 'POST':
         data = request.json
-        new_s = ChatSession(name=datetime.now().strftime("%b %d, %Y %I:%M %p"), user_id=user_id)
-        db.session.add(new_s)
-        db.session.flush()
-        
         # Check if this is a Quiz Start or a Reflection Start
-        if "reflection_context" in data:
-            # Reflection Mode
-            prompt = f"The user is reflecting on a previous journal entry. Please help them process these thoughts. {data['reflection_context']}"
+        if "journal_entry_id" in data or "reflection_context" in data:
+            # Reflection Mode: the entry and related passages come from the journal index, within a token budget
+            prompt = reflection_prompt(user_id, data)
+            if prompt is None: return jsonify({"error": "Journal entry not found."}), 404
         else:
             # Quiz Mode
             prompt = "A user just completed a check-in quiz. Generate a warm, empathetic opening message. Here are their answers:\n" + "\n".join(data.get("quiz_answers", []))
+
+        # Phase 1: create the session, then commit so no connection is held during the model call
+        new_s = ChatSession(name=datetime.now().strftime("%b %d, %Y %I:%M %p"), user_id=user_id)
+        db.session.add(new_s)
+        db.session.flush()
+        session_info = {"id": new_s.id, "name": new_s.name}
+        db.session.commit()
             
+        greeting_messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+        if data.get("stream"):
+            def generate():
+                yield ndjson({"session": session_info})
+                yield from stream_assistant_reply(session_info["id"], greeting_messages, fallback="Hello. I'm here to listen.",
+                                                  call_type="greeting", temperature=0.8)
+            return ndjson_response(generate())
+
+        # Phase 2: call the model outside of any transaction
         try:
-            completion = client.chat.completions.create(messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}], model="openai/gpt-oss-120b", temperature=0.8)
-            greeting = completion.choices[0].message.content
-        except Exception: greeting = "Hello. I'm here to listen."
+            greeting = llm.complete("greeting", greeting_messages, temperature=0.8)
+        except LLMError as e:
+            print(f"Greeting failed, using the canned one: {e}")
+            greeting = "Hello. I'm here to listen."
         
-        initial_msg = ChatMessage(role='assistant', content=greeting, session_id=new_s.id)
-        db.session.add(initial_msg)
-        db.session.commit()
-        return jsonify({"id": new_s.id, "name": new_s.name, "initial_message": {"role": "assistant", "content": greeting}}), 201
+        # Phase 3: persist the greeting in its own short transaction
+        save_assistant_message(session_info["id"], greeting)
+        return jsonify({**session_info, "initial_message": {"role": "assistant", "content": greeting}}), 201
     
-    sessions_list = ChatSession.query.filter_by(user_id=user_id).order_by(ChatSession.start_time.desc()).all()
-    return jsonify([{"id": s.id, "name": s.name} for s in sessions_list])
+    try:
+        sessions_list, next_cursor = keyset_page(
+            ChatSession.query.with_entities(ChatSession.id, ChatSession.name, ChatSession.start_time).filter_by(user_id=user_id),
+            ChatSession.start_time, ChatSession.id)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    return jsonify({"items": [{"id": s.id, "name": s.name} for s in sessions_list], "next_cursor": next_cursor})
 
-@app.route('/api/sessions/<int:session_id>', methods=['PUT', 'DELETE'])
+@bp.route('/api/sessions/<int:session_id>', methods=['PUT', 'DELETE'])
 @user_login_required
 def manage_single_session(session_id):
     chat_session = ChatSession.query.get_or_404(session_id)
@@ -413,67 +2330,184 @@ def manage_single_session(session_id):
         db.session.commit()
         return jsonify({"message": "Session deleted."})
 
-@app.route('/api/sessions/<int:session_id>/messages', methods=['GET'])
+@bp.route('/api/sessions/<int:session_id>/messages', methods=['GET'])
 @user_login_required
 def get_session_messages(session_id):
     chat_session = ChatSession.query.get_or_404(session_id)
     if chat_session.user_id != session['user_id']: return jsonify({"error": "Unauthorized"}), 403
-    messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp.asc()).all()
-    return jsonify([{"role": m.role, "content": m.content} for m in messages])
+    # Pages run newest first (the cursor points further back); each page is returned oldest first
+    try:
+        messages, next_cursor = keyset_page(
+            ChatMessage.query.with_entities(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.timestamp).filter_by(session_id=session_id),
+            ChatMessage.timestamp, ChatMessage.id)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    return jsonify({"items": [{"role": m.role, "content": m.content} for m in reversed(messages)], "next_cursor": next_cursor})
 
-@app.route('/api/chat', methods=['POST'])
+@bp.route('/api/chat', methods=['POST'])
 @user_login_required
+@rate_limited('chat')
 def api_chat():
     data = request.json
     chat_session = ChatSession.query.get_or_404(data.get("session_id"))
     if chat_session.user_id != session['user_id']: return jsonify({"error": "Unauthorized"}), 403
     
-    db.session.add(ChatMessage(role='user', content=data.get("message"), session_id=chat_session.id))
-    history = [{"role": m.role, "content": m.content} for m in chat_session.messages]
+    # Phase 1: persist the user turn and snapshot the windowed history, then release the connection
+    session_id = chat_session.id
+    db.session.add(ChatMessage(role='user', content=data.get("message"), session_id=session_id))
+    db.session.flush()
+    history, fold = load_chat_context(chat_session)
+    schedule_summary_refresh(chat_session, fold)
+    notes = journal_context_message(session['user_id'], data.get("message"))
+    db.session.commit()
+    # Journal notes go just before the new turn, so the prompt prefix stays the same from turn to turn
+    chat_messages = [{"role": "system", "content": SYSTEM_PROMPT}] + history[:-1] + ([notes] if notes else []) + history[-1:]
     
+    if data.get("stream"):
+        # The reply is saved once the stream closes
+        return ndjson_response(stream_assistant_reply(session_id, chat_messages))
+
+    # Phase 2: call the model with no transaction or pooled connection held
     try:
-        completion = client.chat.completions.create(messages=[{"role": "system", "content": SYSTEM_PROMPT}] + history, model="openai/gpt-oss-120b")
-        ai_reply = completion.choices[0].message.content
-        db.session.add(ChatMessage(role='assistant', content=ai_reply, session_id=chat_session.id))
-        db.session.commit()
-        return jsonify({"reply": ai_reply})
-    except Exception as e:
-        db.session.rollback()
+        ai_reply = llm.complete("chat", chat_messages)
+    except LLMUnavailable as e:
+        return jsonify({"error": f"API Error: {str(e)}"}), 503, {"Retry-After": str(e.retry_after)}
+    except LLMError as e:
         return jsonify({"error": f"API Error: {str(e)}"}), 500
 
+    # Phase 3: persist the reply in its own short transaction
+    save_assistant_message(session_id, ai_reply)
+    return jsonify({"reply": ai_reply})
+
 # SECTION 4: JOURNAL API
-@app.route('/api/journal', methods=['GET', 'POST'])
+@bp.route('/api/journal', methods=['GET', 'POST'])
 @user_login_required
 def manage_journal():
     if request.method == 'POST':
         data = request.json
+        try:
+            lat, lng = import_point(data)
+            location = import_text(data, 'location', 100, required=False)
+        except ValueError as e: return jsonify({"error": str(e)}), 400
         
-        # Get coordinates directly from the map click
-        lat = data.get('lat')
-        lng = data.get('lng')
-
-        # If user didn't click map, default to None (will not show on heatmap)
-        # Or you can keep the random NYC logic here if you REALLY want a default.
-        if lat is None or lng is None:
-             lat = None
-             lng = None
+        # Coordinates come from the map click; a typed place name is geocoded instead, and a
+        # pin without a name is labelled with the nearest place. Neither: not on the heatmap.
+        location, lat, lng = resolve_location(location, lat, lng)
 
         entry = JournalEntry(
             title=data.get('title'),
             content=data.get('content'),
             mood=data.get('mood', 'Neutral'),
+            location=location,
             lat=lat,
             lng=lng,
+            timestamp=datetime.utcnow(),
             user_id=session['user_id']
         )
         db.session.add(entry)
+        db.session.flush()
+        index_journal_entry(entry)
+        bump_heatmap(lat, lng, entry.mood, +1)
+        bump_mood_rollup(entry.user_id, entry.timestamp, entry.mood, +1)
         db.session.commit()
-        return jsonify({"id": entry.id, "title": entry.title, "mood": entry.mood, "timestamp": entry.timestamp.isoformat()}), 201
+        return jsonify({"id": entry.id, "title": entry.title, "mood": entry.mood, "location": entry.location,
+                        "timestamp": entry.timestamp.isoformat()}), 201
     
-    entries = JournalEntry.query.filter_by(user_id=session['user_id']).order_by(JournalEntry.timestamp.desc()).all()
-    return jsonify([{"id": e.id, "title": e.title, "mood": e.mood, "location": e.location, "content": e.content, "timestamp": e.timestamp.isoformat()} for e in entries])
+    # List view gets a snippet; the full body is fetched per entry from /api/journal/<id>
+    try:
+        entries, next_cursor = keyset_page(
+            JournalEntry.query.with_entities(
+                JournalEntry.id, JournalEntry.title, JournalEntry.mood, JournalEntry.location, JournalEntry.timestamp,
+                db.func.substr(JournalEntry.content, 1, JOURNAL_SNIPPET_CHARS).label('snippet')
+            ).filter_by(user_id=session['user_id']),
+            JournalEntry.timestamp, JournalEntry.id)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "items": [{"id": e.id, "title": e.title, "mood": e.mood, "location": e.location, "snippet": e.snippet, "timestamp": e.timestamp.isoformat()} for e in entries],
+        "next_cursor": next_cursor
+    })
+
+@bp.route('/api/journal/search', methods=['GET'])
+@user_login_required
+def search_journal():
+    # ?q=<words>&mood=<Mood,...>&from=<YYYY-MM-DD>&to=<YYYY-MM-DD>&limit=&cursor=
+    terms = search_terms(request.args.get('q'))
+    if not terms: return jsonify({"error": "Search query is required."}), 400
+    entries = JournalEntry.__table__
+    filters = [entries.c.user_id == session['user_id']]
+    moods = [m for m in request.args.get('mood', '').split(',') if m]
+    if moods: filters.append(entries.c.mood.in_(moods))
+    try:
+        if request.args.get('from'):
+            filters.append(entries.c.timestamp >= datetime.fromisoformat(request.args['from']))
+        if request.args.get('to'):
+            end = datetime.fromisoformat(request.args['to'])
+            filters.append(entries.c.timestamp < end + timedelta(days=1) if len(request.args['to']) == 10 else entries.c.timestamp <= end)
+        offset = int(base64.urlsafe_b64decode(request.args['cursor'].encode())) if request.args.get('cursor') else 0
+        if offset < 0: raise ValueError
+    except ValueError: return jsonify({"error": "Dates must be YYYY-MM-DD and the cursor must come from a previous page."}), 400
+
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE_DEFAULT, type=int), PAGE_SIZE_MAX))
+    statement = journal_search_query(terms, filters, limit + 1, offset)
+    if statement is None: return jsonify({"error": "Search is not available on this database."}), 501
+    rows = db.session.execute(statement).all()
+    next_cursor = base64.urlsafe_b64encode(str(offset + limit).encode()).decode() if len(rows) > limit else None
+    return jsonify({
+        "items": [{"id": r.id, "title": mark_highlights(r.title), "snippet": mark_highlights(r.snippet), "mood": r.mood,
+                   "location": r.location, "timestamp": r.timestamp.isoformat()} for r in rows[:limit]],
+        "next_cursor": next_cursor
+    })
+
+@bp.route('/api/journal/trends', methods=['GET'])
+@user_login_required
+def journal_mood_trends():
+    # ?period=day|week&from=<YYYY-MM-DD>&to=<YYYY-MM-DD>; reads only the rollup table
+    period = request.args.get('period', 'day')
+    if period not in MOOD_TREND_PERIODS: return jsonify({"error": "period must be 'day' or 'week'."}), 400
+    step = MOOD_TREND_PERIODS[period]
+    try:
+        end = mood_period_start(date.fromisoformat(request.args['to']) if request.args.get('to') else datetime.utcnow(), period)
+        start = mood_period_start(date.fromisoformat(request.args['from']), period) if request.args.get('from') \
+            else end - timedelta(days=step * (MOOD_TREND_DEFAULT_BUCKETS[period] - 1))
+    except ValueError: return jsonify({"error": "Dates must be YYYY-MM-DD."}), 400
+    if start > end: return jsonify({"error": "'from' must not be after 'to'."}), 400
+    if (end - start).days // step >= MOOD_TREND_MAX_BUCKETS:
+        return jsonify({"error": f"At most {MOOD_TREND_MAX_BUCKETS} buckets per request."}), 400
+
+    rows = db.session.execute(
+        db.select(MoodRollup.period_start, MoodRollup.mood, MoodRollup.count)
+        .where(MoodRollup.user_id == session['user_id'], MoodRollup.period == period,
+               MoodRollup.period_start.between(start, end), MoodRollup.count > 0)
+        .order_by(MoodRollup.period_start)
+    ).all()
+    counts = {}
+    for period_start, mood, count in rows:
+        counts.setdefault(period_start, {})[mood] = count
+    # Every bucket in the range is listed, so empty days/weeks chart as zero
+    buckets = [start + timedelta(days=step * i) for i in range((end - start).days // step + 1)]
+    return jsonify({
+        "period": period, "from": start.isoformat(), "to": end.isoformat(),
+        "moods": sorted({mood for _, mood, _ in rows}),
+        "buckets": [{"start": b.isoformat(), "counts": counts.get(b, {}), "total": sum(counts.get(b, {}).values())} for b in buckets]
+    })
+
+@bp.route('/api/geocode', methods=['GET'])
+@user_login_required
+def geocode_suggestions():
+    # ?q=<start of a place name>[, country]&limit=; answered from the bundled gazetteer
+    query = place_query(request.args.get('q'))
+    if len(query) < 2: return jsonify({"items": []})
+    limit = max(1, min(request.args.get('limit', PLACE_SUGGESTIONS_MAX, type=int), PLACE_SUGGESTIONS_MAX))
+    return jsonify({"items": [{"label": label, "lat": lat, "lng": lng} for label, lat, lng in suggest_places(query, limit)]})
+
+@bp.route('/api/geocode/reverse', methods=['GET'])
+@user_login_required
+def geocode_reverse():
+    lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"error": "lat and lng must be valid coordinates."}), 400
+    return jsonify({"label": reverse_geocode(lat, lng)})
 
-@app.route('/api/journal/<int:entry_id>', methods=['GET', 'PUT', 'DELETE'])
+@bp.route('/api/journal/<int:entry_id>', methods=['GET', 'PUT', 'DELETE'])
 @user_login_required
 def manage_journal_entry(entry_id):
     entry = JournalEntry.query.get_or_404(entry_id)
@@ -484,100 +2518,296 @@ def manage_journal_entry(entry_id):
             "title": entry.title, 
             "content": entry.content, 
             "mood": entry.mood,
-            "location": entry.location
+            "location": entry.location,
+            "lat": entry.lat,
+            "lng": entry.lng
         })
     if request.method == 'PUT':
-        entry.title = request.json.get('title', entry.title)
-        entry.content = request.json.get('content', entry.content)
-        entry.mood = request.json.get('mood', entry.mood)
-        entry.location = request.json.get('location', entry.location)
+        data = request.json
+        try:
+            lat, lng = import_point(data)
+            location = import_text(data, 'location', 100, required=False) if 'location' in data else entry.location
+        except ValueError as e: return jsonify({"error": str(e)}), 400
+        old_mood, old_point, old_text = entry.mood, (entry.lat, entry.lng), (entry.title, entry.content)
+        entry.title = data.get('title', entry.title)
+        entry.content = data.get('content', entry.content)
+        if (entry.title, entry.content) != old_text:
+            index_journal_entry(entry)
+        entry.mood = data.get('mood', entry.mood)
+        # A new pin wins (and is relabelled unless a name came with it); a renamed place is geocoded again
+        if lat is None:
+            lat, lng = old_point if location == entry.location else (None, None)
+        elif 'location' not in data and (lat, lng) != old_point:
+            location = None
+        entry.location, entry.lat, entry.lng = resolve_location(location, lat, lng)
+        if entry.mood != old_mood or (entry.lat, entry.lng) != old_point:
+            bump_heatmap(*old_point, old_mood, -1)
+            bump_heatmap(entry.lat, entry.lng, entry.mood, +1)
+        if entry.mood != old_mood:
+            bump_mood_rollup(entry.user_id, entry.timestamp, old_mood, -1)
+            bump_mood_rollup(entry.user_id, entry.timestamp, entry.mood, +1)
         db.session.commit()
         return jsonify({"message": "Entry updated."})
     if request.method == 'DELETE':
+        unindex_journal_entry(entry.id)
+        bump_heatmap(entry.lat, entry.lng, entry.mood, -1)
+        bump_mood_rollup(entry.user_id, entry.timestamp, entry.mood, -1)
         db.session.delete(entry)
         db.session.commit()
         return jsonify({"message": "Entry deleted."})
 
 # SECTION 5: HEATMAP API
-@app.route('/api/heatmap', methods=['GET'])
+@bp.route('/api/heatmap', methods=['GET'])
 def get_heatmap_data():
-    all_entries = JournalEntry.query.filter(JournalEntry.lat != None).all()
-    heatmap_data = []
-    for entry in all_entries:
-        safe_lat = entry.lat + random.uniform(-0.01, 0.01)
-        safe_lng = entry.lng + random.uniform(-0.01, 0.01)
-        heatmap_data.append({"lat": safe_lat, "lng": safe_lng, "mood": entry.mood})
-    return jsonify(heatmap_data)
+    # ?zoom=<map zoom>&bbox=<west>,<south>,<east>,<north>; no bbox means the whole world
+    level = heatmap_level_for_zoom(request.args.get('zoom', 2, type=int))
+    size = 360.0 / 2 ** level
+    try:
+        west, south, east, north = [float(v) for v in request.args.get('bbox', '-180,-90,180,90').split(',')]
+        if not all(map(math.isfinite, (west, south, east, north))): raise ValueError
+    except ValueError:
+        return jsonify({"error": "bbox must be west,south,east,north"}), 400
+    if east - west >= 360:
+        west, east = -180.0, 180.0 - 1e-9
+    else:  # Leaflet reports unwrapped longitudes once the map is panned around the globe
+        west, east = (west + 180) % 360 - 180, (east + 180) % 360 - 180
+    south, north = max(south, -90.0), min(north, 90.0 - 1e-9)
+
+    (x_min, y_min), (x_max, y_max) = heatmap_cell(south, west, level), heatmap_cell(north, east, level)
+    cells = HeatmapCell.query.filter(HeatmapCell.level == level, HeatmapCell.count > 0, HeatmapCell.cell_y.between(y_min, y_max))
+    if west <= east:
+        cells = cells.filter(HeatmapCell.cell_x.between(x_min, x_max))
+    else:  # the box crosses the antimeridian
+        cells = cells.filter(db.or_(HeatmapCell.cell_x >= x_min, HeatmapCell.cell_x <= x_max))
+
+    grouped = {}
+    for c in cells.order_by(HeatmapCell.cell_x, HeatmapCell.cell_y, HeatmapCell.mood):
+        cell = grouped.setdefault((c.cell_x, c.cell_y), {
+            "lat": round((c.cell_y + 0.5) * size - 90, 4), "lng": round((c.cell_x + 0.5) * size - 180, 4), "count": 0, "moods": {}
+        })
+        cell["count"] += c.count
+        cell["moods"][c.mood] = c.count
+
+    response = jsonify({"level": level, "cell_size": size, "cells": list(grouped.values())})
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    response.add_etag()
+    return response.make_conditional(request)
 
 # SECTION 6: PROFILE & COMMUNITY API
-@app.route('/api/profile', methods=['GET', 'POST'])
+@bp.route('/api/profile', methods=['GET', 'POST'])
 @user_login_required
 def manage_profile():
-    user = db.session.get(User, session['user_id'])
+    user = current_user()
     if request.method == 'POST':
         user.profile_info = request.json.get('profile_info', '')
         db.session.commit()
         return jsonify({"message": "Profile updated."})
     return jsonify({"profile_info": user.profile_info})
 
-@app.route('/api/pin', methods=['PUT'])
+@bp.route('/api/pin', methods=['PUT'])
 @user_login_required
 def change_pin():
     data = request.json
-    user = db.session.get(User, session['user_id'])
-    if not user.check_pin(data.get('old_pin')): return jsonify({"error": "Incorrect old PIN."}), 403
-    user.set_pin(data.get('new_pin'))
+    user = current_user()
+    user_id, pin_hash = user.id, user.pin_hash
+    db.session.commit()  # no pooled connection held while the PINs are hashed
+    if not verify_pin(pin_hash, data.get('old_pin')): return jsonify({"error": "Incorrect old PIN."}), 403
+    db.session.execute(db.update(User).where(User.id == user_id).values(pin_hash=hash_pin(data.get('new_pin'))))
     db.session.commit()
     return jsonify({"message": "PIN changed successfully."})
 
-@app.route('/api/community/message', methods=['GET', 'POST'])
+@bp.route('/api/export', methods=['GET'])
 @user_login_required
+def export_data():
+    # ?zip=1 for a zipped download; streamed, so a long history never sits in memory
+    user = current_user()
+    zipped = request.args.get('zip') in ('1', 'true')
+    return Response(stream_with_context(export_chunks(user, zipped)),
+                    mimetype='application/zip' if zipped else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{export_filename(user, zipped)}"', 'Cache-Control': 'no-store'})
+
+@bp.route('/api/import', methods=['POST'])
+@user_login_required
+def import_data():
+    # Body: a file from /api/export (NDJSON or zipped); everything is imported or nothing is
+    too_large = jsonify({"error": f"Imports are limited to {IMPORT_MAX_BYTES // (1024 * 1024)} MB."}), 413
+    if (request.content_length or 0) > IMPORT_MAX_BYTES: return too_large
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as upload:
+        received = 0
+        while chunk := request.stream.read(64 * 1024):
+            received += len(chunk)
+            if received > IMPORT_MAX_BYTES: return too_large
+            upload.write(chunk)
+        upload.seek(0)
+        try:
+            counts = import_records(session['user_id'], ndjson_lines(upload))
+        except ValueError as e: return jsonify({"error": str(e)}), 400
+    return jsonify(counts), 201
+
+@bp.route('/api/community/message', methods=['GET', 'POST'])
+@user_login_required
+@rate_limited('community_message')
 def community_message():
-    user = db.session.get(User, session['user_id'])
+    user = current_user()
     if request.method == 'POST':
         message_text = request.json.get('message_text')
-        if not message_text: return jsonify({"error": "Message cannot be empty."}), 400
-        message = CommunityMessage.query.filter_by(submitted_by_username=user.username).first()
+        if not isinstance(message_text, str): return jsonify({"error": "Message must be text."}), 400
+        if not message_text.strip(): return jsonify({"error": "Message cannot be empty."}), 400
+        user_id, username = user.id, user.username  # read before the commit below expires them
+        # Decide instantly when rules or the cache can; otherwise queue it for the batch worker
+        status, reason = cached_verdict(message_text) or ("pending", None)
+        message = CommunityMessage.query.filter_by(submitted_by_username=username).first()
         if not message:
-            message = CommunityMessage(submitted_by_username=user.username)
+            message = CommunityMessage(submitted_by_username=username)
             db.session.add(message)
         message.text = message_text
-        message.status = 'pending'
-        try:
-            completion = client.chat.completions.create(messages=[{"role": "system", "content": SYSTEM_PROMPT_MODERATOR}, {"role": "user", "content": message_text}], model="openai/gpt-oss-120b", temperature=0.0, response_format={"type": "json_object"})
-            mod_result = json.loads(completion.choices[0].message.content)
-            message.status = "approved" if mod_result.get("decision") == "APPROVE" else "rejected"
-            message.reason = mod_result.get("reason")
-        except: message.status, message.reason = "rejected", "Moderation failed."
+        message.status, message.reason = status, reason
+        message.claimed_by = message.claimed_until = None
         db.session.commit()
-        return jsonify({"status": message.status, "reason": message.reason})
-
+        if status == "pending":
+            # Moderated later in a batch, outside this request; charge the user's share up front
+            charge_model_tokens('community_message', user_id, estimate_tokens(message_text))
+            ensure_moderation_worker()
+            moderation_wakeup.set()
+        return jsonify({"status": status, "reason": reason})
+
+    ensure_moderation_worker()
     message = CommunityMessage.query.filter_by(submitted_by_username=user.username).first()
-    if message: return jsonify({"text": message.text, "status": message.status})
+    if message: return jsonify({"text": message.text, "status": message.status, "reason": message.reason})
     return jsonify({"status": "not_found"})
 
-@app.route('/api/community/messages/approved', methods=['GET'])
+@bp.route('/api/community/messages/approved', methods=['GET'])
 def get_approved_messages():
-    approved = CommunityMessage.query.filter_by(status='approved').all()
-    return jsonify([msg.text for msg in approved])
+    try:
+        approved, next_cursor = keyset_page(
+            CommunityMessage.query.with_entities(CommunityMessage.id, CommunityMessage.text, CommunityMessage.timestamp).filter_by(status='approved'),
+            CommunityMessage.timestamp, CommunityMessage.id)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    return jsonify({"items": [msg.text for msg in approved], "next_cursor": next_cursor})
 
 # SECTION 7: OTHER RESOURCES
-@app.route('/find-nearby', methods=['POST'])
+@bp.route('/metrics')
+def metrics():
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return jsonify({"error": "Unauthorized"}), 401
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+@bp.route('/audio/<filename>')
+def audio_track(filename):
+    """A meditation track, with Range/206 and conditional-request support from send_file."""
+    quality = request.args.get('quality')
+    if quality is not None and quality not in AUDIO_QUALITIES:
+        return jsonify({"error": f"quality must be one of: {', '.join(AUDIO_QUALITIES)}."}), 400
+    rungs = ASSET_MANIFEST.get('audio', {}).get(filename)
+    source = safe_join(AUDIO_FOLDER, filename)
+    if not filename.lower().endswith('.mp3') or not (rungs or (source and os.path.isfile(source))):
+        return jsonify({"error": "Track not found."}), 404
+
+    chosen = quality or audio_quality_from_hints(request.headers)
+    if rungs and chosen in rungs:
+        # Each rung is its own file with its own ETag, so If-Range never splices two encodings
+        response = send_from_directory(current_app.static_folder, rungs[chosen], mimetype='audio/mpeg', max_age=AUDIO_MAX_AGE)
+    else:
+        chosen = 'source'
+        response = send_from_directory(AUDIO_FOLDER, filename, mimetype='audio/mpeg', max_age=AUDIO_MAX_AGE)
+    response.headers['X-Audio-Quality'] = chosen
+    if quality is None:
+        response.vary.update(AUDIO_CLIENT_HINTS)
+    return response
+
+@bp.route('/find-nearby', methods=['POST'])
 def find_nearby():
     return jsonify([])
 
 # --- FLASK CLI COMMANDS ---
-@app.route('/force-init-db')
-def force_init_db():
-    try:
-        with app.app_context():
-            db.create_all()
-        return "✅ Database tables created. You can now use the app."
-    except Exception as e:
-        return f"⚠️ Error: {e}"
-        
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Creates missing tables and applies pending schema migrations."""
+    applied = ensure_schema()
+    click.echo(f"Applied: {', '.join(applied)}" if applied else "Schema is up to date.")
+
+@bp.cli.command('rebuild-heatmap')
+def rebuild_heatmap_command():
+    """Rebuilds the heatmap aggregates from existing journal entries."""
+    click.echo(f"Heatmap rebuilt from {rebuild_heatmap()} located entries.")
+
+@bp.cli.command('rebuild-mood-rollups')
+def rebuild_mood_rollups_command():
+    """Rebuilds the per-user mood trend rollups from existing journal entries."""
+    click.echo(f"Mood rollups rebuilt from {rebuild_mood_rollups()} journal entries.")
+
+@bp.cli.command('rebuild-journal-index')
+def rebuild_journal_index_command():
+    """Rebuilds the journal retrieval index used to ground chats."""
+    click.echo(f"Journal index rebuilt from {rebuild_journal_index()} journal entries.")
+
+@bp.cli.command('export-user')
+@click.argument('username')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="Defaults to bigsister-<username>-<date>.ndjson[.zip].")
+@click.option('--zip', 'zipped', is_flag=True, help="Write a zip archive.")
+def export_user_command(username, output, zipped):
+    """Exports a user's journal and chats as NDJSON, streamed to the file."""
+    user = User.query.filter_by(username=username).first()
+    if not user: raise click.ClickException(f"No user named {username}.")
+    output = output or export_filename(user, zipped)
+    with open(output, 'wb') as f:
+        for chunk in export_chunks(user, zipped):
+            f.write(chunk)
+    click.echo(f"Wrote {output}")
+
+@bp.cli.command('import-user-data')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_user_data_command(username, path):
+    """Imports an export file (NDJSON or zipped) into an existing user's account."""
+    user = User.query.filter_by(username=username).first()
+    if not user: raise click.ClickException(f"No user named {username}.")
+    with open(path, 'rb') as f:
+        try:
+            counts = import_records(user.id, ndjson_lines(f))
+        except ValueError as e: raise click.ClickException(str(e))
+    click.echo("Imported " + ", ".join(f"{v} {k.replace('_', ' ')}" for k, v in counts.items()) + ".")
+
+@bp.cli.command('moderate-queue')
+@click.option('--once', is_flag=True, help="Drain the queue once and exit instead of polling; fails on the first failed batch.")
+def moderate_queue_command(once):
+    """Runs the Wall of Support moderation worker (use with MODERATION_WORKER=external)."""
+    while True:
+        try:
+            drain_moderation_queue(max_failures=1 if once else None)
+        except Exception as e: raise click.ClickException(f"Moderation batch failed: {e}")
+        if once: return
+        time.sleep(MODERATION_POLL_SECONDS)
+
+
+
+# --- APP FACTORY ---
+def create_app(config=None):
+    """Builds the app. Opens no database connection and creates no Groq client; both happen on first use.
+
+    config overrides the settings read from the environment (e.g. SQLALCHEMY_DATABASE_URI).
+    """
+    app = Flask(__name__, static_folder=STATIC_FOLDER, template_folder=os.path.join(BASE_DIR, 'templates'))
+    app.secret_key = os.environ.get("FLASK_SECRET_KEY")
+    app.config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URL or DEFAULT_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    CORS(app, supports_credentials=True)
+    db.init_app(app)
+    app.register_blueprint(bp)
+    app.view_functions['static'] = serve_static
+    created_apps.add(app)  # its pools are dropped in forked children
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        ensure_schema()
         print("✅ Database tables ensured.")
+    ensure_moderation_worker(app)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,117 @@
+# FILE: gunicorn.conf.py
+#
+# Production server configuration:   gunicorn -c gunicorn.conf.py app:app
+#
+# Build the static assets first (python scripts/build_assets.py); each worker reads
+# static/dist/manifest.json once at import.
+#
+# The LLM-bound endpoints (/api/chat, POST /api/sessions, POST /api/community/message)
+# spend almost all of their time waiting on Groq. With the classic "sync" worker each
+# waiting request pins a whole process, so concurrency == worker count. The default here
+# is the cooperative "gevent" worker: the standard library (sockets, ssl, threading, time)
+# is monkey-patched so the Groq/httpx client yields while it waits, and one process can
+# hold hundreds of outstanding model calls. The Flask views stay unchanged.
+#
+# Environment:
+#   PORT                       bind port (default 8000)
+#   WEB_CONCURRENCY            worker processes (default: CPU count)
+#   GUNICORN_WORKER_CLASS      gevent (default), gthread or sync
+#   GUNICORN_WORKER_CONNECTIONS  max concurrent requests per gevent worker (default 500)
+#   GUNICORN_THREADS           threads per gthread worker (default 32)
+#   GUNICORN_TIMEOUT           worker timeout in seconds (default 120, streams can be long)
+#   GUNICORN_PRELOAD           import the app once in the master and fork workers from it
+#                              (default 1); new workers then start in milliseconds
+#   SCHEMA_ON_START            run the schema migrations once in the master before any
+#                              worker starts (default 1); otherwise run `flask db-upgrade`
+#
+# Preloading is fork-safe: app.py opens no database connection or Groq client at import,
+# and every forked child drops the pool it inherited from the master. Under gevent the
+# master is monkey-patched here, before the app is imported, rather than by each worker.
+#
+# Pool sizing: with gevent, many requests share one process, so size the SQLAlchemy pool
+# (DB_POOL_SIZE / DB_MAX_OVERFLOW) for the number of requests *touching the database* at
+# once, not for the number of outstanding model calls; api_chat no longer holds a
+# connection across the LLM call. On Postgres, psycogreen makes psycopg2 cooperative.
+#
+# uvicorn can serve the app through its WSGI interface (`uvicorn --interface wsgi app:app`),
+# but that runs each request on a thread pool, so every model call still blocks a thread.
+#
+# Compare modes with: python scripts/bench_concurrency.py
+#
+# Rate limits: the per-user buckets (RATE_LIMITS in app.py) are kept in a SQLite file that all
+# workers open, RATE_LIMIT_DB (default: one file per database in the temp directory). It must
+# be on a local disk every worker can see; with several hosts, each enforces its own limits.
+#
+# PIN hashing: each worker hashes PINs in its own pool of PIN_HASH_WORKERS spawned processes
+# (default 1), so the host runs WEB_CONCURRENCY x PIN_HASH_WORKERS hashing processes at most.
+# Raising the cost (PIN_HASH_METHOD) rehashes each account at its next login.
+#
+# Metrics: set PROMETHEUS_MULTIPROC_DIR to a writable directory so every worker records its
+# metrics there and /metrics reports totals across workers. This file creates and empties it
+# when gunicorn loads it, before the app is imported (by the master, when preloading); other
+# processes that import app.py with it set (flask CLI) need it to exist.
+
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))
+threads = int(os.environ.get("GUNICORN_THREADS", 32)) if worker_class == "gthread" else 1
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+keepalive = 5
+accesslog = "-"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if metrics_dir:
+    # Now rather than in on_starting: with preload the master imports app.py (whose metrics open
+    # files in this directory) before that hook runs
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        os.remove(os.path.join(metrics_dir, name))
+
+if worker_class == "gevent":
+    # Locks, events and sockets the app creates at import must already be cooperative
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def post_fork(server, worker):
+    # gunicorn's gevent worker patches the standard library itself; the Postgres driver
+    # is a C extension and needs its wait callback installed separately.
+    if worker_class != "gevent":
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+
+def post_worker_init(worker):
+    # Moderate whatever a restart left pending now, not at the first visit to the wall
+    from app import ensure_moderation_worker
+    ensure_moderation_worker(worker.wsgi)
+
+
+def on_starting(server):
+    if os.environ.get("SCHEMA_ON_START", "1") == "1":
+        # Once, before any worker serves a request; workers never touch the schema
+        if preload_app:
+            from app import app, ensure_schema
+            with app.app_context():
+                applied = ensure_schema()
+            if applied:
+                server.log.info("Applied migrations: %s", ", ".join(applied))
+        else:  # importing the app here would preload it after all
+            subprocess.run([sys.executable, "-m", "flask", "--app", "app", "db-upgrade"], check=True)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
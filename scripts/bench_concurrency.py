@@ -0,0 +1,117 @@
+# FILE: scripts/bench_concurrency.py
+#
+# Compares gunicorn worker classes on the LLM-bound /api/chat path. Starts the fake Groq
+# server, then for each worker class boots gunicorn with gunicorn.conf.py against a
+# throwaway SQLite database, fires concurrent chat turns and reports throughput and
+# latency percentiles.
+#
+#   python scripts/bench_concurrency.py --clients 200 --requests 400 --latency 1.0
+#
+# Expected shape: sync workers top out at (workers / latency) req/s, while gevent
+# approaches (clients / latency) until the CPU or the database becomes the limit.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def login_client(base_url, index):
+    http = requests.Session()
+    http.post(f"{base_url}/api/signup", json={"username": f"bench{index:04d}", "pin": "1234"})
+    session_id = http.post(f"{base_url}/api/sessions", json={"quiz_answers": []}).json()["id"]
+    return http, session_id
+
+
+def run_mode(worker_class, args, groq_url):
+    port = str(args.port)
+    base_url = f"http://127.0.0.1:{port}"
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = dict(os.environ, PORT=port, GROQ_BASE_URL=groq_url, GROQ_API_KEY="bench", FLASK_SECRET_KEY="bench",
+               DATABASE_URL=f"sqlite:///{db_path}", GUNICORN_WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY=str(args.workers), RATE_LIMIT_ENABLED="0")  # the clients chat far faster than a person
+    subprocess.run([sys.executable, "-c", "import app; app.app.app_context().push(); app.ensure_schema()"],
+                   cwd=ROOT, env=env, check=True)
+    server = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null", "app:app"],
+                              cwd=ROOT, env=env)
+    try:
+        wait_for(base_url + "/login")
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            clients = list(pool.map(lambda i: login_client(base_url, i), range(args.clients)))
+
+            def chat_turn(i):
+                http, session_id = clients[i % len(clients)]
+                start = time.perf_counter()
+                response = http.post(f"{base_url}/api/chat", json={"session_id": session_id, "message": "Today was a lot."})
+                return time.perf_counter() - start, response.status_code == 200
+
+            started = time.perf_counter()
+            results = list(pool.map(chat_turn, range(args.requests)))
+            elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [r[0] for r in results]
+    errors = sum(1 for r in results if not r[1])
+    return {
+        "mode": worker_class,
+        "rps": len(results) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": percentile(latencies, 99),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare gunicorn worker classes on /api/chat.")
+    parser.add_argument("--modes", default="sync,gevent")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake Groq latency in seconds")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--groq-port", type=int, default=8765)
+    args = parser.parse_args()
+
+    groq_url = f"http://127.0.0.1:{args.groq_port}"
+    fake_groq = subprocess.Popen([sys.executable, os.path.join(ROOT, "scripts", "fake_groq.py"),
+                                  "--port", str(args.groq_port), "--latency", str(args.latency)])
+    try:
+        time.sleep(0.5)
+        rows = [run_mode(mode, args, groq_url) for mode in args.modes.split(",")]
+    finally:
+        fake_groq.terminate()
+
+    print(f"\n{args.requests} chat turns, {args.clients} concurrent clients, {args.workers} workers, {args.latency}s model latency")
+    print(f"{'mode':<8} {'req/s':>8} {'p50 (s)':>8} {'p99 (s)':>8} {'errors':>7}")
+    for row in rows:
+        print(f"{row['mode']:<8} {row['rps']:>8.1f} {row['p50']:>8.2f} {row['p99']:>8.2f} {row['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
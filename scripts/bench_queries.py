@@ -0,0 +1,117 @@
+# FILE: scripts/bench_queries.py
+#
+# Seeds a database, then reports query plans and timings for the app's hot queries
+# without the hot-path indexes ("before") and with them ("after").
+#
+#   python scripts/bench_queries.py                                   # throwaway SQLite file
+#   python scripts/bench_queries.py --database-url postgresql://localhost/bigsister_bench
+#
+# The target database is seeded in place, so point it at a scratch database.
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import seed_data
+
+REPEAT = 50
+
+
+def hot_queries(bigsister, db):
+    """The app's hot queries as (name, statement), with realistic parameters picked from the data."""
+    messages, sessions = bigsister.ChatMessage.__table__, bigsister.ChatSession.__table__
+    entries, wall = bigsister.JournalEntry.__table__, bigsister.CommunityMessage.__table__
+    busy_session = db.session.execute(
+        db.select(messages.c.session_id).group_by(messages.c.session_id).order_by(db.func.count().desc()).limit(1)).scalar()
+    busy_user = db.session.execute(
+        db.select(entries.c.user_id).group_by(entries.c.user_id).order_by(db.func.count().desc()).limit(1)).scalar()
+    page = bigsister.PAGE_SIZE_DEFAULT + 1
+    return [
+        ("transcript page", db.select(messages.c.id, messages.c.role, messages.c.content, messages.c.timestamp)
+            .where(messages.c.session_id == busy_session).order_by(messages.c.timestamp.desc(), messages.c.id.desc()).limit(page)),
+        ("chat context window", db.select(messages.c.id, messages.c.role, messages.c.content)
+            .where(messages.c.session_id == busy_session, messages.c.id > 0).order_by(messages.c.id.desc())
+            .limit(bigsister.CHAT_HISTORY_MAX_MESSAGES * 2)),
+        ("session list", db.select(sessions.c.id, sessions.c.name, sessions.c.start_time)
+            .where(sessions.c.user_id == busy_user).order_by(sessions.c.start_time.desc(), sessions.c.id.desc()).limit(page)),
+        ("journal list", db.select(entries.c.id, entries.c.title, entries.c.mood, entries.c.timestamp)
+            .where(entries.c.user_id == busy_user).order_by(entries.c.timestamp.desc(), entries.c.id.desc()).limit(page)),
+        ("located entries", db.select(entries.c.lat, entries.c.lng, entries.c.mood).where(entries.c.lat.isnot(None))),
+        ("approved wall", db.select(wall.c.id, wall.c.text, wall.c.timestamp)
+            .where(wall.c.status == 'approved').order_by(wall.c.timestamp.desc(), wall.c.id.desc()).limit(page)),
+        ("moderation queue", db.select(wall.c.id).where(wall.c.status == 'pending').order_by(wall.c.timestamp)
+            .limit(bigsister.MODERATION_BATCH_SIZE)),
+    ]
+
+
+def explain(db, statement):
+    sql = str(statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if db.engine.dialect.name == "sqlite" else "EXPLAIN "
+    rows = db.session.execute(db.text(prefix + sql)).all()
+    return [row[-1] for row in rows]
+
+
+def time_query(db, statement):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        db.session.execute(statement).all()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def measure(bigsister, db, label):
+    results = {}
+    print(f"\n=== {label} ===")
+    for name, statement in hot_queries(bigsister, db):
+        results[name] = time_query(db, statement)
+        print(f"\n-- {name}: {results[name]:.3f} ms (median of {REPEAT})")
+        for line in explain(db, statement):
+            print(f"   {line}")
+    return results
+
+
+def set_indexes(db, present):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True) if present else index.drop(db.engine, checkfirst=True)
+    with db.engine.begin() as conn:
+        conn.execute(db.text("ANALYZE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query-plan benchmark for the hot-path indexes.")
+    parser.add_argument("--database-url")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--sessions-per-user", type=int, default=5)
+    parser.add_argument("--messages-per-session", type=int, default=30)
+    parser.add_argument("--entries-per-user", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse data already in the database")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    import app as bigsister
+    db = bigsister.db
+
+    with bigsister.app.app_context():
+        bigsister.ensure_schema()
+        if not args.skip_seed:
+            started = time.perf_counter()
+            counts = seed_data.seed(args.users, args.sessions_per_user, args.messages_per_session, args.entries_per_user)
+            print(f"Seeded {', '.join(f'{v} {k}' for k, v in counts.items())} in {time.perf_counter() - started:.1f}s")
+
+        set_indexes(db, present=False)
+        before = measure(bigsister, db, "before: primary keys only")
+        set_indexes(db, present=True)
+        after = measure(bigsister, db, "after: hot-path indexes")
+
+    print(f"\n{'query':<22} {'before (ms)':>12} {'after (ms)':>12} {'speedup':>8}")
+    for name in before:
+        print(f"{name:<22} {before[name]:>12.3f} {after[name]:>12.3f} {before[name] / max(after[name], 1e-6):>7.1f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# FILE: scripts/bench_startup.py
+#
+# Measures cold start against a throwaway SQLite database:
+#   * importing app.py in a fresh interpreter (which builds the app via create_app())
+#   * the first requests after import: a rendered page, then the first database query
+#   * launching gunicorn with gunicorn.conf.py until it answers, with and without preload
+#
+#   python scripts/bench_startup.py
+#   python scripts/bench_startup.py --runs 10 --workers 4 --importtime
+#
+# --importtime also lists the slowest modules app.py imports at startup (python -X importtime).
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from bench_concurrency import ROOT
+
+# Runs in a fresh interpreter and prints its timings as JSON
+PROBE = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/login')
+page = time.perf_counter()
+client.get('/api/heatmap')
+query = time.perf_counter()
+print(json.dumps({"import": imported - started, "first page": page - imported, "first query": query - page}))
+"""
+
+
+def probe(env):
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env, limit):
+    """Direct imports of app.py by cumulative import time, in ms."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):  # a top-level import; its children were listed just before it
+            if name.strip() == "app":
+                break
+            rows = []
+        elif not name.startswith("    "):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def gunicorn_boot(env, preload, port):
+    """Seconds from launching gunicorn to its first successful response."""
+    env = dict(env, PORT=str(port), GUNICORN_PRELOAD="1" if preload else "0")
+    url = f"http://127.0.0.1:{port}/login"
+    started = time.perf_counter()
+    server = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null", "--log-level", "warning", "app:app"],
+                              cwd=ROOT, env=env)
+    try:
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                if requests.get(url, timeout=1).ok:
+                    return time.perf_counter() - started
+            except requests.RequestException:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"{url} did not come up")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark: import, first request and gunicorn boot times.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--worker-class", help="overrides GUNICORN_WORKER_CLASS")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--importtime", action="store_true", help="list the slowest imports")
+    parser.add_argument("--skip-gunicorn", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}", FLASK_SECRET_KEY="bench",
+               GROQ_API_KEY="bench", WEB_CONCURRENCY=str(args.workers))
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    if args.worker_class:
+        env["GUNICORN_WORKER_CLASS"] = args.worker_class
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "db-upgrade"], cwd=ROOT, env=env, check=True, capture_output=True)
+
+    samples = [probe(env) for _ in range(args.runs)]
+    print(f"In-process, median of {args.runs} fresh interpreters:")
+    for step in samples[0]:
+        print(f"  {step:<14} {statistics.median(s[step] for s in samples) * 1000:>8.1f} ms")
+
+    if args.importtime:
+        print("\nSlowest imports in app.py (cumulative):")
+        for ms, name in slowest_imports(env, 12):
+            print(f"  {name:<40} {ms:>8.1f} ms")
+
+    if not args.skip_gunicorn:
+        print(f"\ngunicorn launch to first response, {args.workers} workers, median of {args.runs}:")
+        for preload in (False, True):
+            boots = [gunicorn_boot(env, preload, args.port) for _ in range(args.runs)]
+            print(f"  {'preload' if preload else 'no preload':<14} {statistics.median(boots) * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# FILE: scripts/build_assets.py
+#
+# Builds static/dist/ for production. Run it at deploy time, before starting gunicorn:
+#
+#   python scripts/build_assets.py
+#
+#   * css/ and js/ are copied under content-hashed names (style.3f2a91c0.css) and get
+#     precompressed .gz and .br siblings (brotli is optional).
+#   * Every PNG under img/ is copied under a hashed name and resized to WebP and AVIF
+#     variants at each of WIDTHS (never upscaled), for <picture>/srcset.
+#   * Every MP3 under audio/ is re-encoded with ffmpeg at each rung of AUDIO_LADDER, for
+#     the /audio/<track> endpoint. Skipped when ffmpeg is not on PATH.
+#   * static/dist/manifest.json maps source paths to the built files. app.py reads it:
+#     url_for('static', ...) resolves to the hashed name, responses from dist/ are sent
+#     with "Cache-Control: immutable", covers are rendered with srcset and /audio picks
+#     a bitrate per listener.
+#
+# Without a build the app falls back to the original files in static/.
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from io import BytesIO
+
+try:
+    from PIL import Image, features
+except ImportError:
+    sys.exit("build_assets.py needs Pillow: pip install Pillow")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC = os.path.join(ROOT, "static")
+DIST = os.path.join(STATIC, "dist")
+
+WIDTHS = (320, 640, 1024)
+TEXT_DIRS = ("css", "js")
+IMAGE_DIRS = ("img",)
+COMPRESSIBLE = (".css", ".js", ".svg", ".json")
+IMAGE_FORMATS = {"avif": {"quality": 55}, "webp": {"quality": 78, "method": 6}}
+AUDIO_DIRS = ("audio",)
+# The tracks are mono speech, so neither rung needs stereo or a full-band sample rate
+AUDIO_LADDER = {
+    "low": ["-ac", "1", "-ar", "22050", "-b:a", "32k"],
+    "standard": ["-ac", "1", "-ar", "44100", "-b:a", "96k"],
+}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:8]
+
+
+def write_hashed(relpath, data):
+    """Writes data under dist/ with the content hash in its name; returns the static-relative path."""
+    stem, ext = os.path.splitext(relpath)
+    hashed = f"dist/{stem}.{content_hash(data)}{ext}".replace(os.sep, "/")
+    target = os.path.join(STATIC, hashed)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as f:
+        f.write(data)
+    if ext in COMPRESSIBLE:
+        precompress(target, data)
+    return hashed
+
+
+def precompress(target, data):
+    """Writes .gz and .br siblings, skipping any that would not be smaller."""
+    encoded = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        encoded[".br"] = brotli.compress(data, quality=11)
+    for suffix, blob in encoded.items():
+        if len(blob) < len(data):
+            with open(target + suffix, "wb") as f:
+                f.write(blob)
+
+
+def walk(*dirs):
+    for top in dirs:
+        for folder, _, names in os.walk(os.path.join(STATIC, top)):
+            for name in sorted(names):
+                path = os.path.join(folder, name)
+                yield path, os.path.relpath(path, STATIC).replace(os.sep, "/")
+
+
+def build_image(path, relpath, formats, files):
+    """Writes the hashed original plus resized variants; returns the manifest entry."""
+    with open(path, "rb") as f:
+        files[relpath] = write_hashed(relpath, f.read())
+    stem, _ = os.path.splitext(relpath)
+    with Image.open(path) as source:
+        source.load()
+        width, height = source.size
+        entry = {"width": width, "height": height}
+        for fmt in formats:
+            entry[fmt] = []
+            for target_width in sorted({min(w, width) for w in WIDTHS}):
+                variant = source if target_width == width else source.resize(
+                    (target_width, round(height * target_width / width)), Image.LANCZOS)
+                target_rel = f"{stem}-{target_width}w.{fmt}"
+                buffer = BytesIO()
+                variant.save(buffer, fmt.upper(), **IMAGE_FORMATS[fmt])
+                files[target_rel] = write_hashed(target_rel, buffer.getvalue())
+                entry[fmt].append([target_width, files[target_rel]])
+    return entry
+
+
+def build_audio(ffmpeg, path, relpath):
+    """Encodes each rung of AUDIO_LADDER; returns {rung: built path}."""
+    stem, ext = os.path.splitext(relpath)
+    rungs = {}
+    for rung, options in AUDIO_LADDER.items():
+        encoded = subprocess.run(
+            [ffmpeg, "-v", "error", "-i", path, "-vn", "-map_metadata", "0", "-c:a", "libmp3lame", *options, "-f", "mp3", "pipe:1"],
+            check=True, stdout=subprocess.PIPE).stdout
+        rungs[rung] = write_hashed(f"{stem}-{rung}{ext}", encoded)
+    return rungs
+
+
+def build():
+    shutil.rmtree(DIST, ignore_errors=True)
+    formats = [fmt for fmt in IMAGE_FORMATS if features.check(fmt)]
+    ffmpeg = shutil.which("ffmpeg")
+    files, images, audio = {}, {}, {}
+
+    for path, relpath in walk(*TEXT_DIRS):
+        with open(path, "rb") as f:
+            files[relpath] = write_hashed(relpath, f.read())
+    for path, relpath in walk(*IMAGE_DIRS):
+        if relpath.lower().endswith(".png"):
+            images[relpath] = build_image(path, relpath, formats, files)
+    if ffmpeg:
+        for path, relpath in walk(*AUDIO_DIRS):
+            if relpath.lower().endswith(".mp3"):
+                audio[os.path.basename(relpath)] = build_audio(ffmpeg, path, relpath)
+
+    manifest = {"files": files, "images": images, "audio": audio}
+    with open(os.path.join(DIST, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest, formats, bool(ffmpeg)
+
+
+def report(manifest):
+    def size(relpath):
+        return os.path.getsize(os.path.join(STATIC, relpath))
+
+    for source, entry in manifest["images"].items():
+        variants = ", ".join(f"{fmt} {w}w {size(p) // 1024} KB" for fmt in IMAGE_FORMATS for w, p in entry.get(fmt, []))
+        print(f"{source}: {size(source) // 1024} KB -> {variants}")
+    for source, built in manifest["files"].items():
+        if source.endswith(COMPRESSIBLE):
+            path = os.path.join(STATIC, built)
+            sizes = [f"{suffix} {os.path.getsize(path + suffix) // 1024} KB"
+                     for suffix in (".gz", ".br") if os.path.exists(path + suffix)]
+            print(f"{source}: {size(built) // 1024} KB -> {built} ({', '.join(sizes) or 'not compressed'})")
+    for track, rungs in manifest["audio"].items():
+        variants = ", ".join(f"{rung} {size(path) // 1024} KB" for rung, path in rungs.items())
+        print(f"audio/{track}: {size('audio/' + track) // 1024} KB -> {variants}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build hashed, resized and precompressed static assets into static/dist/.")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    manifest, formats, encoded_audio = build()
+    if not encoded_audio:
+        print("ffmpeg is not on PATH; audio tracks were not re-encoded and will be served as-is")
+    if not brotli:
+        print("brotli is not installed; only .gz siblings were written")
+    missing = set(IMAGE_FORMATS) - set(formats)
+    if missing:
+        print(f"This Pillow build cannot encode {', '.join(sorted(missing))}; those variants were skipped")
+    if not args.quiet:
+        report(manifest)
+    print(f"Wrote {len(manifest['files'])} files to {os.path.relpath(DIST, ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
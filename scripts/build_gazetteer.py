@@ -0,0 +1,361 @@
+# FILE: scripts/build_gazetteer.py
+#
+# Builds data/gazetteer.tsv and data/countries.tsv, the place list the app geocodes journal
+# locations against (see GEOCODING in app.py). No network access is needed.
+#
+#   python scripts/build_gazetteer.py                          # the bundled list
+#   python scripts/build_gazetteer.py --geonames cities15000.txt
+#
+# The bundled list is the representative city of every time zone (zone.tab from the system's
+# tz database) merged with CURATED_PLACES, which adds populations, common spellings and the
+# big cities that are not time zone names. For full coverage pass a GeoNames cities dump
+# (https://download.geonames.org/export/dump/, e.g. cities15000.txt: ~33k places, ~3 MB).
+#
+# gazetteer.tsv columns: name, country code, latitude, longitude, population, alternate names
+# (comma-separated). countries.tsv: country code, country name (a code's later rows are aliases).
+
+import argparse
+import os
+import re
+import sys
+import unicodedata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "data")
+MAX_ALTERNATES = 8
+
+# name|country|lat|lng|population|alternate names
+CURATED_PLACES = """
+Toronto|CA|43.6532|-79.3832|2794356|
+Montreal|CA|45.5017|-73.5673|1762949|Montréal
+Vancouver|CA|49.2827|-123.1207|662248|
+Calgary|CA|51.0447|-114.0719|1306784|
+Edmonton|CA|53.5461|-113.4938|1010899|
+Ottawa|CA|45.4215|-75.6972|1017449|
+Winnipeg|CA|49.8951|-97.1384|749607|
+Quebec City|CA|46.8139|-71.2080|549459|Quebec,Québec
+Hamilton|CA|43.2557|-79.8711|569353|
+Mississauga|CA|43.5890|-79.6441|717961|
+Brampton|CA|43.7315|-79.7624|656480|
+Surrey|CA|49.1913|-122.8490|568322|
+Kitchener|CA|43.4516|-80.4925|256885|
+London|CA|42.9849|-81.2453|422324|
+Markham|CA|43.8561|-79.3370|338503|
+Vaughan|CA|43.8361|-79.4983|323103|
+Gatineau|CA|45.4765|-75.7013|291041|
+Saskatoon|CA|52.1332|-106.6700|266141|
+Burnaby|CA|49.2488|-122.9805|249125|
+Regina|CA|50.4452|-104.6189|226404|
+Richmond|CA|49.1666|-123.1336|209937|
+Halifax|CA|44.6488|-63.5752|439819|
+Windsor|CA|42.3149|-83.0364|229660|
+Sherbrooke|CA|45.4042|-71.8929|172950|
+Oshawa|CA|43.8971|-78.8658|166000|
+Sudbury|CA|46.4917|-80.9930|166004|
+Abbotsford|CA|49.0504|-122.3045|153524|
+Barrie|CA|44.3894|-79.6903|147829|
+Kelowna|CA|49.8880|-119.4960|144576|
+Guelph|CA|43.5448|-80.2482|143740|
+Kingston|CA|44.2312|-76.4860|132485|
+Waterloo|CA|43.4643|-80.5204|121436|
+St. John's|CA|47.5615|-52.7126|110525|St Johns
+Thunder Bay|CA|48.3809|-89.2477|108843|
+Red Deer|CA|52.2690|-113.8116|100844|
+Nanaimo|CA|49.1659|-123.9401|99863|
+Lethbridge|CA|49.6956|-112.8451|98406|
+Victoria|CA|48.4284|-123.3656|91867|
+Moncton|CA|46.0878|-64.7782|79470|
+Prince George|CA|53.9171|-122.7497|74003|
+Sherwood Park|CA|53.5412|-113.2957|71332|
+Fort McMurray|CA|56.7268|-111.3790|68002|
+St. Albert|CA|53.6305|-113.6256|68232|St Albert
+Fredericton|CA|45.9636|-66.6431|63116|
+Charlottetown|CA|46.2382|-63.1311|38809|
+Whitehorse|CA|60.7212|-135.0568|28201|
+Yellowknife|CA|62.4540|-114.3718|20340|
+Iqaluit|CA|63.7467|-68.5170|7429|
+New York|US|40.7128|-74.0060|8336817|New York City,NYC,Manhattan
+Los Angeles|US|34.0522|-118.2437|3898747|LA
+Chicago|US|41.8781|-87.6298|2746388|
+Houston|US|29.7604|-95.3698|2304580|
+Phoenix|US|33.4484|-112.0740|1608139|
+Philadelphia|US|39.9526|-75.1652|1603797|Philly
+San Antonio|US|29.4241|-98.4936|1434625|
+San Diego|US|32.7157|-117.1611|1386932|
+Dallas|US|32.7767|-96.7970|1304379|
+San Jose|US|37.3382|-121.8863|1013240|
+Austin|US|30.2672|-97.7431|961855|
+Jacksonville|US|30.3322|-81.6557|949611|
+Fort Worth|US|32.7555|-97.3308|918915|
+Columbus|US|39.9612|-82.9988|905748|
+Indianapolis|US|39.7684|-86.1581|887642|
+Charlotte|US|35.2271|-80.8431|874579|
+San Francisco|US|37.7749|-122.4194|873965|SF
+Seattle|US|47.6062|-122.3321|737015|
+Denver|US|39.7392|-104.9903|715522|
+Washington|US|38.9072|-77.0369|689545|Washington DC,Washington D.C.,DC
+Nashville|US|36.1627|-86.7816|689447|
+Oklahoma City|US|35.4676|-97.5164|681054|
+Boston|US|42.3601|-71.0589|675647|
+Portland|US|45.5152|-122.6784|652503|
+Las Vegas|US|36.1699|-115.1398|641903|Vegas
+Detroit|US|42.3314|-83.0458|639111|
+Baltimore|US|39.2904|-76.6122|585708|
+Milwaukee|US|43.0389|-87.9065|577222|
+Albuquerque|US|35.0844|-106.6504|564559|
+Tucson|US|32.2226|-110.9747|542629|
+Sacramento|US|38.5816|-121.4944|524943|
+Kansas City|US|39.0997|-94.5786|508090|
+Atlanta|US|33.7490|-84.3880|498715|
+Omaha|US|41.2565|-95.9345|486051|
+Raleigh|US|35.7796|-78.6382|467665|
+Miami|US|25.7617|-80.1918|442241|
+Minneapolis|US|44.9778|-93.2650|429954|
+Tampa|US|27.9506|-82.4572|384959|
+New Orleans|US|29.9511|-90.0715|383997|
+Cleveland|US|41.4993|-81.6944|372624|
+Honolulu|US|21.3069|-157.8583|350964|
+Cincinnati|US|39.1031|-84.5120|309317|
+Orlando|US|28.5383|-81.3792|307573|
+Pittsburgh|US|40.4406|-79.9959|302971|
+St. Louis|US|38.6270|-90.1994|301578|St Louis,Saint Louis
+Anchorage|US|61.2181|-149.9003|291247|
+Buffalo|US|42.8864|-78.8784|278349|
+Madison|US|43.0731|-89.4012|269840|
+Boise|US|43.6150|-116.2023|235684|
+Spokane|US|47.6588|-117.4260|228989|
+Salt Lake City|US|40.7608|-111.8910|200133|
+San Juan|PR|18.4655|-66.1057|342259|
+London|GB|51.5074|-0.1278|8982000|
+Birmingham|GB|52.4862|-1.8904|1149000|
+Leeds|GB|53.8008|-1.5491|793139|
+Glasgow|GB|55.8642|-4.2518|635640|
+Sheffield|GB|53.3811|-1.4701|584853|
+Manchester|GB|53.4808|-2.2426|553230|
+Edinburgh|GB|55.9533|-3.1883|527620|
+Liverpool|GB|53.4084|-2.9916|498042|
+Bristol|GB|51.4545|-2.5879|467099|
+Cardiff|GB|51.4816|-3.1791|362756|
+Belfast|GB|54.5973|-5.9301|343542|
+Nottingham|GB|52.9548|-1.1581|323632|
+Newcastle upon Tyne|GB|54.9783|-1.6178|300196|Newcastle
+Dublin|IE|53.3498|-6.2603|1173179|
+Paris|FR|48.8566|2.3522|2161000|
+Marseille|FR|43.2965|5.3698|870018|Marseilles
+Lyon|FR|45.7640|4.8357|516092|Lyons
+Berlin|DE|52.5200|13.4050|3645000|
+Hamburg|DE|53.5511|9.9937|1841179|
+Munich|DE|48.1351|11.5820|1471508|München,Muenchen
+Cologne|DE|50.9375|6.9603|1085664|Köln,Koeln
+Frankfurt|DE|50.1109|8.6821|753056|Frankfurt am Main
+Madrid|ES|40.4168|-3.7038|3223334|
+Barcelona|ES|41.3874|2.1686|1620343|
+Valencia|ES|39.4699|-0.3763|791413|
+Seville|ES|37.3891|-5.9845|688711|Sevilla
+Rome|IT|41.9028|12.4964|2872800|Roma
+Milan|IT|45.4642|9.1900|1352000|Milano
+Naples|IT|40.8518|14.2681|959470|Napoli
+Amsterdam|NL|52.3676|4.9041|872680|
+Rotterdam|NL|51.9244|4.4777|651446|
+Brussels|BE|50.8503|4.3517|1208542|Bruxelles,Brussel
+Vienna|AT|48.2082|16.3738|1897491|Wien
+Zurich|CH|47.3769|8.5417|421878|Zürich,Zuerich
+Geneva|CH|46.2044|6.1432|203856|Genève,Geneve
+Stockholm|SE|59.3293|18.0686|975551|
+Oslo|NO|59.9139|10.7522|697010|
+Copenhagen|DK|55.6761|12.5683|794128|København,Kobenhavn
+Helsinki|FI|60.1699|24.9384|656229|
+Warsaw|PL|52.2297|21.0122|1793579|Warszawa
+Krakow|PL|50.0647|19.9450|779115|Kraków,Cracow
+Prague|CZ|50.0755|14.4378|1309000|Praha
+Budapest|HU|47.4979|19.0402|1752286|
+Lisbon|PT|38.7223|-9.1393|504718|Lisboa
+Porto|PT|41.1579|-8.6291|237591|Oporto
+Athens|GR|37.9838|23.7275|664046|Athina
+Istanbul|TR|41.0082|28.9784|15462452|
+Moscow|RU|55.7558|37.6173|12506468|Moskva
+Saint Petersburg|RU|59.9311|30.3609|5384342|St Petersburg,St. Petersburg
+Kyiv|UA|50.4501|30.5234|2884000|Kiev
+Bucharest|RO|44.4268|26.1025|1883425|Bucuresti
+Tokyo|JP|35.6762|139.6503|13960000|
+Osaka|JP|34.6937|135.5023|2691000|
+Seoul|KR|37.5665|126.9780|9776000|
+Beijing|CN|39.9042|116.4074|21540000|Peking
+Shanghai|CN|31.2304|121.4737|24280000|
+Hong Kong|HK|22.3193|114.1694|7482500|
+Taipei|TW|25.0330|121.5654|2646204|
+Singapore|SG|1.3521|103.8198|5685807|
+Bangkok|TH|13.7563|100.5018|10539000|
+Manila|PH|14.5995|120.9842|1780148|
+Jakarta|ID|-6.2088|106.8456|10562088|
+Kuala Lumpur|MY|3.1390|101.6869|1808000|KL
+Ho Chi Minh City|VN|10.8231|106.6297|8993082|Ho Chi Minh,Saigon
+Hanoi|VN|21.0278|105.8342|8053663|
+Delhi|IN|28.6139|77.2090|16787941|New Delhi
+Mumbai|IN|19.0760|72.8777|12442373|Bombay
+Bangalore|IN|12.9716|77.5946|8443675|Bengaluru
+Hyderabad|IN|17.3850|78.4867|6809970|
+Chennai|IN|13.0827|80.2707|7088000|Madras
+Kolkata|IN|22.5726|88.3639|4496694|Calcutta
+Karachi|PK|24.8607|67.0011|14910352|
+Lahore|PK|31.5204|74.3587|11126285|
+Dhaka|BD|23.8103|90.4125|8906039|Dacca
+Dubai|AE|25.2048|55.2708|3331420|
+Riyadh|SA|24.7136|46.6753|7676654|
+Tehran|IR|35.6892|51.3890|8693706|
+Tel Aviv|IL|32.0853|34.7818|460613|Tel Aviv-Yafo
+Jerusalem|IL|31.7683|35.2137|936425|
+Sydney|AU|-33.8688|151.2093|5312163|
+Melbourne|AU|-37.8136|144.9631|5078193|
+Brisbane|AU|-27.4698|153.0251|2514184|
+Perth|AU|-31.9505|115.8605|2085973|
+Adelaide|AU|-34.9285|138.6007|1376601|
+Canberra|AU|-35.2809|149.1300|431380|
+Auckland|NZ|-36.8485|174.7633|1657200|
+Wellington|NZ|-41.2865|174.7762|215400|
+Christchurch|NZ|-43.5321|172.6362|381500|
+Cairo|EG|30.0444|31.2357|9539673|
+Lagos|NG|6.5244|3.3792|14368332|
+Nairobi|KE|-1.2921|36.8219|4397073|
+Johannesburg|ZA|-26.2041|28.0473|5635127|Joburg
+Cape Town|ZA|-33.9249|18.4241|4617560|
+Casablanca|MA|33.5731|-7.5898|3359818|
+Accra|GH|5.6037|-0.1870|2291352|
+Addis Ababa|ET|9.0250|38.7469|3384569|
+Mexico City|MX|19.4326|-99.1332|9209944|Ciudad de Mexico,CDMX
+Guadalajara|MX|20.6597|-103.3496|1385629|
+Monterrey|MX|25.6866|-100.3161|1142994|
+Sao Paulo|BR|-23.5505|-46.6333|12325232|São Paulo
+Rio de Janeiro|BR|-22.9068|-43.1729|6747815|Rio
+Buenos Aires|AR|-34.6037|-58.3816|3075646|
+Santiago|CL|-33.4489|-70.6693|6310000|
+Lima|PE|-12.0464|-77.0428|9751717|
+Bogota|CO|4.7110|-74.0721|7181469|Bogotá
+Caracas|VE|10.4806|-66.9036|2082000|
+Havana|CU|23.1136|-82.3666|2130081|La Habana
+"""
+
+# Country labels that read better than tzdata's ISO 3166 names (listed first, so the app uses them),
+# then extra spellings accepted after a comma ("Paris, France")
+COUNTRY_LABELS = [("GB", "United Kingdom"), ("KR", "South Korea"), ("KP", "North Korea"), ("CD", "DR Congo"),
+                  ("CG", "Republic of the Congo"), ("BA", "Bosnia and Herzegovina")]
+COUNTRY_ALIASES = [("US", "USA"), ("US", "United States of America"), ("US", "America"), ("GB", "UK"), ("GB", "Britain"),
+                   ("GB", "England"), ("GB", "Scotland"), ("GB", "Wales"), ("GB", "Northern Ireland"), ("AE", "UAE"),
+                   ("CZ", "Czech Republic"), ("NL", "Holland")]
+
+
+def normalize(text):
+    """The app's normalize_place(): ASCII, lower case, punctuation to spaces, 'saint' as 'st'."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    text = re.sub(r"['’.]", "", text)
+    text = re.sub(r"[^a-z0-9]+", " ", text).strip()
+    return re.sub(r"\bsaint\b", "st", text)
+
+
+def latin(text):
+    return all(not c.isalpha() or "LATIN" in unicodedata.name(c, "") for c in text)
+
+
+def iso6709(value):
+    """zone.tab coordinates, e.g. +4332-07923 or +404251-0740023, as (lat, lng) degrees."""
+    match = re.fullmatch(r"([+-]\d{4}(?:\d{2})?)([+-]\d{5}(?:\d{2})?)", value)
+    if not match:
+        raise ValueError(value)
+
+    def degrees(part, width):
+        sign = -1 if part[0] == "-" else 1
+        digits = part[1:]
+        whole, minutes, seconds = int(digits[:width]), int(digits[width:width + 2]), int(digits[width + 2:] or 0)
+        return sign * (whole + minutes / 60 + seconds / 3600)
+
+    return round(degrees(match.group(1), 2), 4), round(degrees(match.group(2), 3), 4)
+
+
+def read_tab(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                yield line.rstrip("\n").split("\t")
+
+
+def zone_places(zoneinfo):
+    for fields in read_tab(os.path.join(zoneinfo, "zone.tab")):
+        country, coordinates, zone = fields[:3]
+        if zone.startswith(("Antarctica/", "Etc/")):
+            continue
+        lat, lng = iso6709(coordinates)
+        yield {"name": zone.rsplit("/", 1)[-1].replace("_", " "), "country": country, "lat": lat, "lng": lng,
+               "population": 0, "alternates": []}
+
+
+def curated_places():
+    for line in CURATED_PLACES.strip().splitlines():
+        name, country, lat, lng, population, alternates = line.split("|")
+        yield {"name": name, "country": country, "lat": float(lat), "lng": float(lng), "population": int(population),
+               "alternates": [a for a in alternates.split(",") if a]}
+
+
+def geonames_places(path):
+    """Rows of a GeoNames cities dump (geonameid, name, asciiname, alternatenames, lat, lng, ...)."""
+    for fields in read_tab(path):
+        name, alternates = fields[1], fields[3].split(",") if fields[3] else []
+        keys, kept = {normalize(name)}, []
+        for alternate in [fields[2]] + alternates:  # Latin-script spellings only, a few at most
+            key = normalize(alternate)
+            if key and key not in keys and latin(alternate):
+                keys.add(key)
+                kept.append(alternate)
+            if len(kept) >= MAX_ALTERNATES:
+                break
+        yield {"name": name, "country": fields[8], "lat": float(fields[4]), "lng": float(fields[5]),
+               "population": int(fields[14] or 0), "alternates": kept}
+
+
+def merge(*sources):
+    """Later sources win for the same (name, country); alternate spellings are pooled."""
+    places = {}
+    for source in sources:
+        for place in source:
+            keys = [(normalize(n), place["country"]) for n in [place["name"]] + place["alternates"]]
+            existing = next((places[k] for k in keys if k in places), None)
+            if existing:
+                alternates = existing["alternates"] + [existing["name"]] + place["alternates"]
+                existing.update(place)
+                existing["alternates"] = [a for a in dict.fromkeys(alternates) if normalize(a) != normalize(place["name"])]
+                place = existing
+            for key in [(normalize(n), place["country"]) for n in [place["name"]] + place["alternates"]]:
+                places[key] = place
+    unique = {id(p): p for p in places.values()}
+    return sorted(unique.values(), key=lambda p: (p["country"], normalize(p["name"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline gazetteer used to geocode journal locations.")
+    parser.add_argument("--geonames", help="a GeoNames cities dump, e.g. cities15000.txt")
+    parser.add_argument("--zoneinfo", default="/usr/share/zoneinfo", help="directory with zone.tab and iso3166.tab")
+    parser.add_argument("--output", default=DATA)
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.zoneinfo, "zone.tab")):
+        sys.exit(f"No zone.tab in {args.zoneinfo}; pass --zoneinfo (the tzdata package ships one)")
+    sources = [zone_places(args.zoneinfo)]
+    if args.geonames:
+        sources.append(geonames_places(args.geonames))
+    sources.append(curated_places())
+    places = merge(*sources)
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "gazetteer.tsv"), "w", encoding="utf-8") as f:
+        f.write("# name\tcountry\tlat\tlng\tpopulation\talternates -- built by scripts/build_gazetteer.py\n")
+        for p in places:
+            f.write(f"{p['name']}\t{p['country']}\t{p['lat']}\t{p['lng']}\t{p['population']}\t{','.join(p['alternates'])}\n")
+    with open(os.path.join(args.output, "countries.tsv"), "w", encoding="utf-8") as f:
+        f.write("# code\tname -- COUNTRY_LABELS, iso3166.tab, then COUNTRY_ALIASES\n")
+        rows = COUNTRY_LABELS + [tuple(fields) for fields in read_tab(os.path.join(args.zoneinfo, "iso3166.tab"))] + COUNTRY_ALIASES
+        for code, name in dict.fromkeys(rows):
+            f.write(f"{code}\t{name}\n")
+    print(f"Wrote {len(places)} places to {os.path.relpath(args.output, ROOT)}/gazetteer.tsv")
+
+
+if __name__ == "__main__":
+    main()
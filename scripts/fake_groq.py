@@ -0,0 +1,191 @@
+# FILE: scripts/fake_groq.py
+#
+# A local stand-in for Groq's OpenAI-compatible chat-completions API, for benchmarks and load
+# tests. Point the app at it with GROQ_BASE_URL=http://127.0.0.1:<port> and any GROQ_API_KEY.
+#
+#   python scripts/fake_groq.py --port 8765 --latency 1.0
+#   python scripts/fake_groq.py --latency 0.3 --token-rate 250 --reply-tokens 120
+#   python scripts/fake_groq.py --failure-rate 0.2 --failure-mode mixed
+#
+# --latency is the time to the first byte and --token-rate the generation speed afterwards,
+# in both streaming (SSE) and non-streaming modes. --failure-rate injects upstream incidents:
+#   500         an internal server error
+#   429         a rate limit with Retry-After: 1
+#   timeout     the reply is held for --hang seconds, longer than any client timeout
+#   disconnect  the connection drops (mid-stream for streaming requests)
+#   mixed       one of the above at random
+
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "That sounds really tough, and I hear you. Thank you for sharing that with me. What has been on your mind the most today?"
+MODERATION_REPLY = json.dumps({"decision": "APPROVE", "reason": "Message is short, general, anonymous, and purely positive."})
+FAILURE_MODES = ("500", "429", "timeout", "disconnect")
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def moderation_reply(messages):
+    """A verdict for every item when the app sends a batch, otherwise a single verdict."""
+    try:
+        items = json.loads(messages[-1].get("content") or "")
+    except ValueError:
+        items = None
+    if isinstance(items, list):
+        return json.dumps({"verdicts": [{"id": item.get("id"), "decision": "APPROVE", "reason": "Supportive and anonymous."}
+                                        for item in items if isinstance(item, dict)]})
+    return MODERATION_REPLY
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 1.0
+    token_rate = 0.0
+    reply_tokens = 0
+    failure_rate = 0.0
+    failure_mode = "500"
+    hang = 60.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = body.get("messages", [])
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = moderation_reply(messages) if json_mode else self.chat_reply()
+        model = body.get("model", "fake-model")
+        failure = self.pick_failure()
+        time.sleep(self.latency)
+
+        if failure in ("500", "429"):
+            self.send_failure(int(failure))
+        elif failure == "timeout":
+            time.sleep(self.hang)
+            self.close_connection = True
+        elif failure == "disconnect" and not body.get("stream"):
+            self.close_connection = True
+        elif body.get("stream"):
+            self.send_stream(model, content, messages, disconnect=failure == "disconnect")
+        else:
+            self.send_json(model, content, messages)
+
+    def chat_reply(self):
+        words = REPLY.split(" ")
+        if self.reply_tokens <= 0:
+            return REPLY
+        reply = []
+        while estimate_tokens(" ".join(reply)) < self.reply_tokens:
+            reply.append(words[len(reply) % len(words)])
+        return " ".join(reply)
+
+    def pick_failure(self):
+        if self.failure_rate <= 0 or random.random() >= self.failure_rate:
+            return None
+        return random.choice(FAILURE_MODES) if self.failure_mode == "mixed" else self.failure_mode
+
+    def generation_delay(self, tokens):
+        if self.token_rate > 0:
+            time.sleep(tokens / self.token_rate)
+
+    def usage(self, content, messages):
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = estimate_tokens(content)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def send_failure(self, status):
+        kind = "rate_limit_exceeded" if status == 429 else "internal_server_error"
+        payload = json.dumps({"error": {"message": f"Injected {status}", "type": kind}}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_json(self, model, content, messages):
+        self.generation_delay(estimate_tokens(content))
+        payload = json.dumps({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": self.usage(content, messages),
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_stream(self, model, content, messages, disconnect=False):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            if disconnect and i == len(words) // 2:
+                self.close_connection = True
+                return
+            self.generation_delay(estimate_tokens(word + " "))
+            self.write_event({
+                "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            })
+        # Like Groq, report usage on the final chunk
+        self.write_event({
+            "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": chunk_id, "usage": self.usage(content, messages)},
+        })
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_event(self, obj):
+        self.write_chunk(f"data: {json.dumps(obj)}\n\n".encode())
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake of the Groq chat-completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds before the first byte of each reply")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="generated tokens per second after the first byte (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=0, help="approximate chat reply length (0 = one short reply)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests that fail, 0..1")
+    parser.add_argument("--failure-mode", choices=FAILURE_MODES + ("mixed",), default="500")
+    parser.add_argument("--hang", type=float, default=60.0, help="seconds a 'timeout' failure holds the reply")
+    args = parser.parse_args()
+
+    FakeGroqHandler.latency = args.latency
+    FakeGroqHandler.token_rate = args.token_rate
+    FakeGroqHandler.reply_tokens = args.reply_tokens
+    FakeGroqHandler.failure_rate = args.failure_rate
+    FakeGroqHandler.failure_mode = args.failure_mode
+    FakeGroqHandler.hang = args.hang
+    server = ThreadingHTTPServer((args.host, args.port), FakeGroqHandler)
+    server.daemon_threads = True
+    print(f"Fake Groq listening on http://{args.host}:{args.port} (latency {args.latency}s, "
+          f"{args.token_rate or 'unlimited'} tokens/s, failure rate {args.failure_rate:.0%} {args.failure_mode})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# FILE: scripts/load_test.py
+#
+# Scripted load scenarios for the app, reporting throughput and p50/p95/p99 per request type.
+#
+# By default it starts scripts/fake_groq.py and gunicorn (with gunicorn.conf.py) against a
+# throwaway SQLite database seeded by scripts/seed_data.py. --base-url targets a server that
+# is already running instead; pass --seeded-users if its database was seeded, so the
+# scenarios log in as seed<id> users rather than signing up new ones. The per-user rate limits
+# are off on the stack it starts (virtual users chat far faster than people); --rate-limits keeps
+# them, to see how 429s behave under load.
+#
+#   python scripts/load_test.py --users 50 --duration 30
+#   python scripts/load_test.py --scenarios chat --stream --groq-args "--latency 0.5 --token-rate 200 --failure-rate 0.05"
+#   python scripts/load_test.py --base-url http://127.0.0.1:8000 --seeded-users 2000 --scenarios heatmap,wall
+#
+# Scenarios (virtual users are spread over them round-robin):
+#   auth     sign up, log in, check auth, log out
+#   chat     chat turns on a session, starting a new session (with its greeting) every 10 turns
+#   journal  create, list, read, update and delete a geotagged entry
+#   heatmap  aggregated heatmap at random zoom levels and viewports
+#   wall     page through approved wall messages; every fifth pass submits one and polls its status
+
+import argparse
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_concurrency import ROOT, percentile, wait_for
+from seed_data import CITIES, MOODS, sentence
+
+REQUEST_TIMEOUT = 60
+
+
+class Recorder:
+    """Collects (latency, ok) samples per request label across all virtual users."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.passes = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def count_pass(self, scenario):
+        with self.lock:
+            self.passes[scenario] += 1
+
+    def add(self, label, seconds, ok):
+        with self.lock:
+            self.samples[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+    def request(self, http, label, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = http.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        except requests.RequestException:
+            self.add(label, time.perf_counter() - start, False)
+            return None
+        self.add(label, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+    def stream(self, http, label, url, payload):
+        """Posts a streaming request; records time to the first delta and to the end of the stream."""
+        start = time.perf_counter()
+        first, ok = None, False
+        try:
+            with http.post(url, json=payload, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                ok = response.status_code < 400
+                for line in response.iter_lines():
+                    event = json.loads(line) if line else {}
+                    if "delta" in event and first is None:
+                        first = time.perf_counter() - start
+                    if "error" in event:
+                        ok = False
+        except (requests.RequestException, ValueError):
+            ok = False
+        if first is not None:
+            self.add(f"{label} first delta", first, True)
+        self.add(label, time.perf_counter() - start, ok)
+
+
+class VirtualUser:
+    def __init__(self, index, base_url, recorder, args):
+        self.index, self.base_url, self.recorder, self.args = index, base_url, recorder, args
+        self.http = requests.Session()
+        self.rng = random.Random(args.seed * 100003 + index)
+        self.session_id, self.turns = None, 0
+
+    def call(self, label, method, path, **kwargs):
+        return self.recorder.request(self.http, label, method, self.base_url + path, **kwargs)
+
+    def log_in(self):
+        if self.args.seeded_users:
+            username = f"seed{self.args.first_seed_id + self.index % self.args.seeded_users:05d}"
+            self.call("login", "POST", "/api/login", json={"username": username, "pin": "1234"})
+        else:
+            self.call("signup", "POST", "/api/signup", json={"username": f"load{uuid.uuid4().hex[:12]}", "pin": "1234"})
+
+    # --- scenarios: one pass each ---
+    def auth(self):
+        username = f"load{uuid.uuid4().hex[:12]}"
+        self.call("signup", "POST", "/api/signup", json={"username": username, "pin": "1234"})
+        self.call("logout", "POST", "/api/logout")
+        self.call("login", "POST", "/api/login", json={"username": username, "pin": "1234"})
+        self.call("check_auth", "GET", "/api/check_auth")
+        self.call("logout", "POST", "/api/logout")
+
+    def chat(self):
+        if self.session_id is None or self.turns >= 10:
+            response = self.call("session create", "POST", "/api/sessions", json={"quiz_answers": ["Okay", "Pretty normal"]})
+            self.session_id, self.turns = (response.json().get("id") if response is not None and response.ok else None), 0
+            if self.session_id is None:
+                return
+        payload = {"session_id": self.session_id, "message": sentence(self.rng, 5, 25)}
+        if self.args.stream:
+            self.recorder.stream(self.http, "chat stream", self.base_url + "/api/chat", {**payload, "stream": True})
+        else:
+            self.call("chat", "POST", "/api/chat", json=payload)
+        self.turns += 1
+
+    def journal(self):
+        lat, lng = self.rng.choice(CITIES)
+        entry = {"title": sentence(self.rng, 2, 5), "content": sentence(self.rng, 20, 80), "mood": self.rng.choice(MOODS),
+                 "lat": lat + self.rng.uniform(-0.3, 0.3), "lng": lng + self.rng.uniform(-0.3, 0.3)}
+        created = self.call("journal create", "POST", "/api/journal", json=entry)
+        self.call("journal list", "GET", "/api/journal")
+        entry_id = created.json().get("id") if created is not None and created.ok else None
+        if entry_id is None:
+            return
+        self.call("journal read", "GET", f"/api/journal/{entry_id}")
+        self.call("journal update", "PUT", f"/api/journal/{entry_id}", json={**entry, "mood": self.rng.choice(MOODS)})
+        self.call("journal delete", "DELETE", f"/api/journal/{entry_id}")
+
+    def heatmap(self):
+        zoom = self.rng.randint(2, 10)
+        lat, lng = self.rng.choice(CITIES)
+        half_width = 180 / 2 ** (zoom - 1)
+        bbox = f"{lng - half_width:.4f},{max(-85, lat - half_width / 2):.4f},{lng + half_width:.4f},{min(85, lat + half_width / 2):.4f}"
+        self.call("heatmap", "GET", "/api/heatmap", params={"zoom": zoom, "bbox": bbox})
+
+    def wall(self):
+        page = self.call("wall page", "GET", "/api/community/messages/approved")
+        cursor = page.json().get("next_cursor") if page is not None and page.ok else None
+        if cursor and self.rng.random() < 0.5:
+            self.call("wall page", "GET", "/api/community/messages/approved", params={"cursor": cursor})
+        if self.rng.random() < 0.2:
+            self.call("wall submit", "POST", "/api/community/message", json={"message_text": "You are stronger than you think."})
+            self.call("wall status", "GET", "/api/community/message")
+
+
+SCENARIOS = ("auth", "chat", "journal", "heatmap", "wall")
+NEEDS_LOGIN = {"chat", "journal", "wall"}
+
+
+def run_user(index, scenario, base_url, recorder, args, deadline):
+    user = VirtualUser(index, base_url, recorder, args)
+    if scenario in NEEDS_LOGIN:
+        user.log_in()
+    step = getattr(user, scenario)
+    while time.time() < deadline:
+        step()
+        recorder.count_pass(scenario)
+
+
+def start_stack(args, tmp):
+    """Starts fake Groq and gunicorn on a seeded throwaway database; returns (base_url, processes)."""
+    groq_url = f"http://127.0.0.1:{args.groq_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, PORT=str(args.port), GROQ_BASE_URL=groq_url, GROQ_API_KEY="load-test", FLASK_SECRET_KEY="load-test",
+               DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'load.db')}", WEB_CONCURRENCY=str(args.workers),
+               RATE_LIMIT_ENABLED="1" if args.rate_limits else "0")
+    if args.worker_class:
+        env["GUNICORN_WORKER_CLASS"] = args.worker_class
+    subprocess.run([sys.executable, os.path.join(ROOT, "scripts", "seed_data.py"), "--users", str(args.seed_users),
+                    "--sessions-per-user", "2", "--messages-per-session", "20", "--entries-per-user", "10"],
+                   cwd=ROOT, env=env, check=True)
+    fake_groq = subprocess.Popen([sys.executable, os.path.join(ROOT, "scripts", "fake_groq.py"), "--port", str(args.groq_port),
+                                  *shlex.split(args.groq_args)], cwd=ROOT)
+    server = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null", "app:app"], cwd=ROOT, env=env)
+    wait_for(base_url + "/login")
+    return base_url, [server, fake_groq]
+
+
+def report(recorder, elapsed, args):
+    rows = []
+    for label in sorted(recorder.samples):
+        samples = recorder.samples[label]
+        rows.append({"request": label, "count": len(samples), "errors": recorder.errors[label], "rps": len(samples) / elapsed,
+                     "p50_ms": percentile(samples, 50) * 1000, "p95_ms": percentile(samples, 95) * 1000,
+                     "p99_ms": percentile(samples, 99) * 1000})
+    print(f"\n{args.users} virtual users, {elapsed:.1f}s, scenarios: {args.scenarios}"
+          f"{' (streaming chat)' if args.stream else ''}")
+    print(f"{'request':<26} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in rows:
+        print(f"{row['request']:<26} {row['count']:>7} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+    print("scenario passes: " + ", ".join(f"{name} {count} ({count / elapsed:.1f}/s)" for name, count in sorted(recorder.passes.items())))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"users": args.users, "duration": elapsed, "scenarios": args.scenarios, "stream": args.stream,
+                       "requests": rows, "passes": dict(recorder.passes)}, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test scenarios with throughput and latency percentiles.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--users", type=int, default=40, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load after setup")
+    parser.add_argument("--stream", action="store_true", help="use streaming chat turns")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--base-url", help="target a running server instead of starting one")
+    parser.add_argument("--seeded-users", type=int, default=0, help="seed<id> users available on --base-url")
+    parser.add_argument("--first-seed-id", type=int, default=1)
+    parser.add_argument("--seed-users", type=int, default=500, help="users to seed when starting the stack")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--worker-class", help="overrides GUNICORN_WORKER_CLASS")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the per-user rate limits on the started stack")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--groq-port", type=int, default=8765)
+    parser.add_argument("--groq-args", default="--latency 0.5", help="extra arguments for scripts/fake_groq.py")
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    processes = []
+    try:
+        if args.base_url:
+            base_url = args.base_url.rstrip("/")
+        else:
+            base_url, processes = start_stack(args, tempfile.mkdtemp())
+            args.seeded_users = args.seed_users
+
+        recorder = Recorder()
+        started = time.time()
+        deadline = started + args.duration
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            users = [pool.submit(run_user, i, scenarios[i % len(scenarios)], base_url, recorder, args, deadline)
+                     for i in range(args.users)]
+            for user in users:
+                user.result()  # surfaces a crashed virtual user instead of silently under-reporting
+        report(recorder, time.time() - started, args)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
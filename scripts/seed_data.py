@@ -0,0 +1,128 @@
+# FILE: scripts/seed_data.py
+#
+# Fills a database with realistic volumes of users, chat sessions, messages, geotagged
+# journal entries and wall messages, using batched executemany inserts.
+#
+#   python scripts/seed_data.py --database-url sqlite:////tmp/bigsister-seed.db --users 2000
+#
+# Every seeded user has the PIN 1234 and is named seed<id>, e.g. seed00001.
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+BATCH_SIZE = 5000
+USER_CHUNK = 1000
+
+CITIES = [
+    (53.55, -113.49), (43.65, -79.38), (49.28, -123.12), (40.71, -74.01), (34.05, -118.24), (41.88, -87.63),
+    (51.51, -0.13), (53.48, -2.24), (55.95, -3.19), (48.86, 2.35), (52.52, 13.40), (-33.87, 151.21),
+    (-37.81, 144.96), (35.68, 139.69), (19.43, -99.13), (-23.55, -46.63), (28.61, 77.21), (1.35, 103.82),
+]
+MOODS = ["Happy", "Calm", "Anxious", "Sad", "Angry", "Neutral"]
+WORDS = ("today school friends tired exam music family weekend walk coffee sleep dream practice game "
+         "talked laughed worried proud quiet rain sunny long short test class team lunch bus home").split()
+
+
+def sentence(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + "."
+
+
+def insert_batches(db, table, rows):
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(db.insert(table), rows[i:i + BATCH_SIZE])
+    db.session.commit()
+
+
+def seed(users=500, sessions_per_user=5, messages_per_session=30, entries_per_user=20, located_share=0.6,
+         wall_messages=None, seed_value=42):
+    """Seeds the app's configured database. Must run inside an app context. Returns row counts.
+
+    Users are generated and inserted USER_CHUNK at a time, so memory stays flat at any scale.
+    """
+    import app as bigsister
+    from werkzeug.security import generate_password_hash
+
+    db, rng = bigsister.db, random.Random(seed_value)
+    now = datetime.utcnow()
+    first_user = (db.session.query(db.func.max(bigsister.User.id)).scalar() or 0) + 1
+    next_session = (db.session.query(db.func.max(bigsister.ChatSession.id)).scalar() or 0) + 1
+    pin_hash = generate_password_hash("1234", bigsister.PIN_HASH_METHOD)  # hashing once keeps seeding fast
+    wall_count = users if wall_messages is None else min(wall_messages, users)
+    counts = {"users": 0, "sessions": 0, "messages": 0, "journal_entries": 0, "wall_messages": 0}
+
+    for chunk_start in range(0, users, USER_CHUNK):
+        user_ids = range(first_user + chunk_start, first_user + min(users, chunk_start + USER_CHUNK))
+        user_rows = [{"id": uid, "username": f"seed{uid:05d}", "pin_hash": pin_hash, "profile_info": ""} for uid in user_ids]
+        session_rows, message_rows, entry_rows = [], [], []
+        for user in user_rows:
+            for _ in range(sessions_per_user):
+                started = now - timedelta(minutes=rng.randint(0, 525600))
+                session_rows.append({"id": next_session, "name": started.strftime("%b %d, %Y %I:%M %p"), "start_time": started,
+                                     "is_active": True, "user_id": user["id"]})
+                for m in range(messages_per_session):
+                    message_rows.append({"role": "user" if m % 2 else "assistant", "content": sentence(rng, 8, 60),
+                                         "timestamp": started + timedelta(seconds=30 * m), "session_id": next_session})
+                next_session += 1
+            for _ in range(entries_per_user):
+                lat = lng = None
+                if rng.random() < located_share:
+                    city_lat, city_lng = rng.choice(CITIES)
+                    lat, lng = city_lat + rng.uniform(-0.3, 0.3), city_lng + rng.uniform(-0.3, 0.3)
+                entry_rows.append({"title": sentence(rng, 2, 5), "content": " ".join(sentence(rng, 10, 30) for _ in range(rng.randint(2, 8))),
+                                   "mood": rng.choice(MOODS), "lat": lat, "lng": lng, "user_id": user["id"],
+                                   "timestamp": now - timedelta(minutes=rng.randint(0, 525600))})
+        wall_rows = [{"submitted_by_username": user["username"], "text": sentence(rng, 3, 8),
+                      "status": rng.choice(["approved"] * 8 + ["rejected", "pending"]), "reason": None,
+                      "timestamp": now - timedelta(minutes=rng.randint(0, 525600))}
+                     for user in user_rows[:max(0, wall_count - chunk_start)]]
+
+        insert_batches(db, bigsister.User.__table__, user_rows)
+        insert_batches(db, bigsister.ChatSession.__table__, session_rows)
+        insert_batches(db, bigsister.ChatMessage.__table__, message_rows)
+        insert_batches(db, bigsister.JournalEntry.__table__, entry_rows)
+        insert_batches(db, bigsister.CommunityMessage.__table__, wall_rows)
+        for key, rows in (("users", user_rows), ("sessions", session_rows), ("messages", message_rows),
+                          ("journal_entries", entry_rows), ("wall_messages", wall_rows)):
+            counts[key] += len(rows)
+
+    if db.engine.dialect.name == "postgresql":
+        # Ids were assigned explicitly, so move the serial sequences past them
+        for table in ("users", "chat_sessions"):
+            db.session.execute(db.text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+        db.session.commit()
+
+    bigsister.rebuild_heatmap()
+    bigsister.rebuild_mood_rollups()
+    bigsister.rebuild_journal_index()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a BigSister database with synthetic data.")
+    parser.add_argument("--database-url", help="defaults to the app's DATABASE_URL / database.db")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--sessions-per-user", type=int, default=5)
+    parser.add_argument("--messages-per-session", type=int, default=30)
+    parser.add_argument("--entries-per-user", type=int, default=20)
+    parser.add_argument("--wall-messages", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    import app as bigsister
+
+    with bigsister.app.app_context():
+        bigsister.ensure_schema()
+        counts = seed(args.users, args.sessions_per_user, args.messages_per_session, args.entries_per_user,
+                      wall_messages=args.wall_messages, seed_value=args.seed)
+    print(", ".join(f"{v} {k}" for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
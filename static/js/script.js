@@ -9,6 +9,7 @@ document.addEventListener('DOMContentLoaded', () => {
         currentJournalId: null,
         isBotTyping: false,
         heatmapMap: null, 
+        heatmapLayer: null,
         pickerMap: null,     // NEW
         pickerMarker: null,  // NEW
         selectedLat: null,   // NEW
@@ -16,6 +17,7 @@ document.addEventListener('DOMContentLoaded', () => {
     };
 
     // --- CONSTANTS & DATA ---
+    const TYPEWRITER_MS_PER_CHAR = 20;
     const FRIENDLY_ERROR_MESSAGE = "Sweetheart, my thoughts got a little tangled just now and I couldn’t finish what I wanted to say.\n\nIt’s nothing you did — sometimes the wires behind me get a bit messy.\n\nCould you try again in a little while? 💜";
     const quizQuestions = [ { question: "In one word, how are you feeling right now?", answers: ["Overwhelmed", "Sad", "Anxious", "Okay"] }, { question: "How has your energy been lately?", answers: ["Totally drained", "Lower than usual", "Pretty normal", "Full of energy"] }, { question: "What's taking up most of your headspace?", answers: ["Relationships with others", "School or work pressure", "How I feel about myself", "Something from the past"] }, { question: "Have you felt more like being alone or with people?", answers: ["Definitely alone", "A little of both", "I want to be around others", "I haven't thought about it"] }, { question: "How have you been sleeping?", answers: ["Restlessly, or not enough", "A bit off", "Fairly well", "Very well"] }, { question: "How does the idea of the next few days feel?", answers: ["Daunting or scary", "A bit stressful", "Manageable", "Hopeful or exciting"] }, { question: "Have you been able to do things you normally enjoy?", answers: ["Not at all", "Only a little", "For the most part", "Yes, definitely"] }, { question: "How critical have you been of yourself recently?", answers: ["Extremely critical", "More than usual", "About the same", "I've been kind to myself"] }, { question: "Where do you feel the most tension in your body?", answers: ["In my chest or stomach", "In my shoulders or neck", "Headaches", "I feel pretty relaxed"] }, { question: "What kind of support feels most needed right now?", answers: ["Just someone to listen", "Help finding a distraction", "Understanding my feelings", "I'm not sure yet"] } ];
     const allResources = [ { name: "Crisis Text Line", country: "USA", type: "Crisis", anonymity: "Anonymous", contact: { text: "HOME to 741741" }, description: "24/7, free, confidential crisis support by text." }, { name: "The Trevor Project", country: "USA", type: "LGBTQ+", anonymity: "Anonymous", contact: { call: "1-866-488-7386", chat: "thetrevorproject.org" }, description: "Crisis intervention and suicide prevention for LGBTQ youth." }, { name: "SAMHSA National Helpline", country: "USA", type: "Substance Abuse", anonymity: "Confidential", contact: { call: "1-800-662-4357" }, description: "Treatment referral and information service." }, { name: "Kids Help Phone", country: "Canada", type: "General", anonymity: "Anonymous", contact: { call: "1-800-668-6868", text: "CONNECT to 686868" }, description: "Canada’s 24/7 e-mental health service for youth." }, { name: "Samaritans", country: "UK", type: "Crisis", anonymity: "Confidential", contact: { call: "116 123" }, description: "Whatever you're going through, a Samaritan will face it with you, 24/7." }, { name: "Shout", country: "UK", type: "Crisis", anonymity: "Anonymous", contact: { text: "SHOUT to 85258" }, description: "Free, confidential, 24/7 text messaging support service." } ];
@@ -42,9 +44,10 @@ document.addEventListener('DOMContentLoaded', () => {
         
         // JOURNAL DOM ELEMENTS
         journalList: document.getElementById('journal-list'), editorHeading: document.getElementById('editor-heading'),
+        journalSearchInput: document.getElementById('journal-search'),
         journalTitleInput: document.getElementById('journal-title'), 
         journalMoodInput: document.getElementById('journal-mood'),
-        journalLocationInput: document.getElementById('journal-location'), // NEW
+        journalLocationInput: document.getElementById('journal-location'), placeSuggestions: document.getElementById('place-suggestions'),
         journalContentInput: document.getElementById('journal-content'),
         saveJournalBtn: document.getElementById('save-journal-btn'), deleteJournalBtn: document.getElementById('delete-journal-btn'), reflectJournalBtn: document.getElementById('reflect-journal-btn'),
         
@@ -83,6 +86,60 @@ document.addEventListener('DOMContentLoaded', () => {
         return response;
     }
 
+    // The {"error"} message of a failed JSON response, or `fallback`. Shown as-is only for 429s
+    // (they say how long to wait) and messages written for the user; other errors stay friendly.
+    async function errorMessage(response, fallback = 'Something went wrong. Please try again.') {
+        try { return (await response.json()).error || fallback; } catch (e) { return fallback; }
+    }
+
+    // Reads a newline-delimited JSON stream and hands each parsed event to onEvent as it arrives
+    async function readNdjson(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+            if (done) break;
+        }
+        if (buffer.trim()) onEvent(JSON.parse(buffer));
+    }
+
+    // Fetches one page of a keyset-paginated list endpoint ({ items, next_cursor })
+    async function fetchPage(endpoint, cursor) {
+        const url = cursor ? `${endpoint}${endpoint.includes('?') ? '&' : '?'}cursor=${encodeURIComponent(cursor)}` : endpoint;
+        const response = await apiFetch(url);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        return response.json();
+    }
+
+    // Loads further pages when a sentinel at the end (or top) of `container` scrolls into view
+    function lazyLoadPages(container, endpoint, nextCursor, renderItems, atTop = false) {
+        container._pager?.disconnect();
+        container.querySelector(':scope > .page-sentinel')?.remove();
+        if (!nextCursor) return;
+        const sentinel = document.createElement('div');
+        sentinel.className = 'page-sentinel';
+        atTop ? container.prepend(sentinel) : container.appendChild(sentinel);
+        let cursor = nextCursor, loading = false;
+        const observer = new IntersectionObserver(async ([entry]) => {
+            if (!entry.isIntersecting || loading || !cursor) return;
+            loading = true;
+            try {
+                const page = await fetchPage(endpoint, cursor);
+                cursor = page.next_cursor;
+                renderItems(page.items, sentinel);
+            } catch (error) { cursor = null; }
+            if (!cursor) { observer.disconnect(); sentinel.remove(); }
+            loading = false;
+        });
+        container._pager = observer;
+        observer.observe(sentinel);
+    }
+
     function showSection(sectionId) {
         DOMElements.allSections.forEach(section => section.classList.add('hidden'));
         document.getElementById(sectionId)?.classList.remove('hidden');
@@ -206,14 +263,16 @@ document.addEventListener('DOMContentLoaded', () => {
     async function handleQuizCompletion() {
         toggleLoading(DOMElements.startChatBtn, true, "Preparing Space...");
         try {
-            const response = await apiFetch('/api/sessions', { method: 'POST', body: { quiz_answers: userQuizAnswers } });
-            const newSession = await response.json();
-            appState.currentSessionId = newSession.id;
-            await renderSessionList();
-            DOMElements.chatMessages.innerHTML = '';
-            renderMessage(newSession.initial_message, true); // type the greeting
-            DOMElements.chatSessionName.textContent = newSession.name;
-            showSection('chat-section');
+            const response = await apiFetch('/api/sessions', { method: 'POST', body: { quiz_answers: userQuizAnswers, stream: true } });
+            if (response.status === 429) { alert(await errorMessage(response)); return; }
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            await streamGreeting(response, async (newSession) => {
+                appState.currentSessionId = newSession.id;
+                await renderSessionList();
+                DOMElements.chatMessages.innerHTML = '';
+                DOMElements.chatSessionName.textContent = newSession.name;
+                showSection('chat-section');
+            });
         } catch (error) { 
             console.error("Failed to create new session:", error); 
             alert("Could not start a new session."); 
@@ -222,6 +281,20 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
     
+    // Streams a new session's greeting: the first event names the session, the rest are reply deltas
+    async function streamGreeting(response, onSession) {
+        let bubble = null, pending = Promise.resolve();
+        await readNdjson(response, (event) => {
+            if (event.session) {
+                pending = Promise.resolve(onSession(event.session)).then(() => { bubble = createStreamingMessage(); });
+                return;
+            }
+            pending = pending.then(() => bubble.handle(event));
+        });
+        await pending;
+        if (bubble) bubble.finish();
+    }
+
     async function loadChatView() {
         DOMElements.chatMessages.innerHTML = '<p>Loading sessions...</p>';
         await renderSessionList();
@@ -237,10 +310,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function renderSessionList() {
         try {
-            const response = await apiFetch('/api/sessions');
-            const sessions = await response.json();
+            const page = await fetchPage('/api/sessions');
             DOMElements.sessionList.innerHTML = '';
-            sessions.forEach(session => {
+            const appendSessions = (sessions, sentinel = null) => sessions.forEach(session => {
                 const li = document.createElement('li');
                 li.dataset.sessionId = session.id;
                 li.className = (session.id === appState.currentSessionId) ? 'active' : '';
@@ -251,8 +323,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 buttonsDiv.append(renameBtn, deleteBtn);
                 li.append(nameSpan, buttonsDiv);
                 li.addEventListener('click', () => { appState.currentSessionId = session.id; loadSession(session.id); });
-                DOMElements.sessionList.appendChild(li);
+                DOMElements.sessionList.insertBefore(li, sentinel);
             });
+            appendSessions(page.items);
+            lazyLoadPages(DOMElements.sessionList, '/api/sessions', page.next_cursor, appendSessions);
         } catch (error) { DOMElements.sessionList.innerHTML = '<li>Could not load sessions.</li>'; }
     }
 
@@ -263,10 +337,18 @@ document.addEventListener('DOMContentLoaded', () => {
         if(activeLi) DOMElements.chatSessionName.textContent = activeLi.querySelector('span').textContent;
 
         try {
-            const response = await apiFetch(`/api/sessions/${sessionId}/messages`);
-            const messages = await response.json();
+            const endpoint = `/api/sessions/${sessionId}/messages`;
+            const page = await fetchPage(endpoint);
             DOMElements.chatMessages.innerHTML = '';
-            messages.forEach(msg => renderMessage(msg, false)); // Don't type historical messages
+            page.items.forEach(msg => renderMessage(msg, false)); // Don't type historical messages
+            // Older messages load when the user scrolls up to the top of the transcript
+            lazyLoadPages(DOMElements.chatMessages, endpoint, page.next_cursor, (messages, sentinel) => {
+                const container = DOMElements.chatMessages;
+                const previousHeight = container.scrollHeight, previousTop = container.scrollTop;
+                const anchor = sentinel.nextSibling;
+                messages.forEach(msg => container.insertBefore(renderMessage(msg, false), anchor));
+                container.scrollTop = previousTop + (container.scrollHeight - previousHeight);
+            }, true);
         } catch (error) { DOMElements.chatMessages.innerHTML = '<p class="error-message">Could not load messages.</p>'; }
     }
 
@@ -295,13 +377,106 @@ document.addEventListener('DOMContentLoaded', () => {
         renderMessage({ role: 'user', content: userText }, false);
         DOMElements.chatInput.value = '';
         appState.isBotTyping = true;
+        const bubble = createStreamingMessage();
         try {
-            const response = await apiFetch('/api/chat', { method: 'POST', body: { message: userText, session_id: appState.currentSessionId } });
-            const data = await response.json();
-            if (response.ok) { renderMessage({ role: 'assistant', content: data.reply }, true); } 
-            else { renderMessage({ role: 'assistant', content: FRIENDLY_ERROR_MESSAGE }, true); }
-        } catch (error) { renderMessage({ role: 'assistant', content: FRIENDLY_ERROR_MESSAGE }, true); } 
-        finally { appState.isBotTyping = false; }
+            const response = await apiFetch('/api/chat', { method: 'POST', body: { message: userText, session_id: appState.currentSessionId, stream: true } });
+            if (response.ok) { await readNdjson(response, (event) => bubble.handle(event)); }
+            else if (response.status === 429) { bubble.fail(await errorMessage(response, FRIENDLY_ERROR_MESSAGE)); }
+            else { bubble.fail(); }
+        } catch (error) { bubble.fail(); }
+        finally { bubble.finish(); appState.isBotTyping = false; }
+    }
+
+    // Renders markdown that arrives in pieces into `container`. Blocks that can no longer change
+    // are parsed once and kept; only the block still being written is re-parsed. Appends are
+    // batched so parsing, DOM updates and the scroll to the bottom happen at most once per frame.
+    function createMarkdownRenderer(container) {
+        const open = document.createElement('div');  // the block still being written
+        open.style.display = 'contents';
+        let source = '', committed = 0, scanned = 0, fence = null, dirty = false, frameRequested = false;
+
+        // Moves `committed` past every finished block: a blank line, outside a code fence, followed
+        // by an unindented line (an indented one may still continue a list item or code block)
+        function commitFinishedBlocks() {
+            let boundary = committed, end;
+            while ((end = source.indexOf('\n', scanned)) !== -1) {
+                const line = source.slice(scanned, end);
+                const marker = line.match(/^ {0,3}(`{3,}|~{3,})/);
+                if (marker) {
+                    if (!fence) fence = marker[1][0];
+                    else if (marker[1][0] === fence) fence = null;
+                } else if (!fence && !line.trim()) {
+                    if (end + 1 >= source.length) break;  // wait to see how the next line starts
+                    if (!/\s/.test(source[end + 1])) boundary = end + 1;
+                }
+                scanned = end + 1;
+            }
+            if (boundary > committed) {
+                open.insertAdjacentHTML('beforebegin', marked.parse(source.slice(committed, boundary)));
+                committed = boundary;
+            }
+        }
+
+        function flush() {
+            frameRequested = false;
+            if (!dirty) return;
+            dirty = false;
+            commitFinishedBlocks();
+            open.innerHTML = marked.parse(source.slice(committed));
+            DOMElements.chatMessages.scrollTop = DOMElements.chatMessages.scrollHeight;
+        }
+
+        container.replaceChildren(open);
+        return {
+            append(text) {
+                source += text;
+                dirty = true;
+                if (!frameRequested) { frameRequested = true; requestAnimationFrame(flush); }
+            },
+            replace(text) {
+                source = ''; committed = scanned = 0; fence = null;
+                container.replaceChildren(open);
+                this.append(text);
+            },
+            flush,
+            get length() { return source.length; }
+        };
+    }
+
+    // Reveals text at the typewriter pace, a frame's worth of characters at a time
+    function typewrite(renderer, text) {
+        return new Promise(resolve => {
+            let shown = 0, started = null;
+            const step = (now) => {
+                if (started === null) started = now;
+                const target = Math.min(text.length, Math.floor((now - started) / TYPEWRITER_MS_PER_CHAR) + 1);
+                if (target > shown) { renderer.append(text.slice(shown, target)); renderer.flush(); shown = target; }
+                if (shown < text.length) requestAnimationFrame(step); else resolve();
+            };
+            requestAnimationFrame(step);
+        });
+    }
+
+    // An assistant bubble that grows as streamed deltas arrive
+    function createStreamingMessage() {
+        const div = document.createElement('div');
+        div.className = 'message bot-message';
+        const p = document.createElement('p');
+        p.innerHTML = '<i class="fas fa-ellipsis-h"></i>';
+        div.appendChild(p);
+        DOMElements.chatMessages.appendChild(div);
+        DOMElements.chatMessages.scrollTop = DOMElements.chatMessages.scrollHeight;
+
+        let renderer = null, failed = false;  // the renderer replaces the ellipsis on the first delta
+        const bubble = {
+            handle(event) {
+                if (event.delta) { (renderer ||= createMarkdownRenderer(p)).append(event.delta); }
+                else if (event.error) { bubble.fail(); }
+            },
+            fail(message = FRIENDLY_ERROR_MESSAGE) { failed = true; (renderer ||= createMarkdownRenderer(p)).replace(message); },
+            finish() { if (!(renderer && renderer.length) && !failed) bubble.fail(); }
+        };
+        return bubble;
     }
 
     function renderMessage(message, useTypewriter) {
@@ -313,16 +488,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (useTypewriter && message.role === 'assistant') {
             appState.isBotTyping = true;
-            let i = 0;
-            const interval = setInterval(() => {
-                p.innerHTML = marked.parse(message.content.slice(0, ++i));
-                DOMElements.chatMessages.scrollTop = DOMElements.chatMessages.scrollHeight;
-                if (i >= message.content.length) { clearInterval(interval); appState.isBotTyping = false; }
-            }, 20);
+            typewrite(createMarkdownRenderer(p), message.content).then(() => { appState.isBotTyping = false; });
         } else {
             p.innerHTML = marked.parse(message.content);
             DOMElements.chatMessages.scrollTop = DOMElements.chatMessages.scrollHeight;
         }
+        return div;
     }
 
     function initPickerMap() {
@@ -337,32 +508,69 @@ document.addEventListener('DOMContentLoaded', () => {
             attribution: '&copy; OpenStreetMap &copy; CARTO'
         }).addTo(appState.pickerMap);
 
-        // Click event to drop pin
-        appState.pickerMap.on('click', (e) => {
+        // Click event to drop pin, then name it after the nearest place
+        appState.pickerMap.on('click', async (e) => {
             const { lat, lng } = e.latlng;
-            appState.selectedLat = lat;
-            appState.selectedLng = lng;
-
-            if (appState.pickerMarker) {
-                appState.pickerMarker.setLatLng(e.latlng);
-            } else {
-                appState.pickerMarker = L.marker(e.latlng).addTo(appState.pickerMap);
-            }
+            setPickerPin(lat, lng);
+            const response = await apiFetch(`/api/geocode/reverse?lat=${lat}&lng=${lng}`);
+            const { label } = await response.json();
+            if (appState.selectedLat === lat && appState.selectedLng === lng) DOMElements.journalLocationInput.value = label || '';
         });
     }
 
+    function setPickerPin(lat, lng, zoom = null) {
+        appState.selectedLat = lat;
+        appState.selectedLng = lng;
+        if (appState.pickerMarker) {
+            appState.pickerMarker.setLatLng([lat, lng]);
+        } else {
+            appState.pickerMarker = L.marker([lat, lng]).addTo(appState.pickerMap);
+        }
+        if (zoom) appState.pickerMap.setView([lat, lng], zoom);
+    }
+
+    // Place names are suggested from the server's offline gazetteer; picking one moves the pin
+    // there, while typing anything else drops the pin so the server geocodes the name on save
+    let placeSuggestTimer = null;
+    let placeSuggestions = new Map(); // label -> {lat, lng}
+    function handleLocationInput() {
+        const query = DOMElements.journalLocationInput.value.trim();
+        const picked = placeSuggestions.get(query);
+        if (picked) { setPickerPin(picked.lat, picked.lng, 8); return; }
+        if (appState.pickerMarker) {
+            appState.pickerMap.removeLayer(appState.pickerMarker);
+            appState.pickerMarker = null;
+        }
+        appState.selectedLat = null;
+        appState.selectedLng = null;
+        clearTimeout(placeSuggestTimer);
+        if (query.length < 2) return;
+        placeSuggestTimer = setTimeout(async () => {
+            const response = await apiFetch(`/api/geocode?q=${encodeURIComponent(query)}`);
+            const { items } = await response.json();
+            if (DOMElements.journalLocationInput.value.trim() !== query) return; // typed on since
+            placeSuggestions = new Map(items.map(place => [place.label, place]));
+            DOMElements.placeSuggestions.innerHTML = '';
+            items.forEach(place => {
+                const option = document.createElement('option');
+                option.value = place.label;
+                DOMElements.placeSuggestions.appendChild(option);
+            });
+        }, 200);
+    }
+
     // --- JOURNAL (Database backed) ---
     async function loadJournalView() { 
         resetJournalEditor(); 
+        DOMElements.journalSearchInput.value = '';
         await renderJournalList(); 
         // Initialize the map after the tab is visible
         setTimeout(initPickerMap, 100); 
     }
     async function renderJournalList() {
-        const response = await apiFetch('/api/journal');
-        const entries = await response.json();
+        const page = await fetchPage('/api/journal');
         DOMElements.journalList.innerHTML = '';
-        entries.forEach(entry => {
+        const appendEntries = (entries, sentinel = null) => entries.forEach(entry => {
             const item = document.createElement('div');
             item.className = `journal-item ${entry.id === appState.currentJournalId ? 'active' : ''}`;
             item.dataset.journalId = entry.id;
@@ -370,9 +578,38 @@ document.addEventListener('DOMContentLoaded', () => {
             const locText = entry.location ? ` | ${entry.location}` : '';
             item.innerHTML = `<h4>${entry.title}</h4><p>${entry.mood}${locText} • ${new Date(entry.timestamp).toLocaleDateString()}</p>`;
             item.addEventListener('click', () => loadJournalEntry(entry.id));
-            DOMElements.journalList.appendChild(item);
+            DOMElements.journalList.insertBefore(item, sentinel);
         });
+        appendEntries(page.items);
+        lazyLoadPages(DOMElements.journalList, '/api/journal', page.next_cursor, appendEntries);
+    }
+    // Ranked full-text results; titles and snippets arrive HTML-escaped with <mark> highlights
+    async function renderJournalSearch(query) {
+        const endpoint = `/api/journal/search?q=${encodeURIComponent(query)}`;
+        const page = await fetchPage(endpoint);
+        if (DOMElements.journalSearchInput.value.trim() !== query) return; // a newer search superseded this one
+        DOMElements.journalList.innerHTML = page.items.length ? '' : '<p class="journal-snippet">No matching entries.</p>';
+        const appendResults = (results, sentinel = null) => results.forEach(result => {
+            const item = document.createElement('div');
+            item.className = `journal-item ${result.id === appState.currentJournalId ? 'active' : ''}`;
+            item.dataset.journalId = result.id;
+            item.innerHTML = `<h4>${result.title}</h4><p class="journal-snippet">${result.snippet}</p><p>${result.mood} • ${new Date(result.timestamp).toLocaleDateString()}</p>`;
+            item.addEventListener('click', () => loadJournalEntry(result.id));
+            DOMElements.journalList.insertBefore(item, sentinel);
+        });
+        appendResults(page.items);
+        lazyLoadPages(DOMElements.journalList, endpoint, page.next_cursor, appendResults);
     }
+
+    let journalSearchTimer = null;
+    function handleJournalSearch() {
+        clearTimeout(journalSearchTimer);
+        journalSearchTimer = setTimeout(() => {
+            const query = DOMElements.journalSearchInput.value.trim();
+            query ? renderJournalSearch(query) : renderJournalList();
+        }, 250);
+    }
+
    async function loadJournalEntry(journalId) {
         appState.currentJournalId = journalId;
         const response = await apiFetch(`/api/journal/${journalId}`);
@@ -389,6 +626,7 @@ document.addEventListener('DOMContentLoaded', () => {
         DOMElements.journalTitleInput.value = entry.title;
         DOMElements.journalContentInput.value = entry.content;
         DOMElements.journalMoodInput.value = entry.mood || 'Neutral';
+        DOMElements.journalLocationInput.value = entry.location || '';
         
         // --- 3. Handle Map Marker ---
         // Initialize map if it doesn't exist yet (prevents crash)
@@ -428,6 +666,7 @@ document.addEventListener('DOMContentLoaded', () => {
         DOMElements.journalTitleInput.value = ''; 
         DOMElements.journalContentInput.value = '';
         DOMElements.journalMoodInput.value = 'Neutral';
+        DOMElements.journalLocationInput.value = '';
         
         // Reset Map State
         appState.selectedLat = null;
@@ -457,11 +696,12 @@ document.addEventListener('DOMContentLoaded', () => {
         const method = appState.currentJournalId ? 'PUT' : 'POST';
         const endpoint = appState.currentJournalId ? `/api/journal/${appState.currentJournalId}` : '/api/journal';
         
-        // Send lat/lng directly
+        // Send lat/lng directly; a place name without a pin is geocoded by the server
         const body = { 
             title, 
             content, 
             mood, 
+            location: DOMElements.journalLocationInput.value.trim(),
             lat: appState.selectedLat, 
             lng: appState.selectedLng 
         };
@@ -487,61 +727,62 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     async function reflectOnJournalEntry() {
         if (!appState.currentJournalId) return; // Should be loaded
-        const title = DOMElements.journalTitleInput.value;
-        const content = DOMElements.journalContentInput.value;
-        const mood = DOMElements.journalMoodInput.value;
-        const location = DOMElements.journalLocationInput.value;
-
-        // Construct context for the AI
-        const context = `Journal Title: "${title}". Location: "${location}". Mood: ${mood}. Content: "${content}"`;
 
-        // Start a new session explicitly for reflection
-        const res = await apiFetch('/api/sessions', { method: 'POST', body: { reflection_context: context } });
-        const sessionData = await res.json();
+        // Start a new session explicitly for reflection; the server reads the saved entry (and related ones) itself
+        const res = await apiFetch('/api/sessions', { method: 'POST', body: { journal_entry_id: appState.currentJournalId, stream: true } });
+        if (!res.ok) { alert(res.status === 429 ? await errorMessage(res) : "Could not start a new session."); return; }
         
-        // Switch to chat view
-        appState.currentSessionId = sessionData.id;
-        showSection('chat-section');
-        DOMElements.chatMessages.innerHTML = ''; // Clear old messages
-        renderMessage(sessionData.initial_message);
+        // Switch to chat view as soon as the session exists, then stream the greeting into it
+        await streamGreeting(res, (sessionData) => {
+            appState.currentSessionId = sessionData.id;
+            showSection('chat-section');
+            DOMElements.chatMessages.innerHTML = ''; // Clear old messages
+        });
     }
 
     // --- HEATMAP LOGIC ---
+    const MOOD_COLORS = {
+        "Happy": "#FFD700", "Calm": "#4CAF50", "Anxious": "#9C27B0",
+        "Sad": "#2196F3", "Angry": "#F44336", "Neutral": "#B0BEC5"
+    };
+
     async function loadHeatmapView() {
         if (!appState.heatmapMap) {
             // Initialize Map (Dark Minimalist style for "Global Vibe")
             appState.heatmapMap = L.map('heatmap-container', {
-    minZoom: 2,
-    maxZoom: 12 // <--- This prevents zooming in past "City Level"
-}).setView([20, 0], 2);
+                minZoom: 2,
+                maxZoom: 12 // <--- This prevents zooming in past "City Level"
+            }).setView([20, 0], 2);
             L.tileLayer('https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}{r}.png', {
                 attribution: '&copy; OpenStreetMap &copy; CARTO'
             }).addTo(appState.heatmapMap);
+            appState.heatmapLayer = L.layerGroup().addTo(appState.heatmapMap);
+            // Cells are aggregated server-side per zoom level, so refetch only the visible box
+            appState.heatmapMap.on('moveend', refreshHeatmapCells);
         }
+        setTimeout(() => appState.heatmapMap.invalidateSize(), 100);
+        await refreshHeatmapCells();
+    }
 
-        // Fetch Data
-        const res = await apiFetch('/api/heatmap');
+    async function refreshHeatmapCells() {
+        const map = appState.heatmapMap;
+        const b = map.getBounds();
+        const bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map(v => v.toFixed(3)).join(',');
+        const res = await apiFetch(`/api/heatmap?zoom=${map.getZoom()}&bbox=${bbox}`);
         const data = await res.json();
 
-        // Clear existing markers (naive approach for demo)
-        appState.heatmapMap.eachLayer((layer) => {
-            if (layer instanceof L.CircleMarker) appState.heatmapMap.removeLayer(layer);
-        });
-
-        const colors = {
-            "Happy": "#FFD700", "Calm": "#4CAF50", "Anxious": "#9C27B0",
-            "Sad": "#2196F3", "Angry": "#F44336", "Neutral": "#B0BEC5"
-        };
-
-        data.forEach(p => {
-            L.circleMarker([p.lat, p.lng], {
-                radius: 6,
-                fillColor: colors[p.mood] || colors["Neutral"],
+        appState.heatmapLayer.clearLayers();
+        data.cells.forEach(cell => {
+            // Color by the most common mood in the cell, size by how many entries it holds
+            const [mood] = Object.entries(cell.moods).sort((a, b) => b[1] - a[1])[0];
+            L.circleMarker([cell.lat, cell.lng], {
+                radius: Math.min(4 + 3 * Math.sqrt(cell.count), 24),
+                fillColor: MOOD_COLORS[mood] || MOOD_COLORS["Neutral"],
                 color: "#000",
                 weight: 0,
                 opacity: 1,
                 fillOpacity: 0.8
-            }).addTo(appState.heatmapMap);
+            }).addTo(appState.heatmapLayer);
         });
     }
 
@@ -567,7 +808,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if(new_pin.length !== 4) return alert("New PIN must be 4 digits.");
         const res = await apiFetch('/api/pin', { method: 'PUT', body: { old_pin, new_pin } });
         if(res.ok) { alert("PIN changed successfully."); DOMElements.oldPinInput.value = ""; DOMElements.newPinInput.value = ""; }
-        else alert("Failed to change PIN. Check your old PIN.");
+        else alert(await errorMessage(res, "Failed to change PIN. Check your old PIN."));
     };
     
     // --- OTHER SECTIONS (RESTORED) ---
@@ -590,12 +831,29 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Built covers come with AVIF/WebP srcsets (see scripts/build_assets.py); unbuilt ones use the PNG
+    const COVER_SIZES = '(max-width: 640px) 100vw, 400px';
+    function coverPicture(audioItem) {
+        const image = (window.RESPONSIVE_IMAGES || {})[`img/audio-covers/${audioItem.cover}`];
+        if (!image || !image.webp) return `<img src="static/img/audio-covers/${audioItem.cover}" alt="${audioItem.title}" loading="lazy">`;
+        const sources = ['avif', 'webp'].filter(fmt => image[fmt]).map(fmt => `<source type="image/${fmt}" srcset="${image[fmt]}" sizes="${COVER_SIZES}">`).join('');
+        return `<picture>${sources}<img src="${image.src}" alt="${audioItem.title}" width="${image.width}" height="${image.height}" loading="lazy" decoding="async"></picture>`;
+    }
+
+    // Pinned per page load so every Range request of a track hits the same encoding
+    function preferredAudioQuality() {
+        const connection = navigator.connection;
+        if (connection && (connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType) || connection.downlink < 1.5)) return 'low';
+        return 'standard';
+    }
+
     function renderMindMatters() {
         const { audioGallery } = DOMElements;
+        const audioQuality = preferredAudioQuality();
         audioGallery.innerHTML = '';
         mindMattersAudio.forEach(audioItem => {
             const card = document.createElement('div'); card.className = 'audio-card';
-            card.innerHTML = `<div class="audio-card-cover"><img src="static/img/audio-covers/${audioItem.cover}" alt="${audioItem.title}"></div><div class="audio-card-info"><h3>${audioItem.title}</h3><p>${audioItem.description}</p><audio src="static/audio/${audioItem.file}"></audio><div class="custom-audio-player"><button class="play-pause-btn"><i class="fas fa-play"></i></button><div class="time-container"><span class="current-time">0:00</span> / <span class="total-duration">0:00</span></div><input type="range" class="seek-bar" value="0" step="1"><a href="static/audio/${audioItem.file}" download class="download-btn" title="Download Audio"><i class="fas fa-download"></i></a></div></div>`;
+            card.innerHTML = `<div class="audio-card-cover">${coverPicture(audioItem)}</div><div class="audio-card-info"><h3>${audioItem.title}</h3><p>${audioItem.description}</p><audio src="audio/${audioItem.file}?quality=${audioQuality}" preload="metadata"></audio><div class="custom-audio-player"><button class="play-pause-btn"><i class="fas fa-play"></i></button><div class="time-container"><span class="current-time">0:00</span> / <span class="total-duration">0:00</span></div><input type="range" class="seek-bar" value="0" step="1"><a href="audio/${audioItem.file}?quality=standard" download class="download-btn" title="Download Audio"><i class="fas fa-download"></i></a></div></div>`;
             audioGallery.appendChild(card);
         });
         initializeAudioPlayers();
@@ -617,24 +875,45 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     async function loadCommunityView() {
-        const [msgRes, myRes] = await Promise.all([apiFetch('/api/community/messages/approved'), apiFetch('/api/community/message')]);
-        const msgs = await msgRes.json();
+        const [page, myRes] = await Promise.all([fetchPage('/api/community/messages/approved'), apiFetch('/api/community/message')]);
         DOMElements.messageWall.innerHTML = '';
-        msgs.forEach(m => { const c = document.createElement('div'); c.className = 'message-card'; c.innerHTML = `<p>${m}</p>`; DOMElements.messageWall.appendChild(c); });
+        const appendCards = (msgs, sentinel = null) => msgs.forEach(m => { const c = document.createElement('div'); c.className = 'message-card'; c.innerHTML = `<p>${m}</p>`; DOMElements.messageWall.insertBefore(c, sentinel); });
+        appendCards(page.items);
+        lazyLoadPages(DOMElements.messageWall, '/api/community/messages/approved', page.next_cursor, appendCards);
         const myMsg = await myRes.json();
-        if (myMsg.status !== 'not_found') { DOMElements.myMessageTextarea.value = myMsg.text; DOMElements.myMessageStatus.textContent = `Status: ${myMsg.status}`; }
+        if (myMsg.status !== 'not_found') {
+            DOMElements.myMessageTextarea.value = myMsg.text; DOMElements.myMessageStatus.textContent = `Status: ${myMsg.status}`;
+            if (myMsg.status === 'pending') pollMyMessageStatus();
+        }
         else { DOMElements.myMessageStatus.textContent = "You haven't posted yet."; }
     }
 
+    // Pending messages are reviewed in the background; check back until a verdict arrives
+    let myMessagePoll = null;
+    function pollMyMessageStatus(attempt = 0) {
+        clearTimeout(myMessagePoll);
+        if (attempt >= 20) return;
+        myMessagePoll = setTimeout(async () => {
+            if (DOMElements.messageWall.closest('section').classList.contains('hidden')) return;
+            const res = await apiFetch('/api/community/message');
+            const myMsg = await res.json();
+            if (myMsg.status === 'pending') { pollMyMessageStatus(attempt + 1); return; }
+            DOMElements.myMessageStatus.textContent = `Status: ${myMsg.status}. ${myMsg.reason || ''}`;
+            if (myMsg.status === 'approved') loadCommunityView();
+        }, Math.min(3000 * (attempt + 1), 15000));
+    }
+
     async function handleSaveMyMessage() {
         const text = DOMElements.myMessageTextarea.value.trim();
         if (!text) { alert('Message cannot be empty.'); return; }
         toggleLoading(DOMElements.saveMyMessageBtn, true, "Reviewing...");
         try {
             const r = await apiFetch('/api/community/message', { method: 'POST', body: { message_text: text } });
+            if (!r.ok) { DOMElements.myMessageStatus.textContent = await errorMessage(r, "Could not submit your message."); return; }
             const d = await r.json();
-            DOMElements.myMessageStatus.textContent = `Status: ${d.status}. ${d.reason || ''}`;
-            loadCommunityView(); // Refresh the wall to show the new message if approved
+            DOMElements.myMessageStatus.textContent = d.status === 'pending' ? 'Status: pending. Your message is being reviewed.' : `Status: ${d.status}. ${d.reason || ''}`;
+            if (d.status === 'pending') pollMyMessageStatus();
+            else loadCommunityView(); // Refresh the wall to show the new message if approved
         } catch (e) {
             console.error(e);
         } finally {
@@ -668,6 +947,8 @@ document.addEventListener('DOMContentLoaded', () => {
         DOMElements.sendBtn.addEventListener('click', handleSendMessage);
         DOMElements.chatInput.addEventListener('keydown', (e) => { if (e.key === 'Enter' && !e.shiftKey) { e.preventDefault(); handleSendMessage(); } });
         DOMElements.saveJournalBtn.addEventListener('click', saveJournalEntry);
+        DOMElements.journalSearchInput.addEventListener('input', handleJournalSearch);
+        DOMElements.journalLocationInput.addEventListener('input', handleLocationInput);
         DOMElements.deleteJournalBtn.addEventListener('click', deleteJournalEntry);
         DOMElements.reflectJournalBtn.addEventListener('click', reflectOnJournalEntry);
         DOMElements.saveMyMessageBtn.addEventListener('click', handleSaveMyMessage);
@@ -0,0 +1,30 @@
+import os
+import sys
+
+# Before app.py is imported: cheap PIN hashes on the test thread, no rate limits, no moderation thread
+os.environ.setdefault("FLASK_SECRET_KEY", "test")
+os.environ.setdefault("PIN_HASH_METHOD", "pbkdf2:sha256:1000")
+os.environ.setdefault("PIN_HASH_WORKERS", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("MODERATION_WORKER", "external")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as bigsister
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = bigsister.create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}", "TESTING": True})
+    with app.app_context():
+        bigsister.ensure_schema()
+        yield app
+        bigsister.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    assert client.post("/api/signup", json={"username": "tester", "pin": "1234"}).status_code == 201
+    return client
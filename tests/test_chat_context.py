@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import app as bigsister
+
+
+def long_session(app, turns):
+    user = bigsister.User(username="talker", pin_hash="x")
+    chat_session = bigsister.ChatSession(name="Long one", user=user)
+    bigsister.db.session.add(chat_session)
+    bigsister.db.session.flush()
+    bigsister.db.session.execute(bigsister.db.insert(bigsister.ChatMessage.__table__), [
+        {"session_id": chat_session.id, "role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i}",
+         "timestamp": datetime.utcnow()}
+        for i in range(turns)])
+    bigsister.db.session.commit()
+    return chat_session
+
+
+def test_a_long_unsummarized_session_is_folded_in_order(app):
+    chat_session = long_session(app, 10 * bigsister.CHAT_HISTORY_MAX_MESSAGES)
+    ids = [m.id for m in bigsister.ChatMessage.query.order_by(bigsister.ChatMessage.id)]
+
+    folded = []
+    while True:
+        history, fold = bigsister.load_chat_context(chat_session)
+        if not fold: break
+        assert len(history) <= bigsister.CHAT_HISTORY_MAX_MESSAGES + 1
+        folded += [m["id"] for m in fold]
+        # what refresh_session_summary stores once the model has summarized the fold
+        chat_session.summary, chat_session.summarized_through_id = f"summary through {fold[-1]['id']}", fold[-1]["id"]
+
+    # every turn is either summarized or still in the window, and none twice
+    window = ids[len(folded):]
+    assert folded == ids[:len(folded)]
+    assert [m["content"] for m in history[1:]] == [f"turn {ids.index(i)}" for i in window]
+    assert len(window) <= bigsister.CHAT_HISTORY_MAX_MESSAGES
+
+
+def test_a_short_session_is_not_folded(app):
+    chat_session = long_session(app, bigsister.CHAT_HISTORY_MAX_MESSAGES)
+    history, fold = bigsister.load_chat_context(chat_session)
+    assert fold == [] and len(history) == bigsister.CHAT_HISTORY_MAX_MESSAGES
@@ -0,0 +1,15 @@
+import pytest
+
+import app as bigsister
+
+
+@pytest.mark.parametrize("text", [42, 4.2, True, ["hi"], {"text": "hi"}, None, "", "   "])
+def test_bad_wall_messages_are_rejected(client, text):
+    assert client.post("/api/community/message", json={"message_text": text}).status_code == 400
+    assert bigsister.CommunityMessage.query.count() == 0
+
+
+def test_undecided_wall_message_is_queued(client):
+    response = client.post("/api/community/message", json={"message_text": "Keep going, you are doing great"})
+    assert response.status_code == 200 and response.get_json()["status"] in ("pending", "approved", "rejected")
+    assert bigsister.CommunityMessage.query.one().text == "Keep going, you are doing great"
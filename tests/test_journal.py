@@ -0,0 +1,65 @@
+import pytest
+
+import app as bigsister
+
+
+def new_entry(client, **fields):
+    return client.post("/api/journal", json={"title": "Walk", "content": "A long walk.", "mood": "Happy", **fields})
+
+
+@pytest.mark.parametrize("point", [
+    {"lat": "45.1", "lng": 10.0},
+    {"lat": float("nan"), "lng": 10.0},
+    {"lat": 45.0, "lng": float("inf")},
+    {"lat": 1000, "lng": 5000},
+    {"lat": True, "lng": 10.0},
+    {"lat": 45.0},
+])
+def test_bad_coordinates_are_rejected(client, point):
+    response = new_entry(client, **point)
+    assert response.status_code == 400
+    assert "lat" in response.get_json()["error"] or "lng" in response.get_json()["error"]
+    assert bigsister.HeatmapCell.query.count() == 0
+
+    entry_id = new_entry(client).get_json()["id"]
+    assert client.put(f"/api/journal/{entry_id}", json=point).status_code == 400
+
+
+def test_valid_pin_lands_on_the_heatmap(client):
+    assert new_entry(client, lat=53.5, lng=-113.5, location="Edmonton").status_code == 201
+    assert bigsister.HeatmapCell.query.filter_by(level=bigsister.HEATMAP_LEVELS[0]).one().count == 1
+
+
+@pytest.mark.parametrize("fields", [
+    {"location": 123},
+    {"location": ["Paris"]},
+    {"location": "x" * 101},
+    {"location": "Paris", "lat": "48.85", "lng": "2.35"},
+])
+def test_bad_locations_are_rejected(client, fields):
+    assert new_entry(client, **fields).status_code == 400
+
+    entry_id = new_entry(client, location="Paris").get_json()["id"]
+    assert client.put(f"/api/journal/{entry_id}", json=fields).status_code == 400
+    assert client.get(f"/api/journal/{entry_id}").get_json()["location"] == "Paris"
+
+
+def test_named_place_is_geocoded(client):
+    entry_id = new_entry(client, location="Paris").get_json()["id"]
+    entry = client.get(f"/api/journal/{entry_id}").get_json()
+    assert entry["lat"] == pytest.approx(48.85, abs=0.1) and entry["lng"] == pytest.approx(2.35, abs=0.1)
+
+
+def test_put_moves_and_renames_places(client):
+    entry_id = new_entry(client, location="Paris").get_json()["id"]
+    client.put(f"/api/journal/{entry_id}", json={"location": "Edmonton"})
+    entry = client.get(f"/api/journal/{entry_id}").get_json()
+    assert entry["location"].startswith("Edmonton") and entry["lat"] == pytest.approx(53.5, abs=0.2)
+
+    client.put(f"/api/journal/{entry_id}", json={"title": "Renamed"})
+    assert client.get(f"/api/journal/{entry_id}").get_json()["lat"] == entry["lat"]
+
+    client.put(f"/api/journal/{entry_id}", json={"location": ""})
+    entry = client.get(f"/api/journal/{entry_id}").get_json()
+    assert (entry["location"], entry["lat"], entry["lng"]) == (None, None, None)
+    assert bigsister.HeatmapCell.query.filter(bigsister.HeatmapCell.count > 0).count() == 0